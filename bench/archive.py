@@ -0,0 +1,176 @@
+"""Живая таблица и скорость отчётов до и после переноса старых трат в архив.
+
+Запуск из корня репозитория::
+
+    python -m bench.archive
+    python -m bench.archive --rows 200000 --years 3 --keep-days 365
+
+В базу кладётся ``--rows`` трат за ``--years`` лет: один большой счёт,
+ради которого и меряются отчёты, и много мелких. Затем до и после прохода
+ArchiveJob печатаются размер живых таблиц (по dbstat, без свободных
+страниц), размер архива и время отчётов: запрос /report за разные периоды,
+/trends за 90 дней и первая и глубокая страница /history.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp.name}/bench.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "py"))
+
+from sqlalchemy import func, select, text  # noqa: E402
+
+from analytics import load_series  # noqa: E402
+from archive import ArchiveJob  # noqa: E402
+from constants import DEFAULT_CATEGORIES  # noqa: E402
+from db import archive as tiering  # noqa: E402
+from db.database import AsyncSessionLocal, Base, engine  # noqa: E402
+from db.expenses import insert_expenses  # noqa: E402
+from db.migrations import upgrade  # noqa: E402
+from db.models import Account, FxRate, User  # noqa: E402
+from history import HistoryPage, fetch_page  # noqa: E402
+
+ACCOUNT_ID = 1
+SMALL_ACCOUNTS = 500
+INSERT_BATCH = 20000
+CURRENCIES = ["RUB", "USD", "EUR"]
+REPORT_DAYS = [30, 365, 10000]
+
+# Таблица и её индексы в dbstat; FTS-таблицы поиска — отдельной строкой
+LIVE_TABLES = {
+    "expenses": ("expenses", "ix_expenses_account_created", "ix_expenses_user_created"),
+    "поиск (FTS)": ("expenses_fts_data", "expenses_fts_idx", "expenses_fts_docsize", "expenses_fts_config",
+                    "expenses_fts_content"),
+    "daily_category_totals": ("daily_category_totals", "sqlite_autoindex_daily_category_totals_1"),
+    "monthly_category_totals": ("monthly_category_totals", "sqlite_autoindex_monthly_category_totals_1"),
+}
+
+
+async def seed(rows: int, years: int):
+    rng = random.Random(1)
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as session:
+        session.add_all(Account(id=i, code=f"bench{i}", password="-") for i in range(1, SMALL_ACCOUNTS + 2))
+        session.add(User(tg_id=1, account_id=ACCOUNT_ID))
+        await session.commit()
+
+        # Как при обычной работе: id растут вместе с датой
+        span = years * 365 * 86400
+        moments = sorted(rng.randint(0, span) for _ in range(rows))
+        for offset in range(0, rows, INSERT_BATCH):
+            await insert_expenses(session, [
+                dict(
+                    user_id=1,
+                    account_id=ACCOUNT_ID if rng.random() < 0.2 else rng.randint(2, SMALL_ACCOUNTS + 1),
+                    amount=round(rng.lognormvariate(6, 1), 2),
+                    currency=rng.choice(CURRENCIES),
+                    category=rng.choice(DEFAULT_CATEGORIES),
+                    comment="",
+                    created_at=now - timedelta(seconds=span - moment),
+                )
+                for moment in moments[offset:offset + INSERT_BATCH]
+            ])
+        await session.commit()
+
+
+async def sizes(session) -> dict[str, tuple[int, float]]:
+    result = {}
+    for title, names in LIVE_TABLES.items():
+        placeholders = ", ".join(f"'{name}'" for name in names)
+        size = await session.scalar(text(
+            f"SELECT coalesce(sum(pgsize), 0) FROM dbstat('main') WHERE name IN ({placeholders})"
+        ))
+        count = await session.scalar(text(f"SELECT count(*) FROM {names[0]}")) if "fts" not in names[0] else None
+        result[title] = (count, size / 2 ** 20)
+    archived = await session.scalar(text("SELECT coalesce(sum(pgsize), 0) FROM dbstat('archive')"))
+    result["архив (отдельный файл)"] = (await session.scalar(text("SELECT count(*) FROM archive.expenses")),
+                                        archived / 2 ** 20)
+    return result
+
+
+async def timed(coro_factory, repeat: int) -> float:
+    values = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await coro_factory()
+        values.append((time.perf_counter() - started) * 1000)
+    return statistics.median(values)
+
+
+async def report_query(session, days: int):
+    # Тот же запрос, что в generate_expense_report
+    since = (datetime.utcnow() - timedelta(days=days)).date()
+    totals = tiering.category_totals(f"account:{ACCOUNT_ID}", since)
+    await session.execute(
+        select(totals.c.category, func.sum(totals.c.total / func.coalesce(FxRate.rate, 1.0)))
+        .outerjoin(FxRate, FxRate.currency == totals.c.currency)
+        .group_by(totals.c.category)
+    )
+
+
+async def latencies(session, repeat: int) -> dict[str, float]:
+    result = {}
+    for days in REPORT_DAYS:
+        result[f"/report {days} дн."] = await timed(lambda: report_query(session, days), repeat)
+
+    until = datetime.utcnow().date()
+    result["/trends 90 дн."] = await timed(
+        lambda: load_series(session, f"account:{ACCOUNT_ID}", until - timedelta(days=89), until, 1.0), repeat
+    )
+    result["/history 1-я стр."] = await timed(lambda: fetch_page(session, ACCOUNT_ID, 1), repeat)
+    # Глубокая страница — из самого старого года, после переноса она в архиве
+    # «Новее начала эпохи» — самая старая страница
+    deep = HistoryPage(older=False, at=0, id=0)
+    result["/history старая стр."] = await timed(lambda: fetch_page(session, ACCOUNT_ID, 1, deep), repeat)
+    session.expunge_all()
+    return result
+
+
+def print_state(title: str, table_sizes: dict, timings: dict):
+    print(f"\n{title}")
+    for name, (count, size) in table_sizes.items():
+        rows = f"{count:>9} строк" if count is not None else " " * 15
+        print(f"  {name:<26} {rows} {size:8.1f} МБ")
+    for name, value in timings.items():
+        print(f"  {name:<26} медиана {value:7.2f} мс")
+
+
+async def main(rows: int, years: int, keep_days: int, repeat: int):
+    tiering.ARCHIVE_AFTER_DAYS = keep_days
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade)
+    started = time.perf_counter()
+    await seed(rows, years)
+    print(f"трат: {rows} за {years} г., заполнение {time.perf_counter() - started:.1f} с; "
+          f"в архив уходит всё раньше {tiering.archive_cutoff(datetime.utcnow().date())}")
+
+    async with AsyncSessionLocal() as session:
+        print_state("до архивации", await sizes(session), await latencies(session, repeat))
+
+    started = time.perf_counter()
+    moved = await ArchiveJob(pause=0).run_pass()
+    elapsed = time.perf_counter() - started
+    print(f"\nпроход ArchiveJob без пауз: {moved} трат за {elapsed:.1f} с ({moved / elapsed:.0f} трат/с)")
+
+    async with AsyncSessionLocal() as session:
+        print_state("после архивации", await sizes(session), await latencies(session, repeat))
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--keep-days", type=int, default=365, help="ARCHIVE_AFTER_DAYS для замера")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.years, args.keep_days, args.repeat))
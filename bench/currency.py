@@ -0,0 +1,142 @@
+"""Отчёт по тратам в нескольких валютах: перевод в SQL и в Python, сколько стоит смесь валют.
+
+Запуск из корня репозитория::
+
+    python -m bench.currency
+    python -m bench.currency --rows 1000000 --currencies 1 5 26
+
+Для каждого числа из ``--currencies`` заводится счёт с ``--rows`` тратами
+за год в стольких валютах из POPULAR_CURRENCIES, и ещё одна доля трат —
+в валюте без курса (XXX). Отчёт за год по category_totals меряется тремя
+способами: без перевода (нижняя граница), с переводом в SQL, как в
+/report, — делением на coalesce(FxRate.rate, base_rate), — и с
+группировкой по валюте и fx_rates.convert в Python, как в дайджесте.
+Итоги двух переводов сверяются: так проверяется, что валюту без курса оба
+пути считают одинаково — не пересчитывая.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp.name}/bench.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "py"))
+
+from sqlalchemy import func, insert, select  # noqa: E402
+
+from constants import DEFAULT_CATEGORIES, POPULAR_CURRENCIES  # noqa: E402
+from db.archive import category_totals  # noqa: E402
+from db.database import AsyncSessionLocal, Base, engine  # noqa: E402
+from db.migrations import upgrade  # noqa: E402
+from db.models import Account, Expense, FxRate, User  # noqa: E402
+from db.rollup import rebuild_daily_totals  # noqa: E402
+from fx import fx_rates, refresh_rates  # noqa: E402
+from report_cache import report_since  # noqa: E402
+
+INSERT_BATCH = 50000
+BASE = "RUB"
+UNKNOWN = "XXX"
+# Доля трат в валюте без курса
+UNKNOWN_SHARE = 0.05
+
+
+async def seed(account_id: int, rows: int, currencies: list[str]):
+    rng = random.Random(account_id)
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as session:
+        session.add(Account(id=account_id, code=f"bench{account_id}", password="-"))
+        session.add(User(tg_id=account_id, account_id=account_id))
+        await session.commit()
+        for offset in range(0, rows, INSERT_BATCH):
+            await session.execute(insert(Expense), [
+                dict(user_id=account_id, account_id=account_id, amount=round(rng.lognormvariate(6, 1), 2),
+                     currency=UNKNOWN if rng.random() < UNKNOWN_SHARE else rng.choice(currencies),
+                     category=rng.choice(DEFAULT_CATEGORIES), comment="",
+                     created_at=now - timedelta(seconds=rng.randint(0, 365 * 86400)))
+                for _ in range(min(INSERT_BATCH, rows - offset))
+            ])
+            await session.commit()
+
+
+async def plain(session, scope: str, since) -> dict:
+    totals = category_totals(scope, since)
+    rows = await session.execute(select(totals.c.category, func.sum(totals.c.total)).group_by(totals.c.category))
+    return dict(rows.all())
+
+
+async def in_sql(session, scope: str, since) -> dict:
+    # Как в /report: bot.generate_expense_report
+    base_rate = fx_rates.rate(BASE)
+    totals = category_totals(scope, since)
+    rows = await session.execute(
+        select(totals.c.category, func.sum(totals.c.total / func.coalesce(FxRate.rate, base_rate)))
+        .outerjoin(FxRate, FxRate.currency == totals.c.currency)
+        .group_by(totals.c.category)
+    )
+    return {category: total * base_rate for category, total in rows}
+
+
+async def in_python(session, scope: str, since) -> dict:
+    # Как в дайджесте: суммы по категории и валюте, перевод через fx_rates.convert
+    totals = category_totals(scope, since)
+    rows = await session.execute(
+        select(totals.c.category, totals.c.currency, func.sum(totals.c.total))
+        .group_by(totals.c.category, totals.c.currency)
+    )
+    categories = defaultdict(float)
+    for category, currency, total in rows:
+        categories[category] += fx_rates.convert(total, currency, BASE)
+    return dict(categories)
+
+
+async def timed(query, scope: str, since, repeat: int) -> tuple[float, dict]:
+    values = []
+    async with AsyncSessionLocal() as session:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = await query(session, scope, since)
+            values.append((time.perf_counter() - started) * 1000)
+    return statistics.median(values), result
+
+
+async def main(rows: int, currency_counts: list[int], repeat: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade)
+    await refresh_rates()
+    for account_id, n in enumerate(currency_counts, start=1):
+        # Базовая валюта всегда среди валют трат
+        await seed(account_id, rows, [BASE] + [c for c in POPULAR_CURRENCIES if c != BASE][:n - 1])
+    async with engine.begin() as conn:
+        await conn.run_sync(rebuild_daily_totals)
+
+    since = report_since(365)
+    print(f"трат на счёт: {rows}, из них в {UNKNOWN} (без курса): {UNKNOWN_SHARE:.0%}; "
+          f"отчёт за год в {BASE}, мс, медиана")
+    print(f"{'валют':>5} | {'без перевода':>12} | {'перевод в SQL':>13} | {'перевод в Python':>16}")
+    for account_id, n in enumerate(currency_counts, start=1):
+        scope = f"account:{account_id}"
+        plain_ms, _ = await timed(plain, scope, since, repeat)
+        sql_ms, sql = await timed(in_sql, scope, since, repeat)
+        python_ms, python = await timed(in_python, scope, since, repeat)
+        assert sql.keys() == python.keys(), (sql, python)
+        assert all(abs(sql[c] - python[c]) < 1e-6 * max(1.0, sql[c]) for c in sql), (sql, python)
+        print(f"{n:>5} | {plain_ms:>12.2f} | {sql_ms:>13.2f} | {python_ms:>16.2f}")
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--currencies", type=int, nargs="+", default=[1, 3, 10, 26])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.currencies, args.repeat))
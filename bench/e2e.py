@@ -0,0 +1,395 @@
+"""Сквозной замер бота: сценарии пользователей против поддельного Bot API.
+
+Запуск из корня репозитория::
+
+    python -m bench.e2e
+    python -m bench.e2e --users 200 --rounds 3 --output e2e.json
+    python -m bench.e2e --compare e2e-old.json
+
+В отдельном процессе поднимаются поддельный Bot API (отвечает на любой
+метод правдоподобным ``Message``) и заглушка numbersapi; бот работает как
+в webhook-режиме: апдейты подаются в ``dp.feed_raw_update``, а всё, что он
+отправляет, уходит по HTTP в поддельный API. База — временная копия
+``--db`` или заново заполненная синтетическими тратами.
+
+Каждый пользователь по кругу проходит сценарий: /add целиком, /report за
+каждый период из ``report_keyboard``, /last, вход в общий счёт и выход из
+него. Для каждого шага считаются p50/p95/p99, общая пропускная способность
+пишется в JSON вместе с коммитом, чтобы сравнивать прогоны между собой.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCH_TOKEN = "123456:bench"
+ACCOUNT_PASSWORD = "bench"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def fake_bot_api(latency: float = 0, updates: list[dict] | None = None, record: bool = False):
+    """Поддельный Bot API (aiohttp-приложение): на любой метод отвечает
+    правдоподобным ``Message``. ``updates`` отдаются боту на первый getUpdates.
+
+    В ``app["calls"]`` — число вызовов каждого метода, при ``record`` в
+    ``app["requests"]`` ещё и сами запросы (метод, поля). Числа, положенные в
+    ``app["flood"]``, — retry_after для ближайших запросов: на них API
+    отвечает 429, как Telegram при превышении лимитов. Используется и
+    тестами (tests/).
+    """
+    import itertools
+
+    from aiohttp import web
+
+    message_ids = itertools.count(1)
+    pending = list(updates or [])
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app["calls"] = calls = {}
+    app["first_call"] = first_call = {}
+    app["requests"] = requests = []
+    app["flood"] = flood = []
+
+    async def bot_method(request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        calls[method] = calls.get(method, 0) + 1
+        first_call.setdefault(method, time.time())
+        if request.content_type.startswith("multipart"):
+            data = {}
+            async for part in await request.multipart():
+                payload = await part.read()
+                if not part.filename:
+                    data[part.name] = payload.decode()
+        else:
+            data = dict(await request.post())
+        if record:
+            requests.append((method, data))
+        if latency:
+            await asyncio.sleep(latency)
+
+        if flood and method.startswith("send"):
+            retry_after = flood.pop(0)
+            return web.json_response({"ok": False, "error_code": 429,
+                                      "description": f"Too Many Requests: retry after {retry_after}",
+                                      "parameters": {"retry_after": retry_after}}, status=429)
+        if method in ("answerCallbackQuery", "setWebhook", "deleteWebhook", "setMyCommands"):
+            return web.json_response({"ok": True, "result": True})
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {"id": 123456, "is_bot": True, "first_name": "bench",
+                                                             "username": "bench_bot"}})
+        if method == "getUpdates":
+            if not pending:
+                # Long polling: новых апдейтов нет, отвечаем не сразу
+                await asyncio.sleep(min(float(data.get("timeout") or 0), 1))
+            result, pending[:] = pending[:], []
+            return web.json_response({"ok": True, "result": result})
+        message_id = next(message_ids)
+        result = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(data.get("chat_id") or 0), "type": "private"},
+            "text": data.get("text", ""),
+        }
+        if method in ("sendPhoto", "sendDocument"):
+            result["photo"] = [{"file_id": f"photo{message_id}", "file_unique_id": f"u{message_id}",
+                                "width": 800, "height": 600}]
+        return web.json_response({"ok": True, "result": result})
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response({"calls": calls, "first_call": first_call})
+
+    app.router.add_post("/bot{token}/{method}", bot_method)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+def _serve_fakes(api_port: int, facts_port: int, latency: float, updates: list[dict] | None = None):
+    """Поддельный Bot API и заглушка фактов; работают в своём процессе,
+    чтобы не отнимать event loop у бота."""
+    from aiohttp import web
+
+    async def fact(request: web.Request) -> web.Response:
+        if latency:
+            await asyncio.sleep(latency)
+        return web.Response(text=f"{request.match_info['number']} is a number from the benchmark stub.")
+
+    async def main():
+        api = fake_bot_api(latency, updates)
+        facts = web.Application()
+        facts.router.add_get("/{number}", fact)
+        for app, port in ((api, api_port), (facts, facts_port)):
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", port).start()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def _wait_for_port(port: int, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"порт {port} так и не открылся")
+
+
+def _configure(db_path: Path, api_port: int, facts_port: int, telegram_limits: bool):
+    # До импорта бота: настройки читаются при импорте модулей
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{db_path}"
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{api_port}"
+    os.environ["FACTS_API_URL"] = f"http://127.0.0.1:{facts_port}"
+    os.environ.pop("FX_RATES_URL", None)
+    os.environ.pop("METRICS_PORT", None)
+    if not telegram_limits:
+        # Иначе задержку шагов определяет лимит «сообщение в секунду на чат»
+        os.environ.setdefault("SEND_CHAT_RATE", "1000")
+        os.environ.setdefault("SEND_CHAT_BURST", "1000")
+        os.environ.setdefault("SEND_GLOBAL_RATE", "100000")
+    sys.path.insert(0, str(ROOT / "py"))
+    sys.path.insert(0, str(ROOT))
+    try:
+        import config  # noqa: F401
+    except ImportError:
+        # config.py с настоящим токеном есть только у того, кто запускает бота
+        config = types.ModuleType("config")
+        config.BOT_TOKEN = BENCH_TOKEN
+        sys.modules["config"] = config
+
+
+async def seed(users: int, accounts: int, history: int):
+    from constants import DEFAULT_CATEGORIES
+    from db.database import AsyncSessionLocal
+    from db.expenses import insert_expenses
+    from db.models import Account, User
+
+    rng = random.Random(1)
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as session:
+        session.add_all(Account(id=i, code=f"BENCH{i}", password=ACCOUNT_PASSWORD) for i in range(1, accounts + 1))
+        session.add_all(User(tg_id=tg_id) for tg_id in range(1, users + 1))
+        await session.flush()
+        rows = []
+        for tg_id in range(1, users + 1):
+            for _ in range(history):
+                rows.append(dict(
+                    user_id=tg_id,
+                    # Половина истории — в общем счёте, куда пользователь будет входить
+                    account_id=tg_id % accounts + 1 if rng.random() < 0.5 else None,
+                    amount=round(rng.uniform(50, 5000), 2),
+                    currency=rng.choice(["RUB", "RUB", "USD", "EUR"]),
+                    category=rng.choice(DEFAULT_CATEGORIES),
+                    comment="",
+                    created_at=now - timedelta(days=rng.uniform(0, 365)),
+                ))
+        await insert_expenses(session, rows)
+        await session.commit()
+
+
+def session_script(tg_id: int, accounts: int, rng: random.Random) -> list[tuple[str, str]]:
+    """Шаги одного круга: (метка для статистики, текст сообщения)."""
+    from constants import report_keyboard
+
+    periods = [button.text for row in report_keyboard.keyboard for button in row if button.text != "Отменить"]
+    steps = [
+        ("add", "/add"),
+        ("add_amount", str(rng.choice([100, 250, 999, 1500, rng.randint(1, 100000)]))),
+        ("add_currency", rng.choice(["RUB", "USD", "EUR"])),
+        ("add_category", rng.choice(["Еда", "Транспорт", "Дом"])),
+        ("add_comment", "Пропустить"),
+    ]
+    for period in periods:
+        steps += [("report", "/report"), (f"report {period}", period)]
+    steps += [
+        ("last", "/last"),
+        ("settings", "Настройки"),
+        ("join_start", "Подключиться к существующему счету"),
+        ("join", f"BENCH{tg_id % accounts + 1} {ACCOUNT_PASSWORD}"),
+        ("settings", "Настройки"),
+        ("leave", "Покинуть текущий счет"),
+    ]
+    return steps
+
+
+class Session:
+    update_ids = iter(range(1, 1 << 62))
+
+    def __init__(self, tg_id: int):
+        self.tg_id = tg_id
+        self.message_ids = iter(range(1, 1 << 62))
+
+    def update(self, text: str) -> dict:
+        user = {"id": self.tg_id, "is_bot": False, "first_name": f"bench{self.tg_id}"}
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": self.tg_id, "type": "private"},
+            "from": user,
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self.update_ids), "message": message}
+
+
+async def run_user(dp, bot, tg_id: int, accounts: int, rounds: int, samples: dict, errors: list):
+    rng = random.Random(tg_id)
+    session = Session(tg_id)
+    for label, text in [("start", "/start")] + session_script(tg_id, accounts, rng) * rounds:
+        started = time.perf_counter()
+        try:
+            await dp.feed_raw_update(bot, session.update(text))
+        except Exception as e:
+            errors.append(f"{label}: {e!r}")
+            continue
+        samples.setdefault(label, []).append(time.perf_counter() - started)
+
+
+def percentiles(values: list[float]) -> dict:
+    ms = sorted(v * 1000 for v in values)
+    q = statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else ms * 99
+    return {
+        "count": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 3),
+        "p50_ms": round(q[49], 3),
+        "p95_ms": round(q[94], 3),
+        "p99_ms": round(q[98], 3),
+        "max_ms": round(ms[-1], 3),
+    }
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result: dict, previous: dict | None):
+    print(f"апдейтов: {result['updates']}, ошибок: {result['errors']}, {result['wall_s']:.1f} с, "
+          f"{result['throughput_rps']:.1f} апдейт/с")
+    header = f"{'шаг':<28}{'n':>7}{'p50':>10}{'p95':>10}{'p99':>10}"
+    if previous:
+        header += f"{'p95 было':>12}{'Δ':>8}"
+    print(header)
+    for label, stats in result["handlers"].items():
+        line = f"{label:<28}{stats['count']:>7}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+        old = (previous or {}).get("handlers", {}).get(label)
+        if old:
+            line += f"{old['p95_ms']:>12.1f}{(stats['p95_ms'] - old['p95_ms']) / old['p95_ms']:>+8.0%}"
+        print(line)
+    print("вызовы Bot API:", ", ".join(f"{m}={n}" for m, n in sorted(result["bot_api_calls"].items())))
+
+
+async def main(args):
+    import aiohttp
+
+    import bot as app
+    from db.database import engine
+
+    await app.init_db()
+    if not args.db:
+        started = time.perf_counter()
+        await seed(args.users, args.accounts, args.history)
+        print(f"база заполнена за {time.perf_counter() - started:.1f} с: {args.users} пользователей, "
+              f"{args.users * args.history} трат")
+
+    bot = app.create_bot()
+    dp = app.build_dispatcher()
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+
+    samples: dict[str, list[float]] = {}
+    errors: list[str] = []
+    started = time.perf_counter()
+    try:
+        # Не больше --concurrency пользователей одновременно
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def limited(tg_id: int):
+            async with semaphore:
+                await run_user(dp, bot, tg_id, args.accounts, args.rounds, samples, errors)
+
+        await asyncio.gather(*(limited(tg_id) for tg_id in range(1, args.users + 1)))
+        wall = time.perf_counter() - started
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+        await engine.dispose()
+
+    async with aiohttp.ClientSession() as http:
+        async with http.get(f"{os.environ['TELEGRAM_API_URL']}/stats") as response:
+            calls = (await response.json())["calls"]
+
+    updates = sum(len(v) for v in samples.values())
+    return {
+        "commit": _commit(),
+        "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "updates": updates,
+        "errors": len(errors),
+        "error_samples": errors[:10],
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(updates / wall, 2),
+        "handlers": {label: percentiles(values) for label, values in samples.items()},
+        "bot_api_calls": calls,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50, help="пользователей одновременно")
+    parser.add_argument("--rounds", type=int, default=2, help="сколько раз каждый проходит сценарий")
+    parser.add_argument("--accounts", type=int, default=10, help="общих счетов для входа/выхода")
+    parser.add_argument("--history", type=int, default=500, help="трат на пользователя при заполнении")
+    parser.add_argument("--db", help="готовая база expenses.db; используется её копия")
+    parser.add_argument("--api-latency", type=float, default=0, help="задержка ответов заглушек, мс")
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="не снимать лимиты отправки (1 сообщение в секунду на чат)")
+    parser.add_argument("--output", default="e2e.json")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения p95")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    db_path = Path(tmp.name) / "expenses.db"
+    if args.db:
+        shutil.copyfile(args.db, db_path)
+
+    api_port, facts_port = _free_port(), _free_port()
+    fakes = multiprocessing.Process(target=_serve_fakes, args=(api_port, facts_port, args.api_latency / 1000),
+                                    daemon=True)
+    fakes.start()
+    try:
+        _wait_for_port(api_port)
+        _wait_for_port(facts_port)
+        _configure(db_path, api_port, facts_port, args.telegram_limits)
+        result = asyncio.run(main(args))
+    finally:
+        fakes.terminate()
+        fakes.join()
+
+    previous = json.loads(Path(args.compare).read_text(encoding="utf-8")) if args.compare else None
+    print_report(result, previous)
+    Path(args.output).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"результаты сохранены в {args.output}")
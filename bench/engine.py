@@ -0,0 +1,143 @@
+"""Пропускная способность SQLite при одновременных /add и /report: прежние настройки и SQLITE_PRAGMAS.
+
+Запуск из корня репозитория::
+
+    python -m bench.engine
+    python -m bench.engine --writers 10 --readers 10 --seconds 10
+
+``--writers`` корутин добавляют траты по одной, каждая в своей
+транзакции вместе с дневными суммами, как add_expense без очереди
+ExpenseWriter. ``--readers`` корутин в это же время строят отчёт по
+category_totals за 30 дней. Прогон повторяется с настройками соединения
+«как было» (журнал DELETE, synchronous=FULL, кэш и mmap по умолчанию) и
+с SQLITE_PRAGMAS из db/database.py. Печатаются записи и отчёты в секунду и
+задержка отчёта p50/p99, а также сколько раз запрос упал с «database is
+locked». Запросы не логируются (echo выключен) в обоих прогонах.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp.name}/bench.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "py"))
+
+from sqlalchemy import func, select  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from constants import DEFAULT_CATEGORIES  # noqa: E402
+from db import database  # noqa: E402
+from db.archive import category_totals  # noqa: E402
+from db.database import AsyncSessionLocal, Base, engine  # noqa: E402
+from db.expenses import insert_expenses  # noqa: E402
+from db.migrations import upgrade  # noqa: E402
+from db.models import Account, FxRate, User  # noqa: E402
+from report_cache import report_since  # noqa: E402
+
+ACCOUNTS = 20
+HISTORY = 100000
+INSERT_BATCH = 20000
+# Значения SQLite по умолчанию — так соединения открывались до SQLITE_PRAGMAS
+DEFAULT_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL", "cache_size": "-2000", "mmap_size": "0"}
+PROFILES = [("как было", DEFAULT_PRAGMAS), ("SQLITE_PRAGMAS", dict(database.SQLITE_PRAGMAS))]
+
+
+def make_row(rng: random.Random, account_id: int, created_at: datetime) -> dict:
+    return dict(user_id=account_id, account_id=account_id, amount=round(rng.lognormvariate(6, 1), 2),
+                currency=rng.choice(["RUB", "USD", "EUR"]), category=rng.choice(DEFAULT_CATEGORIES),
+                comment="", created_at=created_at)
+
+
+async def seed():
+    rng = random.Random(1)
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as session:
+        session.add_all(Account(id=i, code=f"bench{i}", password="-") for i in range(1, ACCOUNTS + 1))
+        session.add_all(User(tg_id=i, account_id=i) for i in range(1, ACCOUNTS + 1))
+        session.add(FxRate(currency="RUB", rate=90.0))
+        await session.commit()
+        for _ in range(0, HISTORY, INSERT_BATCH):
+            await insert_expenses(session, [
+                make_row(rng, rng.randint(1, ACCOUNTS), now - timedelta(days=rng.uniform(0, 365)))
+                for _ in range(INSERT_BATCH)
+            ])
+            await session.commit()
+
+
+async def writer(rng: random.Random, deadline: float, counts: dict):
+    while time.perf_counter() < deadline:
+        try:
+            async with AsyncSessionLocal() as session:
+                await insert_expenses(session, [make_row(rng, rng.randint(1, ACCOUNTS), datetime.utcnow())])
+                await session.commit()
+        except OperationalError:
+            # database is locked: busy_timeout истёк или читатель не дал записать
+            counts["locked"] += 1
+        else:
+            counts["writes"] += 1
+
+
+async def reader(rng: random.Random, deadline: float, counts: dict, latencies: list[float]):
+    while time.perf_counter() < deadline:
+        totals = category_totals(f"account:{rng.randint(1, ACCOUNTS)}", report_since(30))
+        started = time.perf_counter()
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    select(totals.c.category, func.sum(totals.c.total / func.coalesce(FxRate.rate, 1.0)))
+                    .outerjoin(FxRate, FxRate.currency == totals.c.currency)
+                    .group_by(totals.c.category)
+                )
+        except OperationalError:
+            counts["locked"] += 1
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+
+
+async def run(writers: int, readers: int, seconds: float) -> tuple[dict, list[float]]:
+    rng = random.Random(2)
+    counts = {"writes": 0, "locked": 0}
+    latencies: list[float] = []
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(
+        *(writer(random.Random(rng.random()), deadline, counts) for _ in range(writers)),
+        *(reader(random.Random(rng.random()), deadline, counts, latencies) for _ in range(readers)),
+    )
+    return counts, latencies
+
+
+async def main(writers: int, readers: int, seconds: float):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade)
+    await seed()
+
+    print(f"писателей: {writers}, читателей: {readers}, {seconds:.0f} с на прогон; отчёт в мс")
+    print(f"{'настройки':>15} | {'трат/с':>7} | {'отчётов/с':>9} | {'отчёт p50':>9} | {'отчёт p99':>9} | "
+          f"{'locked':>6}")
+    for name, pragmas in PROFILES:
+        # Новые соединения пула открываются уже с этими настройками
+        await engine.dispose()
+        database.SQLITE_PRAGMAS.clear()
+        database.SQLITE_PRAGMAS.update(pragmas)
+        counts, latencies = await run(writers, readers, seconds)
+        p99 = statistics.quantiles(latencies, n=100)[-1]
+        print(f"{name:>15} | {counts['writes'] / seconds:>7.0f} | {len(latencies) / seconds:>9.0f} | "
+              f"{statistics.median(latencies):>9.1f} | {p99:>9.1f} | {counts['locked']:>6}")
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=10)
+    parser.add_argument("--readers", type=int, default=10)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.writers, args.readers, args.seconds))
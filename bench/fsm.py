@@ -0,0 +1,116 @@
+"""Переходы FSM в секунду для разных хранилищ состояния.
+
+Запуск из корня репозитория::
+
+    python -m bench.fsm
+    python -m bench.fsm --chats 10 100 1000 --rounds 5
+    python -m bench.fsm --redis redis://localhost:6379/0
+
+Каждый из ``--chats`` чатов одновременно проходит шаги /add: на шаге
+хендлер читает состояние, ставит следующее и дописывает данные, а в конце
+апдейта FsmFlushMiddleware сохраняет изменения. Сравниваются MemoryStorage
+(всё теряется при перезапуске), SQLAlchemyStorage, как сейчас (кэш и одна
+запись на апдейт), тот же SQL без кэша и с записью на каждый вызов — как
+хранилище, которое пишет в базу напрямую, — и Redis, если задан ``--redis``.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp.name}/bench.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "py"))
+
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+
+from db.database import Base, engine  # noqa: E402
+from db.migrations import upgrade  # noqa: E402
+from fsm_storage import SQLAlchemyStorage, create_fsm_storage  # noqa: E402
+
+BOT_ID = 123456
+# Шаги /add: (состояние после шага, что дописывается в данные)
+STEPS = [
+    ("Form:amount", {}),
+    ("Form:currency", {"amount": 250.0}),
+    ("Form:category", {"currency": "RUB"}),
+    ("Form:comment", {"category": "Еда"}),
+    ("Form:menu", {"comment": "кофе"}),
+]
+
+
+class WriteThroughStorage(SQLAlchemyStorage):
+    """Без кэша и с UPSERT на каждый set_state/set_data."""
+
+    def __init__(self):
+        super().__init__(cache_size=0)
+
+    async def set_state(self, key, state=None):
+        await super().set_state(key, state)
+        await self.flush()
+
+    async def set_data(self, key, data):
+        await super().set_data(key, data)
+        await self.flush()
+
+
+async def step(storage, key: StorageKey, state: str, data: dict):
+    # Как при апдейте: фильтр по состоянию, хендлер, запись в конце
+    await storage.get_state(key)
+    await storage.set_state(key, state)
+    await storage.update_data(key, data)
+    if isinstance(storage, SQLAlchemyStorage):
+        await storage.flush()
+
+
+async def run(storage, chats: int, rounds: int) -> tuple[float, list[float]]:
+    latencies: list[float] = []
+
+    async def chat(chat_id: int):
+        key = StorageKey(bot_id=BOT_ID, chat_id=chat_id, user_id=chat_id)
+        for _ in range(rounds):
+            for state, data in STEPS:
+                started = time.perf_counter()
+                await step(storage, key, state, data)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(chat(chat_id) for chat_id in range(1, chats + 1)))
+    return len(latencies) / (time.perf_counter() - started), latencies
+
+
+async def main(chat_counts: list[int], rounds: int, redis_url: str | None):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade)
+
+    storages = [("memory", MemoryStorage), ("sql", SQLAlchemyStorage), ("sql, без кэша", WriteThroughStorage)]
+    if redis_url:
+        storages.append(("redis", lambda: create_fsm_storage(redis_url)))
+
+    print(f"кругов /add на чат: {rounds}; переходов в секунду, шаг в мс p50 / p99")
+    print(f"{'чатов':>6} | " + " | ".join(f"{name:>27}" for name, _ in storages))
+    for chats in chat_counts:
+        cells = []
+        for _, make in storages:
+            storage = make()
+            rate, latencies = await run(storage, chats, rounds)
+            await storage.close()
+            p99 = statistics.quantiles(latencies, n=100)[-1]
+            cells.append(f"{rate:>7.0f}/с {statistics.median(latencies):>7.2f} / {p99:>7.1f}")
+        print(f"{chats:>6} | " + " | ".join(f"{cell:>27}" for cell in cells))
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--redis", help="redis://... — замерить и RedisStorage")
+    args = parser.parse_args()
+    asyncio.run(main(args.chats, args.rounds, args.redis))
@@ -0,0 +1,120 @@
+"""Скорость страницы /history в зависимости от глубины.
+
+Запуск из корня репозитория::
+
+    python -m bench.history
+    python -m bench.history --rows 200000 --offsets 10 10000 100000
+
+В один счёт кладётся ``--rows`` трат (плюс траты других счетов), затем
+для каждой глубины меряется выборка страницы по ключу (created_at, id) —
+так её делает бот — и для сравнения та же страница через OFFSET.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp.name}/bench.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "py"))
+
+from sqlalchemy import insert, select  # noqa: E402
+
+from constants import DEFAULT_CATEGORIES  # noqa: E402
+from db.database import AsyncSessionLocal, Base, engine  # noqa: E402
+from db.expenses import expense_filter  # noqa: E402
+from db.models import Account, Expense, User  # noqa: E402
+from history import HISTORY_PAGE_SIZE, HistoryPage, _boundary, fetch_page  # noqa: E402
+
+ACCOUNT_ID = 1
+OTHER_ACCOUNTS = 9
+INSERT_BATCH = 50000
+
+
+async def seed(rows: int, noise: int):
+    rng = random.Random(1)
+    start = datetime(2015, 1, 1)
+    async with AsyncSessionLocal() as session:
+        session.add_all(Account(id=i, code=f"bench{i}", password="-") for i in range(1, OTHER_ACCOUNTS + 2))
+        session.add(User(tg_id=1, account_id=ACCOUNT_ID))
+        await session.commit()
+
+        total = rows + noise
+        for offset in range(0, total, INSERT_BATCH):
+            batch = []
+            for i in range(offset, min(offset + INSERT_BATCH, total)):
+                batch.append(dict(
+                    user_id=1,
+                    account_id=ACCOUNT_ID if i < rows else rng.randint(2, OTHER_ACCOUNTS + 1),
+                    amount=round(rng.uniform(10, 5000), 2),
+                    currency="RUB",
+                    category=rng.choice(DEFAULT_CATEGORIES),
+                    comment="",
+                    # Секундная точность: у многих трат совпадает created_at, как и в жизни при импорте
+                    created_at=start + timedelta(seconds=rng.randint(0, 10 * 365 * 86400)),
+                ))
+            await session.execute(insert(Expense), batch)
+        await session.commit()
+
+
+def timed(values: list[float]) -> str:
+    return f"медиана {statistics.median(values):7.2f} мс, максимум {max(values):7.2f} мс"
+
+
+async def main(rows: int, noise: int, offsets: list[int], repeat: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    started = time.perf_counter()
+    await seed(rows, noise)
+    print(f"трат в счёте: {rows}, в других счетах: {noise}, заполнение {time.perf_counter() - started:.1f} с")
+
+    where = expense_filter(ACCOUNT_ID, 1)
+    newest_first = (Expense.created_at.desc(), Expense.id.desc())
+    async with AsyncSessionLocal() as session:
+        for offset in offsets:
+            if offset >= rows:
+                print(f"глубина {offset}: в счёте меньше трат, пропускаем")
+                continue
+            # Граница страницы — последняя трата перед нужной глубиной
+            before = await session.scalar(
+                select(Expense).where(where).order_by(*newest_first).offset(offset - 1).limit(1)
+            )
+            cursor = _boundary(before, older=True)
+            HistoryPage.unpack(cursor.pack())  # то же, что придёт в callback_data
+
+            keyset = []
+            for _ in range(repeat):
+                t = time.perf_counter()
+                page = await fetch_page(session, ACCOUNT_ID, 1, cursor)
+                keyset.append((time.perf_counter() - t) * 1000)
+                session.expunge_all()
+
+            by_offset = []
+            for _ in range(repeat):
+                t = time.perf_counter()
+                expected = (await session.scalars(
+                    select(Expense).where(where).order_by(*newest_first).offset(offset).limit(HISTORY_PAGE_SIZE)
+                )).all()
+                by_offset.append((time.perf_counter() - t) * 1000)
+                session.expunge_all()
+
+            same = [e.id for e in page.expenses] == [e.id for e in expected]
+            print(f"глубина {offset:>8}: по ключу {timed(keyset)} | OFFSET {timed(by_offset)}"
+                  f"{'' if same else '  РАСХОЖДЕНИЕ'}")
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000100)
+    parser.add_argument("--noise", type=int, default=200000, help="трат в других счетах")
+    parser.add_argument("--offsets", type=int, nargs="+", default=[10, 10000, 1000000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.noise, args.offsets, args.repeat))
@@ -0,0 +1,137 @@
+"""Разбивка /members на общих счетах с разным числом участников.
+
+Запуск из корня репозитория::
+
+    python -m bench.members
+    python -m bench.members --members 10 100 --rows 20000
+
+Для каждого размера заводится свой счёт с ``--rows`` тратами за год,
+поровну разбросанными по участникам. Меряется то, что делает бот:
+один сгруппированный запрос load_breakdown за 30 и 365 дней, расчёт
+переводов с текстом и отрисовка графика. Для сравнения — тот же результат
+по запросу на каждого участника.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp.name}/bench.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "py"))
+
+from sqlalchemy import func, select  # noqa: E402
+
+from charts import render_members  # noqa: E402
+from constants import DEFAULT_CATEGORIES  # noqa: E402
+from db.database import AsyncSessionLocal, Base, engine  # noqa: E402
+from db.expenses import insert_expenses  # noqa: E402
+from db.migrations import upgrade  # noqa: E402
+from db.models import Account, Expense, User  # noqa: E402
+from members import chart_data, load_breakdown, settlement_summary  # noqa: E402
+
+CURRENCIES = ["RUB", "USD", "EUR"]
+INSERT_BATCH = 20000
+
+
+async def seed(session, account_id: int, members: int, rows: int, days: int) -> list[int]:
+    session.add(Account(id=account_id, code=f"bench{account_id}", password="-"))
+    tg_ids = [account_id * 10000 + i for i in range(members)]
+    session.add_all(User(tg_id=tg_id, account_id=account_id, name=f"Участник {i + 1}")
+                    for i, tg_id in enumerate(tg_ids))
+    await session.commit()
+
+    rng = random.Random(account_id)
+    now = datetime.utcnow()
+    # Как при обычной работе: траты добавляются по порядку дат
+    ages = sorted((rng.randint(0, days * 86400) for _ in range(rows)), reverse=True)
+    for offset in range(0, rows, INSERT_BATCH):
+        await insert_expenses(session, [
+            dict(
+                user_id=rng.choice(tg_ids),
+                account_id=account_id,
+                amount=round(rng.lognormvariate(6, 1), 2),
+                currency=rng.choice(CURRENCIES),
+                category=rng.choice(DEFAULT_CATEGORIES),
+                comment="",
+                created_at=now - timedelta(seconds=age),
+            )
+            for age in ages[offset:offset + INSERT_BATCH]
+        ])
+    await session.commit()
+    return tg_ids
+
+
+async def per_member(session, account_id: int, tg_ids: list[int], since: datetime):
+    # Как было бы без группировки по участнику: запрос на каждого
+    for tg_id in tg_ids:
+        await session.execute(
+            select(Expense.category, func.sum(Expense.amount))
+            .where(Expense.account_id == account_id, Expense.user_id == tg_id, Expense.created_at >= since)
+            .group_by(Expense.category)
+        )
+
+
+async def timed(make, repeat: int) -> list[float]:
+    values = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await make()
+        values.append((time.perf_counter() - started) * 1000)
+    return values
+
+
+def p50_p95(values: list[float]) -> str:
+    p95 = statistics.quantiles(values, n=20)[-1] if len(values) > 1 else values[0]
+    return f"{statistics.median(values):7.1f} / {p95:7.1f}"
+
+
+async def main(sizes: list[int], rows: int, days: int, repeat: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade)
+
+    print(f"трат на счёт: {rows} за {days} дн.; время в мс, медиана / p95")
+    print(f"{'участников':>10} | {'запрос 30 дн.':>15} | {'запрос 365 дн.':>15} | "
+          f"{'по участнику 30 дн.':>19} | {'переводы':>8} | {'график':>7}")
+    async with AsyncSessionLocal() as session:
+        for account_id, members in enumerate(sizes, start=1):
+            tg_ids = await seed(session, account_id, members, rows, days)
+            today = datetime.utcnow().date()
+
+            month = await timed(lambda: load_breakdown(session, account_id, today - timedelta(days=30), 1.0), repeat)
+            year = await timed(lambda: load_breakdown(session, account_id, today - timedelta(days=365), 1.0), repeat)
+            naive = await timed(
+                lambda: per_member(session, account_id, tg_ids, datetime.utcnow() - timedelta(days=30)),
+                max(repeat // 5, 1)
+            )
+
+            breakdown = await load_breakdown(session, account_id, today - timedelta(days=30), 1.0)
+            started = time.perf_counter()
+            settlement_summary(breakdown, tg_ids[0], 30, "RUB")
+            settle_ms = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            labels, chart_rows = chart_data(breakdown)
+            render_members(labels, breakdown.categories, chart_rows, 30, "RUB")
+            render_ms = (time.perf_counter() - started) * 1000
+
+            print(f"{members:>10} | {p50_p95(month):>15} | {p50_p95(year):>15} | {p50_p95(naive):>19} | "
+                  f"{settle_ms:>8.1f} | {render_ms:>7.1f}")
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--rows", type=int, default=100000, help="трат на каждый счёт")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.members, args.rows, args.days, args.repeat))
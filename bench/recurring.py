@@ -0,0 +1,118 @@
+"""Планировщик повторяющихся трат на 100k правилах с подменённым временем.
+
+Запуск из корня репозитория::
+
+    python -m bench.recurring
+    python -m bench.recurring --rules 10000 --downtime 30 --days 60
+
+Правила создаются с ``next_run_at`` в прошлом (бот «лежал» ``--downtime``
+дней), затем часы двигаются вперёд по ``--step`` часов. Проверяется, что
+вставлено ровно столько трат, сколько должно было наступить, и меряется
+время догоняющего запуска и обычных тиков.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp.name}/bench.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "py"))
+
+from sqlalchemy import func, insert, select  # noqa: E402
+
+from constants import DEFAULT_CATEGORIES  # noqa: E402
+from db.database import AsyncSessionLocal, Base, engine  # noqa: E402
+from db.models import Expense, RecurringExpense, User  # noqa: E402
+from recurring import RecurringScheduler, next_run  # noqa: E402
+
+USERS = 1000
+
+
+class Clock:
+    def __init__(self, now: datetime):
+        self.now = now
+
+    def __call__(self) -> datetime:
+        return self.now
+
+
+def expected_runs(rules: list[dict], until: datetime) -> int:
+    total = 0
+    for rule in rules:
+        run_at = rule["next_run_at"]
+        while run_at <= until:
+            total += 1
+            run_at = next_run(run_at, rule["period"], rule["start_at"].day)
+    return total
+
+
+async def seed(count: int, start: datetime, downtime: int) -> list[dict]:
+    rng = random.Random(1)
+    rules = []
+    for i in range(count):
+        start_at = start - timedelta(days=rng.uniform(0, downtime))
+        rules.append(dict(
+            user_id=i % USERS + 1,
+            amount=round(rng.uniform(100, 5000), 2),
+            currency="RUB",
+            category=rng.choice(DEFAULT_CATEGORIES),
+            comment="",
+            period=rng.choice(["day", "week", "month"]),
+            start_at=start_at,
+            next_run_at=start_at,
+        ))
+    async with AsyncSessionLocal() as session:
+        await session.execute(insert(User), [dict(tg_id=tg_id) for tg_id in range(1, USERS + 1)])
+        await session.execute(insert(RecurringExpense), rules)
+        await session.commit()
+    return rules
+
+
+async def main(count: int, downtime: int, days: int, step: float):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    clock = Clock(datetime(2024, 1, 15, 12, 0))
+    rules = await seed(count, clock.now, downtime)
+    scheduler = RecurringScheduler(clock=clock)
+
+    started = time.perf_counter()
+    caught_up = await scheduler.run_due()
+    catch_up_s = time.perf_counter() - started
+    print(f"правил: {count}, простой {downtime} дн.: догнали {caught_up} трат за {catch_up_s:.2f} с "
+          f"({caught_up / catch_up_s:.0f} трат/с)")
+
+    ticks = []
+    inserted = caught_up
+    end = clock.now + timedelta(days=days)
+    while clock.now < end:
+        clock.now += timedelta(hours=step)
+        started = time.perf_counter()
+        inserted += await scheduler.run_due()
+        ticks.append((time.perf_counter() - started) * 1000)
+    print(f"тиков по {step} ч: {len(ticks)}, медиана {statistics.median(ticks):.1f} мс, "
+          f"максимум {max(ticks):.1f} мс, в куче сейчас {len(scheduler._heap)}")
+
+    async with AsyncSessionLocal() as session:
+        stored = await session.scalar(select(func.count()).select_from(Expense))
+    expected = expected_runs(rules, clock.now)
+    print(f"вставлено {inserted}, в базе {stored}, ожидалось {expected}: "
+          f"{'OK' if inserted == stored == expected else 'РАСХОЖДЕНИЕ'}")
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rules", type=int, default=100000)
+    parser.add_argument("--downtime", type=int, default=7, help="дней простоя до запуска")
+    parser.add_argument("--days", type=int, default=7, help="сколько дней прогонять после")
+    parser.add_argument("--step", type=float, default=1, help="шаг часов, ч")
+    args = parser.parse_args()
+    asyncio.run(main(args.rules, args.downtime, args.days, args.step))
@@ -0,0 +1,101 @@
+"""Задержка /report, когда отчёты просят многие одновременно: отрисовка в event loop и в пуле.
+
+Запуск из корня репозитория::
+
+    python -m bench.render
+    python -m bench.render --concurrency 1 10 50 --workers 4
+
+``--concurrency`` отчётов запрашиваются разом, у каждого свои категории и
+суммы. «В event loop» — как было до пула: render_pie вызывается прямо в
+хендлере. «В пуле» — ChartRenderer, как сейчас. Для каждого отчёта меряется
+время от запроса до готовой картинки (p50/p99), а для event loop — на
+сколько опаздывает задача, которая просыпается каждые 10 мс: столько же
+ждут апдейты остальных пользователей.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "py"))
+
+from charts import ChartRenderer, render_pie  # noqa: E402
+from constants import DEFAULT_CATEGORIES  # noqa: E402
+
+TICK = 0.01
+
+
+def make_report(rng: random.Random) -> tuple:
+    categories = rng.sample(DEFAULT_CATEGORIES, rng.randint(2, len(DEFAULT_CATEGORIES)))
+    return categories, [round(rng.uniform(100, 20000), 2) for _ in categories], 30, "RUB"
+
+
+async def in_loop(args: tuple) -> bytes:
+    return render_pie(*args)
+
+
+async def measure(render, reports: list[tuple]) -> tuple[list[float], list[float]]:
+    """Задержки отчётов и опоздания тикера event loop, в мс."""
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append((time.perf_counter() - started - TICK) * 1000)
+
+    async def request(args: tuple) -> float:
+        await render(args)
+        return (time.perf_counter() - submitted) * 1000
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK)
+    # Все отчёты запрошены в один момент, задержка считается от него
+    submitted = time.perf_counter()
+    latencies = await asyncio.gather(*(request(args) for args in reports))
+    done.set()
+    await tick
+    return latencies, lags
+
+
+def p50_p99(values: list[float]) -> str:
+    p99 = statistics.quantiles(values, n=100)[-1] if len(values) > 1 else values[0]
+    return f"{statistics.median(values):7.0f} / {p99:7.0f}"
+
+
+async def main(concurrency: list[int], workers: int, rounds: int):
+    renderer = ChartRenderer(workers=workers, queue_depth=max(concurrency))
+    await renderer.prewarm()
+    pooled = lambda args: renderer.render(render_pie, *args)  # noqa: E731
+    # Первый вызов в этом процессе грузит matplotlib и шрифты — не в счёт
+    render_pie(*make_report(random.Random(0)))
+
+    rng = random.Random(1)
+    print(f"процессов в пуле: {workers}; время в мс, p50 / p99")
+    print(f"{'отчётов':>8} | {'отчёт, в loop':>15} | {'отчёт, в пуле':>15} | "
+          f"{'опоздание loop':>15} | {'опоздание, пул':>15}")
+    for n in concurrency:
+        results = {}
+        for name, render in (("loop", in_loop), ("pool", pooled)):
+            latencies, lags = [], []
+            for _ in range(rounds):
+                got = await measure(render, [make_report(rng) for _ in range(n)])
+                latencies += got[0]
+                lags += got[1]
+            results[name] = latencies, lags
+        print(f"{n:>8} | {p50_p99(results['loop'][0]):>15} | {p50_p99(results['pool'][0]):>15} | "
+              f"{p50_p99(results['loop'][1]):>15} | {p50_p99(results['pool'][1]):>15}")
+    renderer.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency, args.workers, args.rounds))
@@ -0,0 +1,141 @@
+"""Запрос /report по сырым тратам и по дневным суммам на большой синтетической базе.
+
+Запуск из корня репозитория::
+
+    python -m bench.rollup
+    python -m bench.rollup --rows 5000000 --accounts 5000 --years 3
+
+В базу кладётся ``--rows`` трат за ``--years`` лет на ``--accounts`` общих
+счетов. Размеры счетов распределены по Ципфу, как в жизни: у первого
+счёта траты исчисляются сотнями тысяч, у медианного — десятками.
+Дневные суммы строятся одним проходом rebuild_daily_totals. Затем для
+самого большого и медианного счёта меряется агрегация по категориям с
+переводом в валюту отчёта за разные периоды: так, как отчёт считался по
+таблице expenses, и так, как сейчас, — по category_totals. Результаты
+обоих запросов сверяются.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp.name}/bench.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "py"))
+
+from sqlalchemy import func, insert, select  # noqa: E402
+
+from constants import DEFAULT_CATEGORIES  # noqa: E402
+from db.archive import category_totals  # noqa: E402
+from db.database import AsyncSessionLocal, Base, engine  # noqa: E402
+from db.migrations import upgrade  # noqa: E402
+from db.models import Account, Expense, FxRate, User  # noqa: E402
+from db.rollup import rebuild_daily_totals  # noqa: E402
+from report_cache import report_since  # noqa: E402
+
+INSERT_BATCH = 50000
+CURRENCIES = ["RUB", "RUB", "USD", "EUR"]
+RATES = {"USD": 1.0, "RUB": 90.0, "EUR": 0.9}
+REPORT_DAYS = [7, 30, 365, 10000]
+
+
+async def seed(rows: int, accounts: int, years: int) -> dict[int, int]:
+    rng = random.Random(1)
+    now = datetime.utcnow()
+    span = years * 365 * 86400
+    # Ципф: вес i-го счёта пропорционален 1/i
+    cum_weights = list(itertools.accumulate(1 / i for i in range(1, accounts + 1)))
+    sizes = dict.fromkeys(range(1, accounts + 1), 0)
+    async with AsyncSessionLocal() as session:
+        session.add_all(Account(id=i, code=f"bench{i}", password="-") for i in range(1, accounts + 1))
+        session.add_all(User(tg_id=i, account_id=i) for i in range(1, accounts + 1))
+        session.add_all(FxRate(currency=c, rate=r) for c, r in RATES.items())
+        await session.commit()
+
+        for offset in range(0, rows, INSERT_BATCH):
+            n = min(INSERT_BATCH, rows - offset)
+            owners = rng.choices(range(1, accounts + 1), cum_weights=cum_weights, k=n)
+            for account_id in owners:
+                sizes[account_id] += 1
+            await session.execute(insert(Expense), [
+                dict(user_id=account_id, account_id=account_id, amount=round(rng.lognormvariate(6, 1), 2),
+                     currency=rng.choice(CURRENCIES), category=rng.choice(DEFAULT_CATEGORIES), comment="",
+                     created_at=now - timedelta(seconds=rng.randint(0, span)))
+                for account_id in owners
+            ])
+            await session.commit()
+
+    async with engine.begin() as conn:
+        await conn.run_sync(rebuild_daily_totals)
+    return sizes
+
+
+def raw_query(account_id: int, since):
+    # Как отчёт считался до дневных сумм: все траты счёта за период
+    return (
+        select(Expense.category, func.sum(Expense.amount / func.coalesce(FxRate.rate, 1.0)))
+        .outerjoin(FxRate, FxRate.currency == Expense.currency)
+        .where(Expense.account_id == account_id,
+               Expense.created_at >= datetime.combine(since, datetime.min.time()))
+        .group_by(Expense.category)
+    )
+
+
+def rollup_query(account_id: int, since):
+    totals = category_totals(f"account:{account_id}", since)
+    return (
+        select(totals.c.category, func.sum(totals.c.total / func.coalesce(FxRate.rate, 1.0)))
+        .outerjoin(FxRate, FxRate.currency == totals.c.currency)
+        .group_by(totals.c.category)
+    )
+
+
+async def timed(session, query, repeat: int) -> tuple[float, dict]:
+    values = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = (await session.execute(query)).all()
+        values.append((time.perf_counter() - started) * 1000)
+    return statistics.median(values), dict(rows)
+
+
+async def main(rows: int, accounts: int, years: int, repeat: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade)
+    started = time.perf_counter()
+    sizes = await seed(rows, accounts, years)
+    print(f"база заполнена за {time.perf_counter() - started:.0f} с: {rows} трат, {accounts} счетов")
+
+    by_size = sorted(sizes, key=sizes.get, reverse=True)
+    targets = [("самый большой", by_size[0]), ("медианный", by_size[len(by_size) // 2])]
+    print("время запроса в мс, медиана")
+    print(f"{'счёт':>14} | {'трат':>7} | {'дней':>5} | {'expenses':>9} | {'дневные суммы':>13} | {'ускорение':>9}")
+    async with AsyncSessionLocal() as session:
+        for label, account_id in targets:
+            for days in REPORT_DAYS:
+                since = report_since(days)
+                raw_ms, raw = await timed(session, raw_query(account_id, since), repeat)
+                rollup_ms, rollup = await timed(session, rollup_query(account_id, since), repeat)
+                assert raw.keys() == rollup.keys(), (raw, rollup)
+                assert all(abs(raw[c] - rollup[c]) < 1e-6 * max(1.0, raw[c]) for c in raw), (raw, rollup)
+                print(f"{label:>14} | {sizes[account_id]:>7} | {days:>5} | {raw_ms:>9.2f} | {rollup_ms:>13.2f} | "
+                      f"{raw_ms / rollup_ms:>8.1f}x")
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--accounts", type=int, default=2000)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.accounts, args.years, args.repeat))
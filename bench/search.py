@@ -0,0 +1,142 @@
+"""Скорость /search на большом счёте.
+
+Запуск из корня репозитория::
+
+    python -m bench.search
+    python -m bench.search --rows 100000 --noise 0
+
+В один счёт кладётся ``--rows`` трат с комментариями из небольшого словаря
+(частые и редкие слова), ещё ``--noise`` — в другие счета. Индекс поиска
+создаётся так же, как в ``python bot.py migrate``, и наполняется триггерами
+при вставке. Для разных запросов меряется поиск первой, пятой и сто первой
+страницы (она уже за первым окном ранжирования), для сравнения — тот же
+фильтр через LIKE.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp.name}/bench.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "py"))
+
+from sqlalchemy import func, insert, select  # noqa: E402
+
+from constants import DEFAULT_CATEGORIES  # noqa: E402
+from db.database import AsyncSessionLocal, Base, engine  # noqa: E402
+from db.migrations import upgrade  # noqa: E402
+from db.models import Account, Expense, User  # noqa: E402
+from db.search import search_expenses  # noqa: E402
+
+ACCOUNT_ID = 1
+OTHER_ACCOUNTS = 9
+INSERT_BATCH = 20000
+# Частые слова встречаются в каждой второй-третьей трате, редкие — раз на тысячи
+COMMON = ["кофе", "обед", "такси", "продукты", "магазин", "бензин"]
+RARE = ["ремонт", "подарок", "стоматолог", "билеты", "абонемент", "штраф", "аптека", "книги"]
+QUERIES = [
+    ("частое слово", "кофе", 0),
+    ("частое слово, 30 дней", "кофе", 30),
+    ("два частых слова", "кофе магазин", 0),
+    ("редкое слово", "стоматолог", 0),
+    ("префикс", "абон", 0),
+    ("категория", "развлечения", 0),
+    ("нет совпадений", "яхта", 0),
+]
+
+
+def comment(rng: random.Random) -> str:
+    words = rng.sample(COMMON, rng.randint(0, 2))
+    if rng.random() < 0.01:
+        words.append(rng.choice(RARE))
+    words.append(str(rng.randint(1, 999)))
+    return " ".join(words)
+
+
+async def seed(rows: int, noise: int, days: int) -> float:
+    rng = random.Random(1)
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as session:
+        session.add_all(Account(id=i, code=f"bench{i}", password="-") for i in range(1, OTHER_ACCOUNTS + 2))
+        session.add(User(tg_id=1, account_id=ACCOUNT_ID))
+        await session.commit()
+
+        started = time.perf_counter()
+        total = rows + noise
+        for offset in range(0, total, INSERT_BATCH):
+            batch = [
+                dict(
+                    user_id=1,
+                    account_id=ACCOUNT_ID if rng.random() < rows / total else rng.randint(2, OTHER_ACCOUNTS + 1),
+                    amount=round(rng.uniform(10, 5000), 2),
+                    currency="RUB",
+                    category=rng.choice(DEFAULT_CATEGORIES),
+                    comment=comment(rng),
+                    created_at=now - timedelta(days=days * (1 - i / total)),
+                )
+                for i in range(offset, min(offset + INSERT_BATCH, total))
+            ]
+            await session.execute(insert(Expense), batch)
+        await session.commit()
+        return total / (time.perf_counter() - started)
+
+
+def timed(values: list[float]) -> str:
+    return f"p50 {statistics.median(values):6.2f} мс, max {max(values):6.2f} мс"
+
+
+async def main(rows: int, noise: int, days: int, repeat: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade)
+    rate = await seed(rows, noise, days)
+    async with AsyncSessionLocal() as session:
+        in_account = await session.scalar(select(func.count()).where(Expense.account_id == ACCOUNT_ID))
+    print(f"трат в счёте: {in_account}, всего: {rows + noise}; вставка с индексом поиска: {rate:.0f} строк/с")
+
+    async with AsyncSessionLocal() as session:
+        for title, query, period in QUERIES:
+            since = datetime.utcnow() - timedelta(days=period) if period else None
+            first, fifth, deep = [], [], []
+            for _ in range(repeat):
+                t = time.perf_counter()
+                page = await search_expenses(session, ACCOUNT_ID, 1, query, since)
+                first.append((time.perf_counter() - t) * 1000)
+                t = time.perf_counter()
+                await search_expenses(session, ACCOUNT_ID, 1, query, since, offset=40)
+                fifth.append((time.perf_counter() - t) * 1000)
+                t = time.perf_counter()
+                await search_expenses(session, ACCOUNT_ID, 1, query, since, offset=1000)
+                deep.append((time.perf_counter() - t) * 1000)
+                session.expunge_all()
+
+            like = []
+            for _ in range(max(repeat // 5, 1)):
+                t = time.perf_counter()
+                q = select(Expense.id).where(Expense.account_id == ACCOUNT_ID,
+                                             Expense.comment.like(f"%{query}%")).limit(11)
+                if since:
+                    q = q.where(Expense.created_at >= since)
+                await session.execute(q)
+                like.append((time.perf_counter() - t) * 1000)
+
+            print(f"{title:<24} «{query}»: 1-я стр. {timed(first)} | 5-я стр. {timed(fifth)} | "
+                  f"101-я стр. {timed(deep)} | LIKE {timed(like)} | на странице {len(page.expenses)}")
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=300000, help="трат в искомом счёте")
+    parser.add_argument("--noise", type=int, default=300000, help="трат в других счетах")
+    parser.add_argument("--days", type=int, default=3 * 365, help="за сколько дней история")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.noise, args.days, args.repeat))
@@ -0,0 +1,165 @@
+"""Холодный старт бота: время импорта и время до ответа на первый апдейт.
+
+Запуск из корня репозитория::
+
+    python -m bench.startup
+    python -m bench.startup --runs 10 --output startup.json
+
+Каждый прогон — новый процесс ``python bot.py`` в режиме polling против
+поддельного Bot API из bench.e2e, который на первый getUpdates отдаёт
+/start. Меряется, когда бот впервые спросил апдейты (готов к работе) и
+когда пришёл его ответ (time-to-first-update). База мигрируется заранее
+отдельной командой ``python bot.py migrate``, её время тоже печатается.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+from bench.e2e import BENCH_TOKEN, ROOT, _free_port, _serve_fakes, _wait_for_port
+
+# config.py с настоящим токеном есть только у того, кто запускает бота
+CONFIG = f"""
+import sys, types
+try:
+    import config
+except ImportError:
+    config = types.ModuleType("config")
+    config.BOT_TOKEN = {BENCH_TOKEN!r}
+    sys.modules["config"] = config
+"""
+
+# Как `python bot.py ...`
+BOOTSTRAP = CONFIG + """
+import runpy
+sys.argv = ["bot.py", *sys.argv[1:]]
+runpy.run_path("bot.py", run_name="__main__")
+"""
+
+IMPORT_PROBE = CONFIG + """
+import time
+started = time.perf_counter()
+import bot
+elapsed = time.perf_counter() - started
+print(elapsed, *(name in sys.modules for name in ("matplotlib", "numpy", "aiohttp.web")))
+"""
+
+START_UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"},
+        "from": {"id": 1, "is_bot": False, "first_name": "bench"},
+        "text": "/start", "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+    },
+}
+
+
+def _env(db_path: Path, api_port: int = 0, facts_port: int = 0) -> dict:
+    env = dict(os.environ)
+    env.update(
+        PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")])),
+        DATABASE_URL=f"sqlite+aiosqlite:///{db_path}",
+        TELEGRAM_API_URL=f"http://127.0.0.1:{api_port}",
+        FACTS_API_URL=f"http://127.0.0.1:{facts_port}",
+    )
+    env.pop("METRICS_PORT", None)
+    env.pop("MIGRATE_ON_START", None)
+    return env
+
+
+def _stats(api_port: int) -> dict:
+    with urllib.request.urlopen(f"http://127.0.0.1:{api_port}/stats") as response:
+        return json.load(response)
+
+
+def measure_import(db_path: Path) -> dict:
+    out = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=ROOT / "py", env=_env(db_path),
+                         capture_output=True, text=True, check=True).stdout.split()
+    return {"import_s": float(out[0]), "matplotlib": out[1] == "True", "numpy": out[2] == "True",
+            "aiohttp_web": out[3] == "True"}
+
+
+def measure_start(db_path: Path, timeout: float) -> dict:
+    api_port, facts_port = _free_port(), _free_port()
+    fakes = multiprocessing.Process(target=_serve_fakes, args=(api_port, facts_port, 0, [START_UPDATE]),
+                                    daemon=True)
+    fakes.start()
+    _wait_for_port(api_port)
+    _wait_for_port(facts_port)
+
+    started = time.time()
+    bot = subprocess.Popen([sys.executable, "-c", BOOTSTRAP], cwd=ROOT / "py", env=_env(db_path, api_port, facts_port),
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            first = _stats(api_port)["first_call"]
+            if "sendMessage" in first:
+                return {"ready_s": first["getUpdates"] - started, "first_update_s": first["sendMessage"] - started}
+            if bot.poll() is not None:
+                raise RuntimeError(f"бот завершился при старте:\n{bot.stderr.read()}")
+            time.sleep(0.02)
+        raise RuntimeError(f"бот не ответил за {timeout} с")
+    finally:
+        bot.terminate()
+        try:
+            bot.wait(10)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        fakes.terminate()
+        fakes.join()
+
+
+def median(runs: list[dict], key: str) -> float:
+    return round(statistics.median(run[key] for run in runs), 3)
+
+
+def main(runs: int, timeout: float) -> dict:
+    tmp = tempfile.TemporaryDirectory()
+    db_path = Path(tmp.name) / "expenses.db"
+
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", BOOTSTRAP, "migrate"], cwd=ROOT / "py", env=_env(db_path),
+                   check=True, capture_output=True)
+    migrate_s = time.perf_counter() - started
+    print(f"python bot.py migrate: {migrate_s:.2f} с (раньше это делал каждый старт)")
+
+    imports = [measure_import(db_path) for _ in range(runs)]
+    print(f"import bot: медиана {median(imports, 'import_s'):.2f} с; при импорте загружены "
+          f"matplotlib={imports[0]['matplotlib']}, numpy={imports[0]['numpy']}, "
+          f"aiohttp.web={imports[0]['aiohttp_web']}")
+
+    starts = []
+    for i in range(runs):
+        starts.append(measure_start(db_path, timeout))
+        print(f"  прогон {i + 1}: готов через {starts[-1]['ready_s']:.2f} с, "
+              f"ответ на первый апдейт через {starts[-1]['first_update_s']:.2f} с")
+    print(f"медиана: готов {median(starts, 'ready_s'):.2f} с, "
+          f"time-to-first-update {median(starts, 'first_update_s'):.2f} с")
+
+    return {
+        "migrate_s": round(migrate_s, 3),
+        "import_s": median(imports, "import_s"),
+        "ready_s": median(starts, "ready_s"),
+        "first_update_s": median(starts, "first_update_s"),
+        "heavy_modules_at_import": {k: v for k, v in imports[0].items() if k != "import_s"},
+        "runs": starts,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60, help="сколько ждать ответа бота, с")
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+    result = main(args.runs, args.timeout)
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
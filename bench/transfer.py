@@ -0,0 +1,118 @@
+"""Скорость и память /export и /import на больших файлах.
+
+Запуск из корня репозитория::
+
+    python -m bench.transfer
+    python -m bench.transfer --rows 100000 1000000 --batch 5000
+
+Для каждого размера заводится пользователь с ``--rows`` тратами. Экспорт —
+ExpenseCsvFile.read до последнего байта, как при загрузке в Telegram.
+Импорт — выгруженный файл с диска через iter_import_rows и import_expenses
+пачками по ``--batch``, как после загрузки документа. Каждый шаг идёт
+дважды: сначала на скорость, потом под tracemalloc — пик памяти Python за
+шаг. Пик не должен расти вместе с числом строк.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp.name}/bench.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "py"))
+
+from constants import DEFAULT_CATEGORIES, POPULAR_CURRENCIES  # noqa: E402
+from db.database import AsyncSessionLocal, Base, engine  # noqa: E402
+from db.expenses import insert_expenses  # noqa: E402
+from db.migrations import upgrade  # noqa: E402
+from db.models import User  # noqa: E402
+from transfer import ExpenseCsvFile, import_expenses, iter_import_rows  # noqa: E402
+
+INSERT_BATCH = 20000
+COMMENTS = ["", "кофе", "обед с коллегами", "такси до дома", "продукты на неделю"]
+
+
+async def seed(user_id: int, rows: int):
+    rng = random.Random(user_id)
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as session:
+        session.add(User(tg_id=user_id))
+        await session.commit()
+        for offset in range(0, rows, INSERT_BATCH):
+            await insert_expenses(session, [
+                dict(user_id=user_id, account_id=None, amount=round(rng.lognormvariate(6, 1), 2),
+                     currency=rng.choice(POPULAR_CURRENCIES), category=rng.choice(DEFAULT_CATEGORIES),
+                     comment=rng.choice(COMMENTS),
+                     created_at=now - timedelta(seconds=rng.randint(0, 5 * 365 * 86400)))
+                for _ in range(min(INSERT_BATCH, rows - offset))
+            ])
+            await session.commit()
+
+
+async def export(user_id: int, path: Path) -> int:
+    async with AsyncSessionLocal() as session:
+        document = ExpenseCsvFile(session, None, user_id)
+        with open(path, "wb") as f:
+            async for chunk in document.read(None):
+                f.write(chunk)
+    return document.rows_written
+
+
+async def import_file(user_id: int, path: Path, batch: int) -> int:
+    async with AsyncSessionLocal() as session:
+        with open(path, "rb") as f:
+            imported, errors = await import_expenses(session, iter_import_rows(f, path.name), user_id, None,
+                                                     batch_size=batch)
+    assert not errors, errors[:3]
+    return imported
+
+
+async def measure(make) -> tuple[float, float, int]:
+    """Время прогона в секундах, пик памяти Python за второй прогон в МБ и результат."""
+    started = time.perf_counter()
+    result = await make()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    assert await make() == result
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+async def main(sizes: list[int], batch: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade)
+
+    print(f"пачка импорта: {batch}; строк в секунду и пик памяти Python")
+    print(f"{'строк':>9} | {'файл, МБ':>8} | {'экспорт':>9} | {'память':>8} | {'импорт':>9} | {'память':>8}")
+    for n, rows in enumerate(sizes, start=1):
+        user_id = n * 10
+        path = Path(_tmp.name) / f"expenses_{rows}.csv"
+        await seed(user_id, rows)
+
+        export_s, export_mb, written = await measure(lambda: export(user_id, path))
+        assert written == rows, written
+        # Каждый прогон импорта — свой пользователь, чтобы таблица росла одинаково
+        targets = iter([user_id + 1, user_id + 2])
+        import_s, import_mb, imported = await measure(lambda: import_file(next(targets), path, batch))
+        assert imported == rows, imported
+
+        size_mb = path.stat().st_size / 2 ** 20
+        print(f"{rows:>9} | {size_mb:>8.1f} | {rows / export_s:>9.0f} | {export_mb:>6.1f}МБ | "
+              f"{rows / import_s:>9.0f} | {import_mb:>6.1f}МБ")
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--batch", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.batch))
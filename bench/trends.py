@@ -0,0 +1,103 @@
+"""Замер /trends на синтетических историях разного размера.
+
+Запуск из корня репозитория::
+
+    python -m bench.trends
+    python -m bench.trends --sizes 1000 100000 --days 365
+
+База создаётся во временной папке; для каждой истории заводится свой счёт.
+Отдельно меряются запрос + расчёт (цель — меньше 100 мс на 100k трат) и
+отрисовка графика, которая в боте идёт в пуле процессов.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp.name}/bench.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "py"))
+
+from analytics import compute_trends, load_series  # noqa: E402
+from charts import render_trends  # noqa: E402
+from constants import DEFAULT_CATEGORIES  # noqa: E402
+from db.database import AsyncSessionLocal, Base, engine  # noqa: E402
+from db.expenses import insert_expenses  # noqa: E402
+from db.models import Account  # noqa: E402
+from db.rollup import expense_scope  # noqa: E402
+
+CURRENCIES = ["RUB", "USD", "EUR"]
+INSERT_BATCH = 20000
+
+
+async def seed(session, account_id: int, size: int, days: int):
+    session.add(Account(id=account_id, code=f"bench{account_id}", password="-"))
+    await session.commit()
+
+    rng = random.Random(account_id)
+    now = datetime.utcnow()
+    batch = []
+    for _ in range(size):
+        batch.append(dict(
+            user_id=rng.randint(1, 50),
+            account_id=account_id,
+            amount=round(rng.lognormvariate(6, 1), 2),
+            currency=rng.choice(CURRENCIES),
+            category=rng.choice(DEFAULT_CATEGORIES),
+            comment="",
+            created_at=now - timedelta(seconds=rng.randint(0, days * 86400)),
+        ))
+        if len(batch) >= INSERT_BATCH:
+            await insert_expenses(session, batch)
+            batch = []
+    await insert_expenses(session, batch)
+    await session.commit()
+
+
+async def measure(session, scope: str, days: int, repeat: int) -> tuple[list[float], object]:
+    until = datetime.utcnow().date()
+    since = until - timedelta(days=days - 1)
+    timings = []
+    trends = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        series = await load_series(session, scope, since, until, 1.0)
+        trends = compute_trends(series, since, until)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings, trends
+
+
+async def main(sizes: list[int], days: int, repeat: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    print(f"{'трат':>8} {'ячеек':>7} {'медиана, мс':>12} {'p95, мс':>8} {'график, мс':>11}")
+    async with AsyncSessionLocal() as session:
+        for account_id, size in enumerate(sizes, start=1):
+            await seed(session, account_id, size, days)
+            timings, trends = await measure(session, expense_scope(account_id, 0), days, repeat)
+
+            started = time.perf_counter()
+            render_trends(trends.dates, trends.daily, trends.rolling, trends.week_starts,
+                          trends.weekly, trends.outlier_days, "RUB")
+            render_ms = (time.perf_counter() - started) * 1000
+
+            cells = len(trends.categories) * len(trends.daily)
+            p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+            print(f"{size:>8} {cells:>7} {statistics.median(timings):>12.1f} {p95:>8.1f} {render_ms:>11.1f}")
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 300000])
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.days, args.repeat))
@@ -0,0 +1,173 @@
+"""Нагрузка на webhook-режим: апдейты идут POST-запросами в aiohttp-приложение webhook.py.
+
+Запуск из корня репозитория::
+
+    python -m bench.webhook
+    python -m bench.webhook --workers 1 2 4 --users 200 --concurrency 100
+
+Всё как у Telegram: поддельный Bot API из bench/e2e.py, webhook-приложение
+(handle_update и WorkerPool) с ``--workers`` процессами на своём порту и
+``--users`` пользователей, каждый из которых по очереди отправляет POST'ом
+апдейты сценария из bench/e2e.py. На 503 апдейт, как у Telegram,
+отправляется повторно чуть позже. Меряется время ответа на POST (p50/p99),
+сколько апдейтов в секунду процессы успевают обработать до конца, сколько
+раз очередь была переполнена и все ли добавленные траты дошли до базы.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench.e2e import BENCH_TOKEN, Session, _configure, _free_port, _serve_fakes, _wait_for_port, seed, \
+    session_script
+
+RETRY_DELAY = 0.05
+
+
+async def run_user(http, url: str, tg_id: int, accounts: int, rounds: int, latencies: list, rejected: list):
+    rng = random.Random(tg_id)
+    session = Session(tg_id)
+    for _, text in [("start", "/start")] + session_script(tg_id, accounts, rng) * rounds:
+        update = session.update(text)
+        while True:
+            started = time.perf_counter()
+            async with http.post(url, json=update) as response:
+                latencies.append((time.perf_counter() - started) * 1000)
+                if response.status == 200:
+                    break
+                assert response.status == 503, response.status
+            rejected.append(tg_id)
+            await asyncio.sleep(RETRY_DELAY)
+
+
+async def count_expenses() -> int:
+    from sqlalchemy import func, select
+
+    from db.database import AsyncSessionLocal, engine
+    from db.models import Expense
+
+    async with AsyncSessionLocal() as session:
+        count = await session.scalar(select(func.count()).select_from(Expense))
+    await engine.dispose()
+    return count
+
+
+async def load(workers: int, args) -> dict:
+    import aiohttp
+    from aiohttp import web
+
+    import webhook
+
+    expenses = await count_expenses()
+
+    app = webhook.create_app(workers)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = _free_port()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    pool = app["pool"]
+    url = f"http://127.0.0.1:{port}{webhook.WEBHOOK_PATH}"
+
+    latencies: list[float] = []
+    rejected: list[int] = []
+    try:
+        async with aiohttp.ClientSession() as http:
+            # Процессы импортируют бота и поднимают сервисы не сразу: по одному
+            # апдейту в каждый (chat_id % workers) и ждём, пока все обработаются
+            for tg_id in range(args.users + 1, args.users + 1 + workers):
+                async with http.post(url, json=Session(tg_id).update("/start")) as response:
+                    assert response.status == 200, response.status
+            while sum(s["processed"] + s["errors"] for s in pool.stats()) < workers:
+                await asyncio.sleep(0.1)
+            before = pool.stats()
+
+            started = time.perf_counter()
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def limited(tg_id: int):
+                async with semaphore:
+                    await run_user(http, url, tg_id, args.accounts, args.rounds, latencies, rejected)
+
+            await asyncio.gather(*(limited(tg_id) for tg_id in range(1, args.users + 1)))
+        accepted = time.perf_counter() - started
+        # POST отвечает сразу после постановки в очередь, обработка идёт дальше
+        while any(s["backlog"] for s in pool.stats()):
+            await asyncio.sleep(0.05)
+        wall = time.perf_counter() - started
+        stats = pool.stats()
+    finally:
+        # Останавливает процессы: их очереди трат дописываются при выходе
+        await runner.cleanup()
+
+    return {
+        "written": await count_expenses() - expenses,
+        "processed": sum(s["processed"] - b["processed"] for s, b in zip(stats, before)),
+        "errors": sum(s["errors"] - b["errors"] for s, b in zip(stats, before)),
+        "rejected": len(rejected),
+        "accept_s": accepted,
+        "wall_s": wall,
+        "latencies": latencies,
+    }
+
+
+def p50_p99(values: list[float]) -> str:
+    q = statistics.quantiles(values, n=100) if len(values) > 1 else values * 99
+    return f"{statistics.median(values):6.1f} / {q[98]:6.1f}"
+
+
+async def prepare(args):
+    import bot as app
+    from db.database import engine
+
+    await app.init_db()
+    await seed(args.users, args.accounts, args.history)
+    await engine.dispose()
+
+
+def main(args):
+    asyncio.run(prepare(args))
+    print(f"пользователей: {args.users}, одновременно: {args.concurrency}, кругов: {args.rounds}")
+    print(f"{'процессов':>9} | {'апдейтов':>8} | {'ошибок':>6} | {'503':>5} | {'трат':>5} | "
+          f"{'POST, мс p50 / p99':>18} | {'приём, апд/с':>12} | {'обработка, апд/с':>16}")
+    for workers in args.workers:
+        result = asyncio.run(load(workers, args))
+        n = result["processed"]
+        # Каждый круг сценария добавляет одну трату; меньше — значит, траты потерялись
+        assert result["written"] == args.users * args.rounds, result["written"]
+        print(f"{workers:>9} | {n:>8} | {result['errors']:>6} | {result['rejected']:>5} | {result['written']:>5} | "
+              f"{p50_p99(result['latencies']):>18} | {n / result['accept_s']:>12.0f} | "
+              f"{n / result['wall_s']:>16.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50, help="пользователей одновременно")
+    parser.add_argument("--rounds", type=int, default=1, help="сколько раз каждый проходит сценарий")
+    parser.add_argument("--accounts", type=int, default=10)
+    parser.add_argument("--history", type=int, default=100, help="трат на пользователя при заполнении")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    # Рабочие процессы запускаются через spawn и импортируют config сами:
+    # если своего config.py нет, им достаётся этот, с токеном заглушки
+    Path(tmp.name, "config.py").write_text(f"BOT_TOKEN = {BENCH_TOKEN!r}\n", encoding="utf-8")
+    sys.path.append(tmp.name)
+
+    api_port, facts_port = _free_port(), _free_port()
+    fakes = multiprocessing.Process(target=_serve_fakes, args=(api_port, facts_port, 0), daemon=True)
+    fakes.start()
+    try:
+        _wait_for_port(api_port)
+        _wait_for_port(facts_port)
+        _configure(Path(tmp.name) / "expenses.db", api_port, facts_port, telegram_limits=False)
+        main(args)
+    finally:
+        fakes.terminate()
+        fakes.join()
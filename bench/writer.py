@@ -0,0 +1,110 @@
+"""Пропускная способность записи трат: по одной транзакции на трату и через ExpenseWriter.
+
+Запуск из корня репозитория::
+
+    python -m bench.writer
+    python -m bench.writer --writers 1 10 100 --expenses 5000
+
+``--writers`` конкурентных корутин (как хендлеры разных пользователей)
+вместе добавляют ``--expenses`` трат. «По одной» — как было до очереди:
+сессия, INSERT вместе с дневными суммами и коммит на каждую трату.
+«Пачками» — ``ExpenseWriter.add`` с фоновой записью; время считается до
+того, как последняя трата закоммичена (``stop``).
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp.name}/bench.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "py"))
+
+from sqlalchemy import func, select  # noqa: E402
+
+from constants import DEFAULT_CATEGORIES  # noqa: E402
+from db.database import AsyncSessionLocal, Base, engine  # noqa: E402
+from db.expenses import insert_expenses  # noqa: E402
+from db.migrations import upgrade  # noqa: E402
+from db.models import Account, Expense, User  # noqa: E402
+from expense_writer import ExpenseWriter  # noqa: E402
+
+ACCOUNTS = 50
+
+
+def make_row(rng: random.Random, writer: int) -> dict:
+    return dict(
+        user_id=writer,
+        account_id=writer % ACCOUNTS + 1,
+        amount=round(rng.uniform(10, 5000), 2),
+        currency="RUB",
+        category=rng.choice(DEFAULT_CATEGORIES),
+        comment="",
+        created_at=datetime.utcnow(),
+    )
+
+
+async def one_by_one(rows: list[list[dict]]):
+    async def write(own: list[dict]):
+        for row in own:
+            async with AsyncSessionLocal() as session:
+                await insert_expenses(session, [row])
+                await session.commit()
+
+    await asyncio.gather(*(write(own) for own in rows))
+
+
+async def batched(rows: list[list[dict]]):
+    writer = ExpenseWriter()
+    writer.start()
+
+    async def write(own: list[dict]):
+        for row in own:
+            await writer.add(row)
+            # Хендлер отдаёт управление на ответе пользователю
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(write(own) for own in rows))
+    await writer.stop()
+
+
+async def main(writer_counts: list[int], expenses: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade)
+    async with AsyncSessionLocal() as session:
+        session.add_all(Account(id=i, code=f"bench{i}", password="-") for i in range(1, ACCOUNTS + 1))
+        session.add_all(User(tg_id=i, account_id=i % ACCOUNTS + 1) for i in range(max(writer_counts)))
+        await session.commit()
+
+    rng = random.Random(1)
+    print(f"трат на прогон: {expenses}; трат в секунду")
+    print(f"{'писателей':>10} | {'по одной':>10} | {'пачками':>10} | {'ускорение':>9}")
+    for writers in writer_counts:
+        results = []
+        for method in (one_by_one, batched):
+            rows = [[make_row(rng, w) for _ in range(expenses // writers)] for w in range(writers)]
+            async with AsyncSessionLocal() as session:
+                before = await session.scalar(select(func.count()).select_from(Expense))
+            started = time.perf_counter()
+            await method(rows)
+            elapsed = time.perf_counter() - started
+            async with AsyncSessionLocal() as session:
+                written = await session.scalar(select(func.count()).select_from(Expense)) - before
+            assert written == sum(map(len, rows)), (method.__name__, written)
+            results.append(written / elapsed)
+        print(f"{writers:>10} | {results[0]:>10.0f} | {results[1]:>10.0f} | {results[1] / results[0]:>8.1f}x")
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--expenses", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.writers, args.expenses))
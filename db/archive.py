@@ -0,0 +1,175 @@
+"""Архив старых трат (холодный слой).
+
+Траты старше ARCHIVE_AFTER_DAYS, округлённых до начала месяца, фоновая
+задача (py/archive.py) пачками переносит из ``expenses`` в
+``archive.expenses`` — в SQLite это отдельный файл, подключённый через
+ATTACH, в PostgreSQL схема. Их дневные суммы при этом сворачиваются в
+``monthly_category_totals``: в живой базе остаются свежие траты, дневные
+суммы за последние месяцы и по строке на месяц и категорию за всё остальное.
+
+Перенос идёт двумя транзакциями: сначала строки копируются в архив
+(повторная копия пропускается), потом удаляются из ``expenses`` вместе с
+пересчётом сумм. Транзакция на два файла SQLite в режиме WAL не атомарна,
+а так сбой между шагами оставляет лишь копию, которую следующий проход
+доделает. Пока трата есть в обоих слоях, чтение из архива её пропускает.
+"""
+from __future__ import annotations
+
+import os
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import Date, and_, bindparam, cast, delete, exists, func, select, union_all, update
+
+from db.database import engine, upsert
+from db.expenses import expense_filter
+from db.models import ArchivedExpense, DailyCategoryTotal, Expense, MonthlyCategoryTotal
+from db.rollup import expense_scope
+
+# 0 — не архивировать: фоновая задача не запускается
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "730"))
+# Бюджеты и дайджесты читают только дневные суммы текущего и прошлого месяца
+ARCHIVE_MIN_DAYS = 62
+
+_COLUMNS = (Expense.id, Expense.amount, Expense.currency, Expense.category, Expense.comment,
+            Expense.created_at, Expense.account_id, Expense.user_id)
+
+# Трата уже скопирована в архив, но ещё не удалена из expenses
+_in_hot = exists().where(Expense.id == ArchivedExpense.id)
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(day: date) -> date:
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def archive_cutoff(today: date) -> date:
+    """Траты раньше этого дня (всегда первое число месяца) уходят в архив."""
+    return month_start(today - timedelta(days=max(ARCHIVE_AFTER_DAYS, ARCHIVE_MIN_DAYS)))
+
+
+def _at(day: date) -> datetime:
+    return datetime.combine(day, time())
+
+
+def scope_filter(scope: str, model=ArchivedExpense):
+    # Обратное к expense_scope(): "account:12" или "user:123"
+    kind, _, value = scope.partition(":")
+    if kind == "account":
+        return expense_filter(int(value), 0, model)
+    return expense_filter(None, int(value), model)
+
+
+def archived_filter(account_id: int | None, user_id: int):
+    """Как expense_filter(), но для архива и без трат, которые ещё есть в expenses."""
+    return and_(expense_filter(account_id, user_id, ArchivedExpense), ~_in_hot)
+
+
+def category_totals(scope: str, since: date):
+    """Подзапрос (category, currency, total) по всем тратам области начиная с ``since``.
+
+    Горячие дневные суммы, месячные суммы архива и — если ``since`` не первое
+    число — архивные траты его месяца, который в месячных суммах неделим.
+    """
+    parts = [
+        select(DailyCategoryTotal.category, DailyCategoryTotal.currency, DailyCategoryTotal.total)
+        .where(DailyCategoryTotal.scope == scope, DailyCategoryTotal.day >= since),
+        select(MonthlyCategoryTotal.category, MonthlyCategoryTotal.currency, MonthlyCategoryTotal.total)
+        .where(MonthlyCategoryTotal.scope == scope, MonthlyCategoryTotal.month >= since),
+    ]
+    if since.day != 1:
+        parts.append(
+            select(ArchivedExpense.category, ArchivedExpense.currency, ArchivedExpense.amount)
+            .where(scope_filter(scope), ArchivedExpense.created_at >= _at(since),
+                   ArchivedExpense.created_at < _at(next_month(since)), ~_in_hot)
+        )
+    return union_all(*parts).subquery()
+
+
+def daily_totals(scope: str, since: date, until: date):
+    """Подзапрос (day, category, currency, total) за [since, until]: горячие дневные суммы
+    и архивные траты, сгруппированные по дням. Архив читается по индексу только в пределах окна."""
+    if engine.dialect.name == "sqlite":
+        day = func.date(ArchivedExpense.created_at)
+    else:
+        day = cast(ArchivedExpense.created_at, Date)
+    return union_all(
+        select(DailyCategoryTotal.day, DailyCategoryTotal.category, DailyCategoryTotal.currency,
+               DailyCategoryTotal.total)
+        .where(DailyCategoryTotal.scope == scope, DailyCategoryTotal.day >= since, DailyCategoryTotal.day <= until),
+        select(day, ArchivedExpense.category, ArchivedExpense.currency, func.sum(ArchivedExpense.amount))
+        .where(scope_filter(scope), ArchivedExpense.created_at >= _at(since),
+               ArchivedExpense.created_at < _at(until + timedelta(days=1)), ~_in_hot)
+        .group_by(day, ArchivedExpense.category, ArchivedExpense.currency),
+    ).subquery()
+
+
+async def archive_range(session, first_id: int, last_id: int, cutoff: date) -> int:
+    """Переносит в архив траты с id из [first_id, last_id], созданные раньше ``cutoff``.
+
+    Читает не больше ``last_id - first_id + 1`` строк по первичному ключу.
+    Коммитит сама (см. описание модуля), возвращает число перенесённых трат.
+    """
+    rows = (await session.execute(
+        select(*_COLUMNS).where(Expense.id.between(first_id, last_id), Expense.created_at < _at(cutoff))
+    )).mappings().all()
+    if not rows:
+        return 0
+    copy = upsert(ArchivedExpense).on_conflict_do_nothing(index_elements=["id"])
+    await session.execute(copy, [dict(row) for row in rows])
+    await session.commit()
+
+    ids = [row["id"] for row in rows]
+    deleted = (await session.execute(delete(Expense).where(Expense.id.in_(ids)).returning(*_COLUMNS))).all()
+    await _fold_into_months(session, deleted)
+    await session.commit()
+
+    gone = set(ids) - {row.id for row in deleted}
+    if gone:
+        # Трату удалили между шагами — её копия в архиве лишняя
+        await session.execute(delete(ArchivedExpense).where(ArchivedExpense.id.in_(gone)))
+        await session.commit()
+    return len(deleted)
+
+
+async def _fold_into_months(session, expenses):
+    # Вычитаем перенесённые траты из дневных сумм и прибавляем к месячным
+    daily = defaultdict(lambda: [0.0, 0])
+    monthly = defaultdict(lambda: [0.0, 0])
+    for e in expenses:
+        scope = expense_scope(e.account_id, e.user_id)
+        day = e.created_at.date()
+        for totals, key in ((daily, (scope, day)), (monthly, (scope, month_start(day)))):
+            totals[key + (e.category, e.currency)][0] += e.amount
+            totals[key + (e.category, e.currency)][1] += 1
+
+    table = DailyCategoryTotal.__table__
+    key = (table.c.scope == bindparam("k_scope"), table.c.day == bindparam("k_day"),
+           table.c.category == bindparam("k_category"), table.c.currency == bindparam("k_currency"))
+    params = [
+        dict(k_scope=scope, k_day=day, k_category=category, k_currency=currency, k_total=total, k_count=count)
+        for (scope, day, category, currency), (total, count) in daily.items()
+    ]
+    await session.execute(
+        update(table).where(*key).values(total=table.c.total - bindparam("k_total"),
+                                         count=table.c.count - bindparam("k_count")),
+        params
+    )
+    await session.execute(delete(table).where(*key, table.c.count <= 0),
+                          [{k: v for k, v in p.items() if k not in ("k_total", "k_count")} for p in params])
+
+    stmt = upsert(MonthlyCategoryTotal)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["scope", "month", "category", "currency"],
+        set_={
+            "total": MonthlyCategoryTotal.total + stmt.excluded.total,
+            "count": MonthlyCategoryTotal.count + stmt.excluded.count,
+        },
+    )
+    await session.execute(stmt, [
+        dict(scope=scope, month=month, category=category, currency=currency, total=total, count=count)
+        for (scope, month, category, currency), (total, count) in monthly.items()
+    ])
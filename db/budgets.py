@@ -0,0 +1,148 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime
+
+from sqlalchemy import and_, case, func, select, update
+
+from db.models import Budget, DailyCategoryTotal, FxRate
+from db.rollup import expense_scope
+
+# Пороги в процентах от бюджета, при пересечении которых предупреждаем
+BUDGET_THRESHOLDS = (80, 100)
+
+
+@dataclass(frozen=True)
+class BudgetAlert:
+    scope: str
+    category: str
+    level: int
+    spent: float
+    amount: float
+    currency: str
+
+
+def current_month() -> date:
+    return datetime.utcnow().date().replace(day=1)
+
+
+def budget_level(spent: float, amount: float) -> int:
+    level = 0
+    for threshold in BUDGET_THRESHOLDS:
+        if spent >= amount * threshold / 100:
+            level = threshold
+    return level
+
+
+async def _rates(session, currencies) -> dict[str, float]:
+    rows = await session.execute(select(FxRate.currency, FxRate.rate).where(FxRate.currency.in_(currencies)))
+    return dict(rows.all())
+
+
+def _convert(amount: float, currency: str, to: str, rates: dict[str, float]) -> float:
+    # Правило то же, что в fx.FxRates.convert: сумму, у валюты которой нет
+    # курса, не пересчитываем — считаем, что она уже в валюте бюджета
+    if currency == to or currency not in rates or to not in rates:
+        return amount
+    return amount / rates[currency] * rates[to]
+
+
+async def add_to_budgets(session, expenses: list[dict]) -> list[BudgetAlert]:
+    """Прибавляет траты текущего месяца к бюджетам. Вызывается в той же транзакции, что и INSERT.
+
+    Возвращает пороги, пересечённые этой пачкой.
+    """
+    month = current_month()
+    amounts = defaultdict(float)
+    for e in expenses:
+        if e["created_at"].date().replace(day=1) == month:
+            amounts[(expense_scope(e["account_id"], e["user_id"]), e["category"], e["currency"])] += e["amount"]
+    if not amounts:
+        return []
+
+    budgets = (await session.execute(
+        select(Budget.scope, Budget.category, Budget.currency)
+        .where(Budget.scope.in_({scope for scope, _, _ in amounts}))
+    )).all()
+    if not budgets:
+        return []
+
+    budget_currency = {(b.scope, b.category): b.currency for b in budgets}
+    rates = await _rates(session, {c for _, _, c in amounts} | set(budget_currency.values()))
+    increments = defaultdict(float)
+    for (scope, category, currency), amount in amounts.items():
+        to = budget_currency.get((scope, category))
+        if to is not None:
+            increments[(scope, category)] += _convert(amount, currency, to, rates)
+
+    alerts = []
+    for (scope, category), increment in increments.items():
+        key = and_(Budget.scope == scope, Budget.category == category)
+        # Прибавляем в самом UPDATE, чтобы параллельные пачки не затирали друг друга;
+        # с началом нового месяца сумма и предупреждения обнуляются
+        same_month = Budget.month == month
+        spent, notified, amount = (await session.execute(
+            update(Budget).where(key)
+            .values(spent=case((same_month, Budget.spent), else_=0.0) + increment,
+                    notified=case((same_month, Budget.notified), else_=0),
+                    month=month)
+            .returning(Budget.spent, Budget.notified, Budget.amount)
+        )).one()
+
+        level = budget_level(spent, amount)
+        if level > notified:
+            claimed = await session.execute(
+                update(Budget).where(key, Budget.notified < level).values(notified=level)
+            )
+            if claimed.rowcount:
+                alerts.append(BudgetAlert(scope, category, level, spent, amount, budget_currency[(scope, category)]))
+    return alerts
+
+
+async def reconcile_budgets(session, scope: str | None = None, category: str | None = None) -> int:
+    """Пересчитывает ``spent`` по дневным суммам текущего месяца и актуальным курсам.
+
+    Исправляет накопившиеся расхождения (смена курсов, сбои записи). Без
+    аргументов — все бюджеты. Коммит остаётся за вызывающим.
+    """
+    month = current_month()
+    q = select(Budget.scope, Budget.category, Budget.currency, Budget.month, Budget.notified)
+    if scope is not None:
+        q = q.where(Budget.scope == scope)
+    if category is not None:
+        q = q.where(Budget.category == category)
+    budgets = (await session.execute(q)).all()
+    if not budgets:
+        return 0
+
+    totals = select(
+        DailyCategoryTotal.scope, DailyCategoryTotal.category, DailyCategoryTotal.currency,
+        func.sum(DailyCategoryTotal.total)
+    ).join(
+        Budget, and_(Budget.scope == DailyCategoryTotal.scope, Budget.category == DailyCategoryTotal.category)
+    ).where(DailyCategoryTotal.day >= month)
+    if scope is not None:
+        totals = totals.where(DailyCategoryTotal.scope == scope)
+    else:
+        # Без явного условия на область SQLite перебирает все дневные суммы
+        # и ищет к каждой бюджет; так дневные суммы читаются по индексу
+        # (scope, day) только у областей, где есть бюджеты
+        totals = totals.where(DailyCategoryTotal.scope.in_(select(Budget.scope)))
+    if category is not None:
+        totals = totals.where(Budget.category == category)
+    totals = (await session.execute(
+        totals.group_by(DailyCategoryTotal.scope, DailyCategoryTotal.category, DailyCategoryTotal.currency)
+    )).all()
+
+    budget_currency = {(b.scope, b.category): b.currency for b in budgets}
+    rates = await _rates(session, {t[2] for t in totals} | set(budget_currency.values()))
+    spent = defaultdict(float)
+    for t_scope, t_category, currency, total in totals:
+        key = (t_scope, t_category)
+        spent[key] += _convert(total, currency, budget_currency[key], rates)
+
+    await session.execute(update(Budget), [
+        dict(scope=b.scope, category=b.category, month=month, spent=spent[(b.scope, b.category)],
+             notified=b.notified if b.month == month else 0)
+        for b in budgets
+    ])
+    return len(budgets)
@@ -0,0 +1,52 @@
+from sqlalchemy import and_, insert, update
+
+from db.models import Expense, User, Account
+from db.budgets import BudgetAlert, add_to_budgets
+from db.rollup import add_to_rollup
+
+
+def expense_filter(account_id: int | None, user_id: int, model=Expense):
+    # Траты общего счёта или личные траты пользователя без счёта;
+    # model=ArchivedExpense — то же условие для архива
+    if account_id is not None:
+        return model.account_id == account_id
+    return and_(model.account_id.is_(None), model.user_id == user_id)
+
+
+async def bump_data_version(session,
+                            user_id: int | None = None,
+                            account_id: int | None = None):
+    # Новая версия данных делает закэшированные отчёты неактуальными
+    if account_id is not None:
+        await session.execute(
+            update(Account).where(Account.id == account_id).values(data_version=Account.data_version + 1)
+        )
+    if user_id is not None:
+        await session.execute(
+            update(User).where(User.tg_id == user_id).values(data_version=User.data_version + 1)
+        )
+
+
+async def insert_expenses(session, rows: list[dict]) -> list[BudgetAlert]:
+    """Вставляет пачку трат одним executemany вместе с дневными суммами, бюджетами и версиями.
+
+    Коммит остаётся за вызывающим, чтобы всё попало в одну транзакцию.
+    Возвращает пересечённые пороги бюджетов — о них нужно предупредить после коммита.
+    """
+    if not rows:
+        return []
+    await session.execute(insert(Expense), rows)
+    await add_to_rollup(session, rows)
+    alerts = await add_to_budgets(session, rows)
+
+    account_ids = {r["account_id"] for r in rows if r["account_id"] is not None}
+    user_ids = {r["user_id"] for r in rows if r["account_id"] is None}
+    if account_ids:
+        await session.execute(
+            update(Account).where(Account.id.in_(account_ids)).values(data_version=Account.data_version + 1)
+        )
+    if user_ids:
+        await session.execute(
+            update(User).where(User.tg_id.in_(user_ids)).values(data_version=User.data_version + 1)
+        )
+    return alerts
@@ -0,0 +1,53 @@
+from sqlalchemy import delete, exists, func, inspect, insert, select, text
+
+from db.database import Base
+from db.models import Expense, DailyCategoryTotal, SchemaVersion
+from db.rollup import rebuild_daily_totals
+from db.search import create_search_index
+
+# Увеличивается при каждом изменении схемы: бот при старте сверяет её с базой
+SCHEMA_VERSION = 6
+
+# Колонки, которые появились после первой версии схемы: create_all их
+# в уже существующие таблицы не добавит
+ADDED_COLUMNS = [
+    ("accounts", "data_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("users", "data_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("users", "base_currency", "VARCHAR"),
+    ("users", "digest", "VARCHAR"),
+    ("users", "digest_sent_on", "DATE"),
+    ("users", "name", "VARCHAR"),
+]
+
+
+def upgrade(conn):
+    """Доводит существующую базу до текущей схемы. Можно запускать повторно."""
+    inspector = inspect(conn)
+    for table, column, ddl in ADDED_COLUMNS:
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        if column not in existing:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+    # Индексы, объявленные в моделях уже после создания таблиц
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+    # Дневные суммы появились позже трат: заполняем их один раз для старых баз
+    has_expenses = conn.scalar(select(exists().where(Expense.id.is_not(None))))
+    has_totals = conn.scalar(select(exists().where(DailyCategoryTotal.day.is_not(None))))
+    if has_expenses and not has_totals:
+        rebuild_daily_totals(conn)
+
+    # Поиск по комментариям: FTS5 с триггерами или tsvector, см. db/search.py
+    create_search_index(conn)
+
+    conn.execute(delete(SchemaVersion))
+    conn.execute(insert(SchemaVersion).values(version=SCHEMA_VERSION))
+
+
+def schema_version(conn) -> int | None:
+    """Версия схемы базы; None — база ещё ни разу не проходила migrate."""
+    if not inspect(conn).has_table(SchemaVersion.__tablename__):
+        return None
+    return conn.scalar(select(func.max(SchemaVersion.version)))
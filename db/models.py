@@ -1,7 +1,7 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, Float, ForeignKey, DateTime, Date, Index, JSON, DDL, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
-from db.database import Base
+from db.database import Base, ARCHIVE_SCHEMA
 
 
 class Account(Base):
@@ -11,6 +11,7 @@ class Account(Base):
     code = Column(String, unique=True, nullable=False)     # публичный код
     password = Column(String, nullable=False)              # пароль
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    data_version = Column(Integer, nullable=False, default=0, server_default="0")  # для кэша отчётов
 
     users = relationship("User", back_populates="account", cascade="all, delete")
     expenses = relationship("Expense", back_populates="account", cascade="all, delete")
@@ -18,10 +19,21 @@ class Account(Base):
 
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Подписчики дайджеста, которым ещё не отправили выпуск за период
+        Index("ix_users_digest", "digest", "digest_sent_on"),
+        # Участники общего счёта: /members, рассылка предупреждений о бюджетах
+        Index("ix_users_account", "account_id"),
+    )
 
     id = Column(Integer, primary_key=True)
-    tg_id = Column(Integer, unique=True, nullable=False)  # Telegram user_id
+    tg_id = Column(BigInteger, unique=True, nullable=False)  # Telegram user_id
     account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"))
+    data_version = Column(Integer, nullable=False, default=0, server_default="0")  # для кэша отчётов
+    base_currency = Column(String)                        # валюта отчётов, None — по умолчанию
+    digest = Column(String)                               # week, month или None — без рассылки
+    digest_sent_on = Column(Date)                         # когда последний раз отправили дайджест
+    name = Column(String)                                 # имя в Telegram — для разбивки по участникам счёта
 
     account = relationship("Account", back_populates="users")
     expenses = relationship("Expense", back_populates="user", cascade="all, delete")
@@ -29,6 +41,11 @@ class User(Base):
 
 class Expense(Base):
     __tablename__ = 'expenses'
+    __table_args__ = (
+        # Траты всегда выбираются по счёту или пользователю и сортируются по дате
+        Index("ix_expenses_account_created", "account_id", "created_at"),
+        Index("ix_expenses_user_created", "user_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True)
     amount = Column(Float, nullable=False)
@@ -38,7 +55,116 @@ class Expense(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"))
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    user_id = Column(BigInteger, ForeignKey("users.tg_id", ondelete="CASCADE"))  # Telegram user_id
 
     account = relationship("Account", back_populates="expenses")
     user = relationship("User", back_populates="expenses")
+
+
+class DailyCategoryTotal(Base):
+    """Суммы трат по дням и категориям — из них строятся отчёты."""
+    __tablename__ = 'daily_category_totals'
+
+    scope = Column(String, primary_key=True)     # "account:<id>" или "user:<tg_id>"
+    day = Column(Date, primary_key=True)
+    category = Column(String, primary_key=True)
+    currency = Column(String, primary_key=True)
+    total = Column(Float, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class ArchivedExpense(Base):
+    """Трата старше горизонта архивации (см. db/archive.py): те же колонки и тот же id.
+
+    Лежит в схеме archive — в SQLite это другой файл, поэтому без внешних ключей.
+    """
+    __tablename__ = 'expenses'
+    __table_args__ = (
+        Index("ix_archive_expenses_account_created", "account_id", "created_at"),
+        Index("ix_archive_expenses_user_created", "user_id", "created_at"),
+        {"schema": ARCHIVE_SCHEMA},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    amount = Column(Float, nullable=False)
+    currency = Column(String, nullable=False)
+    category = Column(String, nullable=False)
+    comment = Column(String)
+    created_at = Column(DateTime(timezone=True))
+    account_id = Column(Integer)
+    user_id = Column(BigInteger)
+
+
+# В PostgreSQL схему для архива нужно создать до таблиц
+event.listen(Base.metadata, "before_create",
+             DDL(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}").execute_if(dialect="postgresql"))
+
+
+class MonthlyCategoryTotal(Base):
+    """Суммы архивных трат по месяцам — то же, что daily_category_totals, для холодного слоя."""
+    __tablename__ = 'monthly_category_totals'
+
+    scope = Column(String, primary_key=True)     # как в daily_category_totals
+    month = Column(Date, primary_key=True)       # первое число месяца
+    category = Column(String, primary_key=True)
+    currency = Column(String, primary_key=True)
+    total = Column(Float, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class FsmRecord(Base):
+    """Состояние и данные FSM одного чата (см. py/fsm_storage.py)."""
+    __tablename__ = 'fsm_states'
+
+    key = Column(String, primary_key=True)
+    state = Column(String)
+    data = Column(JSON, nullable=False, default=dict)
+    updated_at = Column(DateTime(timezone=True), index=True)
+
+
+class FxRate(Base):
+    """Курс валюты из дневного снимка: сколько её единиц за единицу базовой."""
+    __tablename__ = 'fx_rates'
+
+    currency = Column(String, primary_key=True)
+    rate = Column(Float, nullable=False)
+    as_of = Column(Date)
+
+
+class Budget(Base):
+    """Месячный бюджет категории и сколько из него уже потрачено.
+
+    ``spent`` — в валюте бюджета и только за месяц ``month``; обновляется в той
+    же транзакции, что и вставка трат, и периодически сверяется с дневными суммами.
+    """
+    __tablename__ = 'budgets'
+
+    scope = Column(String, primary_key=True)     # как в daily_category_totals
+    category = Column(String, primary_key=True)
+    amount = Column(Float, nullable=False)
+    currency = Column(String, nullable=False)
+    month = Column(Date)                         # первое число месяца, к которому относится spent
+    spent = Column(Float, nullable=False, default=0, server_default="0")
+    notified = Column(Integer, nullable=False, default=0, server_default="0")  # последний порог, о котором предупредили, %
+
+
+class RecurringExpense(Base):
+    """Повторяющаяся трата: раз в ``period`` превращается в обычную строку expenses."""
+    __tablename__ = 'recurring_expenses'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, ForeignKey("users.tg_id", ondelete="CASCADE"), index=True)  # Telegram user_id
+    amount = Column(Float, nullable=False)
+    currency = Column(String, nullable=False)
+    category = Column(String, nullable=False)
+    comment = Column(String)
+    period = Column(String, nullable=False)              # day, week или month
+    start_at = Column(DateTime, nullable=False)          # от него считается число месяца
+    next_run_at = Column(DateTime, nullable=False, index=True)
+
+
+class SchemaVersion(Base):
+    """До какой версии схемы база доведена командой migrate (см. db/migrations.py)."""
+    __tablename__ = 'schema_version'
+
+    version = Column(Integer, primary_key=True)
@@ -0,0 +1,72 @@
+import asyncio
+from collections import defaultdict
+
+from sqlalchemy import String, Date, case, cast, delete, func, insert, literal, select
+
+from db.database import engine, upsert
+from db.models import Expense, DailyCategoryTotal
+
+
+def expense_scope(account_id: int | None, user_id: int) -> str:
+    # Та же логика, что и в отчётах: общий счёт или личные траты без счёта
+    if account_id is not None:
+        return f"account:{account_id}"
+    return f"user:{user_id}"
+
+
+async def add_to_rollup(session, expenses: list[dict]):
+    """Прибавляет траты к дневным суммам. Вызывается в той же транзакции, что и INSERT."""
+    totals = defaultdict(lambda: [0.0, 0])
+    for e in expenses:
+        key = (expense_scope(e["account_id"], e["user_id"]), e["created_at"].date(), e["category"], e["currency"])
+        totals[key][0] += e["amount"]
+        totals[key][1] += 1
+    if not totals:
+        return
+
+    # executemany одного и того же оператора: компилируется один раз и берётся
+    # из кэша, в отличие от INSERT ... VALUES с разным числом строк
+    stmt = upsert(DailyCategoryTotal)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["scope", "day", "category", "currency"],
+        set_={
+            "total": DailyCategoryTotal.total + stmt.excluded.total,
+            "count": DailyCategoryTotal.count + stmt.excluded.count,
+        },
+    )
+    await session.execute(stmt, [
+        dict(scope=scope, day=day, category=category, currency=currency, total=total, count=count)
+        for (scope, day, category, currency), (total, count) in totals.items()
+    ])
+
+
+def rebuild_daily_totals(conn):
+    """Пересчитывает дневные суммы с нуля по таблице expenses одним запросом."""
+    if conn.dialect.name == "sqlite":
+        day = func.date(Expense.created_at)
+    else:
+        day = cast(Expense.created_at, Date)
+    scope = case(
+        (Expense.account_id.is_not(None), literal("account:") + cast(Expense.account_id, String)),
+        else_=literal("user:") + cast(Expense.user_id, String),
+    )
+
+    conn.execute(delete(DailyCategoryTotal))
+    conn.execute(
+        insert(DailyCategoryTotal).from_select(
+            ["scope", "day", "category", "currency", "total", "count"],
+            select(scope, day, Expense.category, Expense.currency,
+                   func.sum(Expense.amount), func.count())
+            .group_by(scope, day, Expense.category, Expense.currency)
+        )
+    )
+
+
+async def main():
+    async with engine.begin() as conn:
+        await conn.run_sync(rebuild_daily_totals)
+
+
+if __name__ == '__main__':
+    # python -m db.rollup — пересобрать таблицу daily_category_totals
+    asyncio.run(main())
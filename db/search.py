@@ -0,0 +1,223 @@
+"""Полнотекстовый поиск по комментариям и категориям трат.
+
+SQLite: таблица FTS5 ``expenses_fts`` (rowid = id траты), которую держат в
+актуальном состоянии триггеры на ``expenses``. В ней же лежит токен области
+(``account12`` / ``user123``), поэтому ограничение по счёту — часть запроса
+MATCH, а не фильтр поверх всех совпадений базы.
+
+PostgreSQL: вычисляемая колонка ``search_vector`` (tsvector) с GIN-индексом
+по (область, вектор) через расширение btree_gin.
+
+Архив (db/archive.py) проиндексирован так же — своя таблица FTS5 в файле
+архива или такая же колонка в схеме archive, — и поиск объединяет оба слоя.
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import datetime
+
+from sqlalchemy import select, text
+
+from db.database import ARCHIVE_SCHEMA, engine
+from db.models import ArchivedExpense, Expense
+
+SEARCH_TABLE = "expenses_fts"
+# Совпадения ранжируются окнами по столько самых свежих. bm25()/ts_rank по
+# всем совпадениям — это проход по всему списку документов слова, а «кофе» на
+# большом счёте встречается десятки тысяч раз
+SEARCH_CANDIDATES = 500
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+# Область траты так же, как expense_scope(), но одним словом для токенизатора
+_SCOPE_SQL = "CASE WHEN {t}.account_id IS NOT NULL THEN 'account' || {t}.account_id ELSE 'user' || {t}.user_id END"
+
+
+def _sqlite_ddl(schema: str) -> list[str]:
+    # Таблица и триггеры в той же схеме, что и траты: в теле триггера имена
+    # без схемы, SQLite ищет их в схеме самого триггера
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {schema}.{SEARCH_TABLE} USING fts5(
+            comment, category, scope,
+            prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {schema}.expenses_fts_insert AFTER INSERT ON expenses BEGIN
+            INSERT INTO {SEARCH_TABLE}(rowid, comment, category, scope)
+            VALUES (new.id, coalesce(new.comment, ''), new.category, {_SCOPE_SQL.format(t="new")});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {schema}.expenses_fts_delete AFTER DELETE ON expenses BEGIN
+            DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {schema}.expenses_fts_update
+            AFTER UPDATE OF comment, category, account_id, user_id ON expenses BEGIN
+            DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+            INSERT INTO {SEARCH_TABLE}(rowid, comment, category, scope)
+            VALUES (new.id, coalesce(new.comment, ''), new.category, {_SCOPE_SQL.format(t="new")});
+        END""",
+    ]
+
+
+def _postgres_ddl(table: str, prefix: str) -> list[str]:
+    return [
+        f"""ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                to_tsvector('russian', coalesce(comment, '') || ' ' || category)
+            ) STORED""",
+        f"""CREATE INDEX IF NOT EXISTS {prefix}_account_search ON {table}
+            USING gin (account_id, search_vector) WHERE account_id IS NOT NULL""",
+        f"""CREATE INDEX IF NOT EXISTS {prefix}_user_search ON {table}
+            USING gin (user_id, search_vector) WHERE account_id IS NULL""",
+    ]
+
+
+def create_search_index(conn):
+    """Создаёт индексы поиска по живым тратам и архиву и заполняет их для уже
+    существующих трат. Можно запускать повторно."""
+    if conn.dialect.name == "postgresql":
+        # Вычисляемая колонка заполняется сама, в том числе для старых строк
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gin"))
+        for ddl in _postgres_ddl("expenses", "ix_expenses") + _postgres_ddl(f"{ARCHIVE_SCHEMA}.expenses",
+                                                                             "ix_archive_expenses"):
+            conn.execute(text(ddl))
+        return
+
+    for schema in ("main", ARCHIVE_SCHEMA):
+        exists = conn.scalar(text(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = :name"),
+                             {"name": SEARCH_TABLE})
+        for ddl in _sqlite_ddl(schema):
+            conn.execute(text(ddl))
+        if not exists:
+            conn.execute(text(
+                f"INSERT INTO {schema}.{SEARCH_TABLE}(rowid, comment, category, scope) "
+                f"SELECT id, coalesce(comment, ''), category, {_SCOPE_SQL.format(t='expenses')} "
+                f"FROM {schema}.expenses"
+            ))
+
+
+async def merge_search_index(session, pages: int) -> bool:
+    """Один шаг слияния сегментов FTS5, не больше ``pages`` страниц записи.
+
+    Удалённые траты (в том числе ушедшие в архив) пропадают из индекса
+    только при слиянии. Возвращает False, когда сливать уже нечего. В
+    PostgreSQL то же самое для GIN делает autovacuum.
+    """
+    if engine.dialect.name != "sqlite":
+        return False
+    before = await session.scalar(text("SELECT total_changes()"))
+    # Отрицательное число — сливать, даже если сегментов на уровне немного
+    await session.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rank) VALUES ('merge', :pages)"),
+                          {"pages": -pages})
+    # Сама команда — одно изменение; если было слияние, их больше
+    return await session.scalar(text("SELECT total_changes()")) - before > 1
+
+
+def search_terms(query: str) -> list[str]:
+    return [term.casefold() for term in _TERM.findall(query)]
+
+
+@dataclass
+class SearchPage:
+    expenses: list
+    has_more: bool
+
+
+def _rank(terms: list[str], comment: str | None, category: str) -> tuple[int, int]:
+    # Сначала траты, где слова запроса есть целиком, потом — где только начало
+    # слова; совпадение в комментарии важнее совпадения в категории
+    words = search_terms(comment or "")
+    whole = sum(term in words or term == category.casefold() for term in terms)
+    in_comment = sum(any(word.startswith(term) for word in words) for term in terms)
+    return whole, in_comment
+
+
+async def search_expenses(session, account_id: int | None, user_id: int, query: str,
+                          since: datetime | None = None, limit: int = 10, offset: int = 0) -> SearchPage:
+    """Траты области, где есть все слова запроса (по началу слова), лучшие совпадения первыми.
+
+    Совпадения берутся от новых к старым окнами по SEARCH_CANDIDATES и
+    ранжируются внутри окна; следующее окно продолжает предыдущее по id,
+    так что до любой страницы можно долистать.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return SearchPage([], False)
+
+    rows = []
+    before = None
+    # Строкой больше, чем нужно странице, — чтобы знать, есть ли следующая
+    while len(rows) <= offset + limit:
+        if engine.dialect.name == "postgresql":
+            candidates = _postgres_candidates(account_id, user_id, terms, since, before)
+        else:
+            candidates = _sqlite_candidates(account_id, user_id, terms, since, before)
+        window = (await session.execute(
+            candidates, {"since": since, "before": before, "candidates": SEARCH_CANDIDATES}
+        )).all()
+        if not window:
+            break
+        before = min(row.id for row in window)
+        window.sort(key=lambda r: (*_rank(terms, r.comment, r.category), r.created_at, r.id), reverse=True)
+        rows.extend(window)
+        if len(window) < SEARCH_CANDIDATES:
+            break
+
+    ids = [row.id for row in rows[offset:offset + limit]]
+    # Id у трат в архиве те же, что были в expenses
+    found = {}
+    for model in (ArchivedExpense, Expense):
+        found.update((e.id, e) for e in (await session.scalars(select(model).where(model.id.in_(ids)))).all())
+    return SearchPage([found[i] for i in ids if i in found], len(rows) > offset + limit)
+
+
+_CANDIDATE_COLUMNS = (Expense.id, Expense.comment, Expense.category, Expense.created_at)
+
+
+def _sqlite_candidates(account_id, user_id, terms, since, before):
+    scope = f"account{account_id}" if account_id is not None else f"user{user_id}"
+    # Область — такое же слово в индексе, поэтому MATCH сразу пересекает
+    # траты счёта с тратами, где есть слова запроса. Слова запроса ищутся
+    # только в комментарии и категории, не в колонке области. Каждое слово —
+    # префикс в кавычках, так что операторы FTS5 из запроса не работают
+    words = " AND ".join(f'"{term}"*' for term in terms)
+    match = f"scope:{scope} AND {{comment category}}: ({words})"
+    date_filter = "AND e.created_at >= :since" if since else ""
+    before_filter = "AND f.rowid < :before" if before is not None else ""
+
+    def tier(schema, extra=""):
+        return f"""SELECT * FROM (
+            SELECT e.id, e.comment, e.category, e.created_at
+            FROM {schema}.{SEARCH_TABLE} f JOIN {schema}.expenses e ON e.id = f.rowid {date_filter}
+            WHERE f.{SEARCH_TABLE} MATCH '{match.replace("'", "''")}' {before_filter} {extra}
+            ORDER BY f.rowid DESC LIMIT :candidates
+        )"""
+
+    # Пока трату переносят в архив, она есть в обоих слоях
+    archived = tier(ARCHIVE_SCHEMA, "AND NOT EXISTS (SELECT 1 FROM main.expenses h WHERE h.id = e.id)")
+    return text(f"""
+        {tier("main")} UNION ALL {archived}
+        ORDER BY id DESC LIMIT :candidates
+    """).columns(*_CANDIDATE_COLUMNS)
+
+
+def _postgres_candidates(account_id, user_id, terms, since, before):
+    if account_id is not None:
+        scope_sql = f"account_id = {int(account_id)}"
+    else:
+        scope_sql = f"account_id IS NULL AND user_id = {int(user_id)}"
+    date_sql = "AND created_at >= :since" if since else ""
+    before_sql = "AND id < :before" if before is not None else ""
+    tsquery = " & ".join(f"{term}:*" for term in terms)
+
+    def tier(table, extra=""):
+        return f"""(
+            SELECT id, comment, category, created_at FROM {table} e
+            WHERE {scope_sql} AND search_vector @@ to_tsquery('russian', :tsquery) {date_sql} {before_sql} {extra}
+            ORDER BY id DESC LIMIT :candidates
+        )"""
+
+    archived = tier(f"{ARCHIVE_SCHEMA}.expenses", "AND NOT EXISTS (SELECT 1 FROM expenses h WHERE h.id = e.id)")
+    return text(f"""
+        {tier("expenses")} UNION ALL {archived}
+        ORDER BY id DESC LIMIT :candidates
+    """).bindparams(tsquery=tsquery).columns(*_CANDIDATE_COLUMNS)
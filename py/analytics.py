@@ -0,0 +1,166 @@
+"""Тренды трат: дневные и недельные суммы, скользящее среднее, сравнение
+с прошлым месяцем и выбросы.
+
+Данные берутся одним запросом из дневных сумм (``daily_category_totals``),
+поэтому объём работы зависит от длины периода и числа категорий, а не от
+количества трат. Только дни, ушедшие в архив (db/archive.py), суммируются
+по самим архивным тратам. Всё остальное считается векторно в NumPy.
+"""
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from datetime import date
+
+import numpy as np
+from sqlalchemy import func, select
+
+from db.archive import daily_totals
+from db.models import FxRate
+
+TRENDS_DAYS = int(os.getenv("TRENDS_DAYS", "90"))
+TRENDS_WINDOW = int(os.getenv("TRENDS_WINDOW", "7"))
+# Насколько сумма за день должна отклониться от обычной для категории
+TRENDS_Z_THRESHOLD = float(os.getenv("TRENDS_Z_THRESHOLD", "3"))
+
+
+@dataclass
+class Series:
+    """Дневные суммы по категориям в колонках: i-я строка запроса — это
+    ``days[i]``, ``categories[codes[i]]`` и ``totals[i]``."""
+    days: np.ndarray
+    codes: np.ndarray
+    categories: list[str]
+    totals: np.ndarray
+
+
+@dataclass
+class Trends:
+    start: date
+    categories: list[str]
+    daily: np.ndarray
+    rolling: np.ndarray
+    week_starts: np.ndarray
+    weekly: np.ndarray
+    month_current: np.ndarray
+    month_previous: np.ndarray
+    # Пары (номер дня, номер категории) с аномально большими тратами
+    outliers: np.ndarray
+    outlier_totals: np.ndarray
+
+    @property
+    def dates(self) -> np.ndarray:
+        return np.datetime64(self.start, "D") + np.arange(len(self.daily))
+
+    @property
+    def outlier_days(self) -> np.ndarray:
+        return np.unique(self.outliers[:, 0])
+
+
+async def load_series(session, scope: str, since: date, until: date, base_rate: float) -> Series:
+    # Суммы переводятся в базовую валюту так же, как в отчёте: делим на курс
+    # валюты траты, на курс базовой валюты умножаем уже в NumPy
+    totals = daily_totals(scope, since, until)
+    q = (
+        select(
+            totals.c.day,
+            totals.c.category,
+            func.sum(totals.c.total / func.coalesce(FxRate.rate, base_rate)).label("total")
+        )
+        .outerjoin(FxRate, FxRate.currency == totals.c.currency)
+        .group_by(totals.c.day, totals.c.category)
+    )
+    rows = (await session.execute(q)).all()
+    if not rows:
+        return Series(np.array([], dtype="datetime64[D]"), np.array([], dtype=np.intp), [], np.array([]))
+
+    days, categories, totals = zip(*rows)
+    names, codes = np.unique(np.array(categories, dtype=object), return_inverse=True)
+    return Series(
+        days=np.array(days, dtype="datetime64[D]"),
+        codes=codes,
+        categories=[str(name) for name in names],
+        totals=np.array(totals, dtype=float) * base_rate,
+    )
+
+
+def compute_trends(series: Series, start: date, end: date,
+                   window: int = TRENDS_WINDOW, z_threshold: float = TRENDS_Z_THRESHOLD) -> Trends:
+    first = np.datetime64(start, "D")
+    n_days = (end - start).days + 1
+    dates = first + np.arange(n_days)
+
+    # Матрица «день × категория»; дни без трат остаются нулями
+    matrix = np.zeros((n_days, len(series.categories)))
+    np.add.at(matrix, ((series.days - first).astype(np.intp), series.codes), series.totals)
+    daily = matrix.sum(axis=1)
+
+    # Скользящее среднее через накопленные суммы; в начале окно короче
+    cumsum = np.concatenate(([0.0], np.cumsum(daily)))
+    idx = np.arange(n_days)
+    lo = np.maximum(idx + 1 - window, 0)
+    rolling = (cumsum[idx + 1] - cumsum[lo]) / (idx + 1 - lo)
+
+    # Недели начинаются с понедельника (1970-01-01 — четверг, отсюда +3)
+    week_of = (dates.astype(np.int64) + 3) // 7
+    week_bounds = np.flatnonzero(np.r_[True, week_of[1:] != week_of[:-1]])
+    weekly = np.add.reduceat(daily, week_bounds)
+    week_starts = dates[week_bounds] - ((dates[week_bounds].astype(np.int64) + 3) % 7)
+
+    # Текущий месяц сравниваем с тем же числом дней прошлого месяца
+    months = dates.astype("datetime64[M]")
+    day_of_month = (dates - months.astype("datetime64[D]")).astype(np.intp) + 1
+    current_month = months[-1]
+    month_current = matrix[months == current_month].sum(axis=0)
+    month_previous = matrix[(months == current_month - 1) & (day_of_month <= day_of_month[-1])].sum(axis=0)
+
+    # z-оценка считается по каждой категории отдельно и только по дням с тратами:
+    # иначе редкие покупки на фоне нулей все выглядели бы выбросами
+    spent = matrix > 0
+    counts = spent.sum(axis=0)
+    mean = np.divide(matrix.sum(axis=0), counts, out=np.zeros(matrix.shape[1]), where=counts > 0)
+    sq = np.where(spent, (matrix - mean) ** 2, 0.0).sum(axis=0)
+    std = np.sqrt(np.divide(sq, counts, out=np.zeros(matrix.shape[1]), where=counts > 0))
+    z = np.divide(matrix - mean, std, out=np.zeros_like(matrix), where=std > 0)
+    outliers = np.argwhere(spent & (z > z_threshold))
+
+    return Trends(
+        start=start,
+        categories=series.categories,
+        daily=daily,
+        rolling=rolling,
+        week_starts=week_starts,
+        weekly=weekly,
+        month_current=month_current,
+        month_previous=month_previous,
+        outliers=outliers,
+        outlier_totals=matrix[outliers[:, 0], outliers[:, 1]],
+    )
+
+
+def summarize(trends: Trends, currency: str, max_outliers: int = 5) -> str:
+    lines = [
+        f"Всего за период: {trends.daily.sum():.2f} {currency}",
+        f"В среднем за {TRENDS_WINDOW} дн.: {trends.rolling[-1]:.2f} {currency} в день",
+    ]
+
+    changes = []
+    for category, current, previous in zip(trends.categories, trends.month_current, trends.month_previous):
+        if not current and not previous:
+            continue
+        if previous:
+            changes.append(f"{category}: {current:.2f} ({(current - previous) / previous:+.0%})")
+        else:
+            changes.append(f"{category}: {current:.2f} (новое)")
+    if changes:
+        lines.append("\nЭтот месяц против того же периода прошлого:")
+        lines.extend(changes)
+
+    if len(trends.outliers):
+        dates = trends.dates
+        lines.append("\nНеобычно большие траты:")
+        # Самые свежие сверху
+        for (day, code), amount in zip(trends.outliers[::-1][:max_outliers],
+                                       trends.outlier_totals[::-1][:max_outliers]):
+            lines.append(f"{dates[day].item():%d.%m} {trends.categories[code]}: {amount:.2f} {currency}")
+    return "\n".join(lines)
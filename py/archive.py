@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import func, select
+
+from db.archive import archive_cutoff, archive_range
+from db.database import AsyncSessionLocal
+from db.models import Expense
+from db.search import merge_search_index
+
+# Сколько id просматривать за шаг и сколько ждать между шагами: проход
+# растягивается во времени и не отнимает диск у записи трат
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "5000"))
+ARCHIVE_PAUSE = float(os.getenv("ARCHIVE_PAUSE", "0.5"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", str(6 * 3600)))
+# Сколько страниц индекса поиска переписывать за шаг его уплотнения
+ARCHIVE_MERGE_PAGES = int(os.getenv("ARCHIVE_MERGE_PAGES", "100"))
+
+
+class ArchiveJob:
+    """Периодически переносит старые траты в архив (см. db/archive.py).
+
+    Проход идёт по ``expenses`` окнами по ``batch`` подряд идущих id: окно —
+    одно чтение по первичному ключу и перенос найденных в нём старых трат,
+    после него пауза ``pause``. Так за шаг читается не больше ``batch``
+    строк, а записывается пропорционально перенесённому. Импорт задним
+    числом даёт старые траты с новыми id — их подберёт следующий проход.
+
+    Из индекса поиска удалённые строки уходят только при слиянии его
+    сегментов, поэтому после переноса индекс уплотняется такими же шагами —
+    по ``merge_pages`` страниц с паузой.
+    """
+
+    def __init__(self, batch: int = ARCHIVE_BATCH, pause: float = ARCHIVE_PAUSE,
+                 merge_pages: int = ARCHIVE_MERGE_PAGES, clock: Callable[[], datetime] = datetime.utcnow):
+        self.batch = batch
+        self.pause = pause
+        self.merge_pages = merge_pages
+        self.clock = clock
+
+    async def run_pass(self) -> int:
+        """Один проход по всей таблице, возвращает число перенесённых трат."""
+        cutoff = archive_cutoff(self.clock().date())
+        async with AsyncSessionLocal() as session:
+            # min и max в одном SELECT SQLite считает проходом по индексу,
+            # а по отдельности — одним шагом по первичному ключу
+            first = await session.scalar(select(func.min(Expense.id)))
+            last = await session.scalar(select(func.max(Expense.id)))
+        if first is None:
+            return 0
+
+        moved = 0
+        for start in range(first, last + 1, self.batch):
+            async with AsyncSessionLocal() as session:
+                moved += await archive_range(session, start, start + self.batch - 1, cutoff)
+            await asyncio.sleep(self.pause)
+
+        merging = moved > 0
+        while merging:
+            async with AsyncSessionLocal() as session:
+                merging = await merge_search_index(session, self.merge_pages)
+                await session.commit()
+            await asyncio.sleep(self.pause)
+        return moved
+
+    async def run_periodically(self, interval: float = ARCHIVE_INTERVAL):
+        while True:
+            try:
+                started = self.clock()
+                moved = await self.run_pass()
+                if moved:
+                    logging.info("В архив перенесено трат: %d за %s", moved, self.clock() - started)
+            except Exception:
+                logging.exception("Не удалось перенести траты в архив")
+            await asyncio.sleep(interval)
+
@@ -2,21 +2,25 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import math
+import os
 import random
 import string
+import sys
 import tempfile
 
 from aiogram import Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import CommandStart, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.types import Message, InputFile, FSInputFile
-from aiogram.types import ReplyKeyboardRemove, ReplyKeyboardMarkup, KeyboardButton
-import aiohttp
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, CallbackQuery, InputFile, BufferedInputFile, MessageEntity
+from aiogram.types import ReplyKeyboardRemove, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup
 from pathlib import Path
 import json
 
-import matplotlib.pyplot as plt
 from io import BytesIO
 from datetime import datetime, timedelta
 from sqlalchemy import select, func
@@ -24,13 +28,43 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from config import BOT_TOKEN
 from constants import main_keyboard, cancel_keyboard, currency_keyboard, POPULAR_CURRENCIES, categories_keyboard, \
-    comment_keyboard, report_keyboard, settings_keyboard
-
-from db.database import engine, Base
-from sqlalchemy import select, and_, or_
-from db.models import Expense, User, Account
+    comment_keyboard, report_keyboard, settings_keyboard, DEFAULT_CATEGORIES
+
+from charts import renderer, render_empty, render_pie, render_trends, render_members, RendererBusy, \
+    REPORT_IMAGE_EXT, RENDER_PREWARM
+from report_cache import report_cache, report_key, report_since, ReportEntry
+from user_cache import user_cache, CachedUser
+from middlewares import DbSessionMiddleware
+from metrics import HandlerTimingMiddleware, UpdateTimingMiddleware, start_metrics_server, METRICS_PORT
+from expense_writer import expense_writer
+from facts import fact_client, get_fact
+from fsm_storage import create_fsm_storage, expire_periodically, FsmFlushMiddleware
+from fx import fx_rates, refresh_rates, refresh_periodically, BASE_CURRENCY
+from send_queue import MAX_MESSAGE_LENGTH, send_scheduler
+from search import SearchResults, SEARCH_PAGE_SIZE, parse_search, query_key, results_keyboard
+from members import MEMBERS_DAYS, load_breakdown, chart_data, settlement_summary
+from history import HistoryPage, fetch_page, format_expenses, page_keyboard
+from digest import DigestJob, DIGESTS, DIGEST_HOUR
+from recurring import recurring_scheduler, next_run, PERIODS, PERIOD_NAMES
+from budgets import BudgetNotifier, reconcile_periodically
+from archive import ArchiveJob
+from transfer import ExpenseCsvFile, ImportFileError, import_expenses, iter_import_rows, CSV_COLUMNS, \
+    IMPORT_SPOOL_SIZE
+from db.database import engine, Base, upsert
+from db.migrations import upgrade, schema_version, SCHEMA_VERSION
+from sqlalchemy import select, update, delete, and_, or_
+from db.models import Expense, User, Account, FxRate, Budget, RecurringExpense
+from db.budgets import budget_level, current_month, reconcile_budgets
+from db.rollup import expense_scope
+from db.expenses import bump_data_version
+from db.search import search_expenses
+from db.archive import ARCHIVE_AFTER_DAYS, category_totals
 from db.database import get_session
 
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# MIGRATE_ON_START=1 — при устаревшей схеме мигрировать самим, а не останавливаться
+MIGRATE_ON_START = os.getenv("MIGRATE_ON_START", "0") == "1"
+
 
 class Form(StatesGroup):
     menu = State()
@@ -43,22 +77,64 @@ class Form(StatesGroup):
     settings = State()
     join_account_h = State()
     create_account = State()
+    import_file = State()
 
 
 async def init_db():
+    """Создаёт и обновляет схему; запускается отдельно: python bot.py migrate."""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade)
+
+
+async def check_db():
+    """При старте только сверяет версию схемы — один запрос вместо create_all.
+
+    Более новая схема тоже подходит: миграции лишь добавляют таблицы и
+    колонки, поэтому при раскатке старые процессы работают с новой базой.
+    """
+    async with engine.connect() as conn:
+        version = await conn.run_sync(schema_version)
+    if version is not None and version >= SCHEMA_VERSION:
+        return
+    if MIGRATE_ON_START:
+        await init_db()
+        return
+    raise SystemExit(
+        f"Схема базы устарела (версия {version}, нужна {SCHEMA_VERSION}). "
+        "Запустите: python bot.py migrate"
+    )
 
 
-async def get_or_create_user(tg_id: int, session):
+async def get_or_create_user(tg_id: int, session, name: str | None = None):
     user = await session.scalar(select(User).where(User.tg_id == tg_id))
     if not user:
-        user = User(tg_id=tg_id)
+        user = User(tg_id=tg_id, name=name)
         session.add(user)
         await session.commit()
+    elif name and user.name != name:
+        # Имя показывается в разбивке по участникам; обновляем, раз уж строка загружена
+        user.name = name
+        await session.commit()
+    user_cache.put(tg_id, user.id, user.account_id, user.base_currency)
     return user
 
 
+async def resolve_user(tg_id: int, session, create: bool = True) -> CachedUser | None:
+    # Большинству хендлеров нужен только id и счёт пользователя — берём из кэша
+    cached = user_cache.get(tg_id)
+    if cached is not None:
+        return cached
+
+    if create:
+        user = await get_or_create_user(tg_id, session)
+    else:
+        user = await session.scalar(select(User).where(User.tg_id == tg_id))
+        if user is None:
+            return None
+    return user_cache.put(tg_id, user.id, user.account_id, user.base_currency)
+
+
 async def get_user_expenses(user_id: int):
     async for session in get_session():
         result = await session.execute(
@@ -71,114 +147,170 @@ async def add_expense(user_id: int,
                       amount: float,
                       currency: str,
                       category: str,
-                      comment: str = ""):
-    async for session in get_session():
-        user: User = await session.scalar(
-            select(User).where(User.tg_id == user_id)
-        )
-        if user is None:
-            return
-
-        expense = Expense(
-            user_id=user_id,
-            account_id=user.account_id,
-            amount=amount,
-            currency=currency,
-            category=category,
-            comment=comment,
-            created_at=datetime.utcnow()
-        )
-        session.add(expense)
-        await session.commit()
-
-
-async def get_fact(number: int) -> str:
-    url = f"http://numbersapi.com/{number}"
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            if resp.status != 200:
-                return "Не удалось получить забавный факт"
-            fact = await resp.text()
-
-    return fact
+                      comment: str = "",
+                      *,
+                      session: AsyncSession):
+    user = await resolve_user(user_id, session, create=False)
+    if user is None:
+        return
 
+    # Сама запись в базу происходит пачкой в фоне, см. ExpenseWriter
+    await expense_writer.add(dict(
+        user_id=user_id,
+        account_id=user.account_id,
+        amount=amount,
+        currency=currency,
+        category=category,
+        comment=comment,
+        created_at=datetime.utcnow()
+    ))
 
-async def generate_expense_report(days: int,
-                                  user_id: int,
-                                  session: AsyncSession) -> BytesIO:
-    since = datetime.utcnow() - timedelta(days=days)
 
-    user: User = await session.scalar(
-        select(User).where(User.tg_id == user_id)
-    )
+async def report_context(user_id: int, session: AsyncSession) -> tuple[str, int, str]:
+    """Область трат, версия её данных и валюта отчёта — из них строятся ключи кэша."""
+    user = await resolve_user(user_id, session, create=False)
     if user is None:
         raise ValueError("Пользователь не найден")
 
+    await expense_writer.flush()
+
+    scope = expense_scope(user.account_id, user_id)
     if user.account_id is not None:
-        account_filter = Expense.account_id == user.account_id
+        version = await session.scalar(select(Account.data_version).where(Account.id == user.account_id))
     else:
-        account_filter = and_(
-            Expense.account_id.is_(None),
-            Expense.user_id == user_id
-        )
+        version = await session.scalar(select(User.data_version).where(User.id == user.id))
+    return scope, version, user.base_currency or BASE_CURRENCY
+
 
+async def generate_expense_report(days: int,
+                                  user_id: int,
+                                  session: AsyncSession) -> tuple[tuple, ReportEntry]:
+    scope, version, base = await report_context(user_id, session)
+    since = report_since(days)
+    key = report_key(scope, version, days, since, base, fx_rates.as_of)
+    entry = report_cache.get(key)
+    if entry is not None:
+        return key, entry
+
+    # Переводим суммы в базовую валюту прямо в агрегации: делим на курс
+    # валюты траты, а на курс базовой валюты умножаем уже итог. Валюта без
+    # курса делится на base_rate, то есть не пересчитывается, как в fx_rates.convert
+    base_rate = fx_rates.rate(base)
+    # Дневные суммы свежих трат вместе с месячными суммами архива, см. db/archive.py
+    totals = category_totals(scope, since)
     q = (
         select(
-            Expense.category,
-            func.sum(Expense.amount).label("total")
-        )
-        .where(
-            account_filter,
-            Expense.created_at >= since
+            totals.c.category,
+            func.sum(totals.c.total / func.coalesce(FxRate.rate, base_rate)).label("total")
         )
-        .group_by(Expense.category)
+        .outerjoin(FxRate, FxRate.currency == totals.c.currency)
+        .group_by(totals.c.category)
     )
     result = await session.execute(q)
     data = result.all()
 
     if not data:
-        buf = BytesIO()
-        plt.figure(figsize=(4, 4))
-        plt.text(0.5, 0.5, "Нет трат за период", ha="center", va="center", fontsize=14)
-        plt.axis("off")
-        plt.savefig(buf, format="png", bbox_inches="tight")
-        plt.close()
-        buf.seek(0)
-        return buf
-
-    categories, totals = zip(*data)
-    total_sum = sum(totals)
-
-    fig, ax = plt.subplots(figsize=(6, 6))
-    ax.pie(totals, labels=categories, autopct="%1.1f%%", startangle=90)
-    ax.set_title(f"Траты за {days} дн.", fontsize=14)
-
-    plt.figtext(0.5, 0.02, f"Всего потрачено: {total_sum:.2f}", ha="center", fontsize=12)
-
-    buf = BytesIO()
-    fig.savefig(buf, format="png", bbox_inches="tight")
-    plt.close(fig)
-    buf.seek(0)
-    return buf
+        png = await renderer.render(render_empty)
+    else:
+        categories, totals = zip(*data)
+        totals = [total * base_rate for total in totals]
+        png = await renderer.render(render_pie, list(categories), totals, days, base)
+    return key, report_cache.put(key, png)
+
+
+async def generate_trends_report(days: int,
+                                 user_id: int,
+                                 session: AsyncSession) -> tuple[tuple, ReportEntry]:
+    # numpy нужен только трендам — не тянем его при старте бота
+    from analytics import load_series, compute_trends, summarize
+
+    until = datetime.utcnow().date()
+    since = until - timedelta(days=days - 1)
+
+    scope, version, base = await report_context(user_id, session)
+    key = ("trends", scope, version, days, until, base, fx_rates.as_of)
+    entry = report_cache.get(key)
+    if entry is not None:
+        return key, entry
+
+    series = await load_series(session, scope, since, until, fx_rates.rate(base))
+    if not len(series.totals):
+        png = await renderer.render(render_empty)
+        return key, report_cache.put(key, png, caption="Нет трат за период")
+
+    trends = compute_trends(series, since, until)
+    png = await renderer.render(
+        render_trends, trends.dates, trends.daily, trends.rolling,
+        trends.week_starts, trends.weekly, trends.outlier_days, base
+    )
+    return key, report_cache.put(key, png, caption=summarize(trends, base))
 
 
-async def command_start(message: Message, state: FSMContext):
-    async for session in get_session():
-        await get_or_create_user(message.from_user.id, session)
+async def generate_members_report(days: int,
+                                  user_id: int,
+                                  session: AsyncSession) -> tuple[tuple, ReportEntry, str]:
+    scope, version, base = await report_context(user_id, session)
+    since = report_since(days)
+    key = ("members", *report_key(scope, version, days, since, base, fx_rates.as_of))
+    # График общий для счёта, а расчёт «вам должны» / «с вас» у каждого
+    # участника свой, поэтому подпись кэшируется отдельно под его id
+    caption_key = (*key, user_id)
+    entry = report_cache.get(key)
+    caption = report_cache.get(caption_key)
+    if entry is not None and caption is not None:
+        return key, entry, caption.caption
+
+    user = await resolve_user(user_id, session, create=False)
+    # Один сгруппированный запрос на весь счёт, сколько бы ни было участников
+    breakdown = await load_breakdown(session, user.account_id, since, fx_rates.rate(base))
+    if not any(breakdown.paid().values()):
+        if entry is None:
+            entry = report_cache.put(key, await renderer.render(render_empty))
+        text = "Нет трат за период"
+    else:
+        if entry is None:
+            labels, rows = chart_data(breakdown)
+            png = await renderer.render(render_members, labels, breakdown.categories, rows, days, base)
+            entry = report_cache.put(key, png)
+        text = settlement_summary(breakdown, user_id, days, base)
+    report_cache.put(caption_key, None, caption=text)
+    return key, entry, text
+
+
+MENU_TEXT = (
+    "Ваши личные траты в удобном месте!\n\n"
+    "Можете воспользоваться такими командами:\n"
+    "/add — добавить трату\n"
+    "/report — посмотреть отчет\n"
+    "/trends — динамика трат и необычные расходы\n"
+    "/members — кто сколько потратил в общем счёте и кто кому должен\n"
+    "/cancel — отменить ввод\n"
+    "/settings — настройки счета\n"
+    "/base — валюта отчетов\n"
+    "/budget — месячные бюджеты по категориям\n"
+    "/recurring — повторяющиеся траты\n"
+    "/digest — сводка трат раз в неделю или месяц\n"
+    "/export, /import — выгрузить или загрузить траты файлом\n"
+    "/history — все траты по страницам\n"
+    "/search — поиск по комментариям и категориям\n"
+    "/last - последние 3 траты"
+)
+
+
+async def command_start(message: Message, state: FSMContext, session: AsyncSession, notice: str | None = None):
+    """Показывает меню; ``notice`` — ответ на предыдущее действие, он уходит одним сообщением с меню."""
+    await resolve_user(message.from_user.id, session)
     await state.set_state(Form.menu)
-    await message.answer(
-        "Ваши личные траты в удобном месте!\n\n"
-        "Можете воспользоваться такими командами:\n"
-        "/add — добавить трату\n"
-        "/report — посмотреть отчет\n"
-        "/cancel — отменить ввод\n"
-        "/settings — настройки счета\n"
-        "/last - последние 3 траты", reply_markup=main_keyboard
-    )
+    text = MENU_TEXT
+    if notice is not None:
+        if len(notice) + len(MENU_TEXT) + 2 <= MAX_MESSAGE_LENGTH:
+            text = f"{notice}\n\n{MENU_TEXT}"
+        else:
+            await message.answer(notice)
+    await message.answer(text, reply_markup=main_keyboard)
 
 
-async def settings_menu(message: Message, state: FSMContext):
+async def settings_menu(message: Message, state: FSMContext, session: AsyncSession):
     await state.set_state(Form.settings)
     await message.answer(
         "Выберете пункт:\n\n"
@@ -189,7 +321,7 @@ async def settings_menu(message: Message, state: FSMContext):
     )
 
 
-async def navigation_settings(message: Message, state: FSMContext):
+async def navigation_settings(message: Message, state: FSMContext, session: AsyncSession):
     text = message.text.strip()
 
     if text == "Подключиться к существующему счету":
@@ -197,32 +329,33 @@ async def navigation_settings(message: Message, state: FSMContext):
         await message.answer("Введите код счёта и пароль через пробел:")
 
     elif text == "Создать новый счет":
-        await create_account(message, state)
+        await create_account(message, state, session)
 
     elif text == "Покинуть текущий счет":
-        await leave_account(message, state)
+        await leave_account(message, state, session)
 
     elif text == "Назад в меню":
         await state.set_state(Form.menu)
-        await command_start(message, state)
+        await command_start(message, state, session)
     elif text == "Получить код и пароль счета":
-        await show_account_credentials(message, state)
+        await show_account_credentials(message, state, session)
 
     else:
         await message.answer("Неизвестная команда. Пожалуйста, выберите из меню.")
 
 
-async def cancel_handler(message: Message, state: FSMContext):
+async def cancel_handler(message: Message, state: FSMContext, session: AsyncSession):
     current_state = await state.get_state()
-    if current_state not in (Form.amount, Form.currency, Form.category, Form.comment, Form.report_get_data):
+    if current_state not in (Form.amount, Form.currency, Form.category, Form.comment, Form.report_get_data,
+                             Form.import_file):
         return
     logging.info("Отмена на шаге %r", current_state)
     await state.clear()
     await state.set_state(Form.menu)
-    await command_start(message, state)
+    await command_start(message, state, session)
 
 
-async def add_expense_start(message: Message, state: FSMContext):
+async def add_expense_start(message: Message, state: FSMContext, session: AsyncSession):
     await state.set_state(Form.amount)
     await message.answer(
         f"Начало добавления траты...\n"
@@ -230,36 +363,176 @@ async def add_expense_start(message: Message, state: FSMContext):
     )
 
 
-async def add_expense_amount(message: Message, state: FSMContext):
+async def add_expense_amount(message: Message, state: FSMContext, session: AsyncSession):
     try:
         temp = message.text.replace(",", ".").replace(" ", "")
         amount = float(temp)
         await state.update_data(amount=amount)
-        await state.update_data(currency="RUB")
+        await state.set_state(Form.currency)
+        await message.answer("Выберите валюту траты:", reply_markup=currency_keyboard)
+    except ValueError:
+        await message.answer("Введите число.")
+
+
+async def add_expense_currency(message: Message, state: FSMContext, session: AsyncSession):
+    currency = message.text.upper().replace(" ", "")
+    if currency in POPULAR_CURRENCIES:
+        await state.update_data(currency=currency)
         await state.set_state(Form.category)
         await message.answer("Теперь введите категорию траты:", reply_markup=categories_keyboard)
+    else:
+        await message.answer("Походу такой валюты нет у нас в базе данных...((\nПопробуйте еще раз")
+
+
+async def set_base_currency(message: Message, state: FSMContext, session: AsyncSession):
+    parts = message.text.split()
+    user = await resolve_user(message.from_user.id, session)
+    if len(parts) != 2 or parts[1].upper() not in POPULAR_CURRENCIES:
+        await message.answer(
+            f"Отчеты сейчас считаются в {user.base_currency or BASE_CURRENCY}.\n"
+            "Чтобы сменить валюту, напишите, например: /base USD"
+        )
+        return
+
+    currency = parts[1].upper()
+    await session.execute(update(User).where(User.tg_id == user.tg_id).values(base_currency=currency))
+    await session.commit()
+    user_cache.invalidate(user.tg_id)
+    await command_start(message, state, session, notice=f"Теперь отчеты будут в {currency}.")
+
+
+async def budget_command(message: Message, state: FSMContext, session: AsyncSession):
+    user = await resolve_user(message.from_user.id, session)
+    scope = expense_scope(user.account_id, user.tg_id)
+    parts = message.text.split()
+    await expense_writer.flush()
+
+    if len(parts) == 1:
+        budgets = (await session.scalars(
+            select(Budget).where(Budget.scope == scope).order_by(Budget.category)
+        )).all()
+        month = current_month()
+        lines = []
+        for b in budgets:
+            spent = b.spent if b.month == month else 0.0
+            lines.append(f"{b.category}: {spent:.2f} из {b.amount:.2f} {b.currency} ({spent / b.amount:.0%})")
+        await message.answer(
+            ("Бюджеты на этот месяц:\n" + "\n".join(lines) if lines else "Бюджетов пока нет.") +
+            "\n\nЗадать бюджет: /budget Еда 15000 RUB\nУбрать: /budget Еда 0"
+        )
+        return
+
+    category = next((c for c in DEFAULT_CATEGORIES if c.casefold() == parts[1].casefold()), None)
+    try:
+        amount = float(parts[2].replace(",", ".")) if len(parts) > 2 else None
     except ValueError:
-        await message.answer("Введите число.")
+        amount = None
+    currency = parts[3].upper() if len(parts) > 3 else user.base_currency or BASE_CURRENCY
+    # nan и inf float() тоже понимает; 0 и меньше — это «убрать бюджет»
+    if category is None or amount is None or not math.isfinite(amount) or currency not in POPULAR_CURRENCIES:
+        await message.answer(
+            f"Напишите категорию, сумму и, если нужно, валюту, например: /budget Еда 15000 RUB\n\n"
+            f"Категории: {', '.join(DEFAULT_CATEGORIES)}"
+        )
+        return
+
+    if amount <= 0:
+        await session.execute(delete(Budget).where(Budget.scope == scope, Budget.category == category))
+        await session.commit()
+        await message.answer(f"Бюджет «{category}» убран.")
+        return
+
+    stmt = upsert(Budget).values(scope=scope, category=category, amount=amount, currency=currency)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["scope", "category"],
+        set_={"amount": stmt.excluded.amount, "currency": stmt.excluded.currency},
+    )
+    await session.execute(stmt)
+    # Уже потраченное в этом месяце считаем сразу, а о пройденных порогах не предупреждаем задним числом
+    await reconcile_budgets(session, scope, category)
+    budget = await session.scalar(
+        select(Budget).where(Budget.scope == scope, Budget.category == category)
+        .execution_options(populate_existing=True)
+    )
+    budget.notified = budget_level(budget.spent, budget.amount)
+    await session.commit()
+    await message.answer(
+        f"Бюджет «{category}»: {amount:.2f} {currency} в месяц.\n"
+        f"В этом месяце уже потрачено {budget.spent:.2f} {currency} ({budget.spent / amount:.0%})."
+    )
+
 
+async def recurring_command(message: Message, state: FSMContext, session: AsyncSession):
+    user = await resolve_user(message.from_user.id, session)
+    parts = message.text.split(maxsplit=5)
+    usage = (
+        "Добавить: /recurring месяц 30000 RUB Дом Аренда\n"
+        "Период — день, неделя или месяц, комментарий можно не писать.\n"
+        "Удалить: /recurring удалить <номер>"
+    )
 
-# async def add_expense_currency(message: Message, state: FSMContext):
-#     currency = message.text.upper().replace(" ", "")
-#     if currency in POPULAR_CURRENCIES:
-#         await state.update_data(currency=currency)
-#         await state.set_state(Form.category)
-#         await message.answer("Теперь введите категорию траты:", reply_markup=categories_keyboard)
-#     else:
-#         await message.answer("Походу такой валюты нет у нас в базе данных...((\nПопробуйте еще раз")
+    if len(parts) == 1:
+        rules = (await session.scalars(
+            select(RecurringExpense).where(RecurringExpense.user_id == user.tg_id).order_by(RecurringExpense.id)
+        )).all()
+        lines = [
+            f"#{r.id}: {r.amount} {r.currency} — {r.category}, {PERIOD_NAMES[r.period]}, "
+            f"следующая {r.next_run_at:%d.%m.%Y}" + (f" ({r.comment})" if r.comment else "")
+            for r in rules
+        ]
+        await message.answer(
+            ("Повторяющиеся траты:\n" + "\n".join(lines) if lines else "Повторяющихся трат пока нет.") +
+            "\n\n" + usage
+        )
+        return
+
+    if parts[1].casefold() == "удалить" and len(parts) == 3 and parts[2].lstrip("#").isdigit():
+        result = await session.execute(
+            delete(RecurringExpense)
+            .where(RecurringExpense.id == int(parts[2].lstrip("#")), RecurringExpense.user_id == user.tg_id)
+        )
+        await session.commit()
+        await message.answer("Повторяющаяся трата удалена." if result.rowcount else "Такой повторяющейся траты нет.")
+        return
+
+    period = PERIODS.get(parts[1].casefold())
+    try:
+        amount = float(parts[2].replace(",", ".")) if len(parts) > 2 else None
+    except ValueError:
+        amount = None
+    currency = parts[3].upper() if len(parts) > 3 else None
+    category = next((c for c in DEFAULT_CATEGORIES if len(parts) > 4 and c.casefold() == parts[4].casefold()), None)
+    # float() понимает и "nan", и "inf": такая трата не запишется в базу
+    if (period is None or amount is None or not (math.isfinite(amount) and amount > 0)
+            or currency not in POPULAR_CURRENCIES or category is None):
+        await message.answer(f"{usage}\n\nКатегории: {', '.join(DEFAULT_CATEGORIES)}")
+        return
+    comment = parts[5] if len(parts) > 5 else ""
+
+    # Первая трата — сразу, обычным путём; дальше её повторяет планировщик
+    now = datetime.utcnow()
+    await add_expense(message.from_user.id, amount, currency, category, comment, session=session)
+    rule = RecurringExpense(
+        user_id=user.tg_id, amount=amount, currency=currency, category=category, comment=comment,
+        period=period, start_at=now, next_run_at=next_run(now, period, now.day)
+    )
+    session.add(rule)
+    await session.commit()
+    recurring_scheduler.schedule(rule.id, rule.next_run_at)
+    await message.answer(
+        f"Готово: {amount} {currency} — {category} {PERIOD_NAMES[period]}. "
+        f"Первая трата уже добавлена, следующая {rule.next_run_at:%d.%m.%Y}."
+    )
 
 
-async def add_expense_category(message: Message, state: FSMContext):
+async def add_expense_category(message: Message, state: FSMContext, session: AsyncSession):
     category = message.text
     await state.update_data(category=category)
     await state.set_state(Form.comment)
     await message.answer("Можете добавить комментарий или пропустить этот шаг:", reply_markup=comment_keyboard)
 
 
-async def process_comment(message: Message, state: FSMContext):
+async def process_comment(message: Message, state: FSMContext, session: AsyncSession):
     comment = message.text
     if comment.lower() == "пропустить":
         comment = ""
@@ -269,22 +542,24 @@ async def process_comment(message: Message, state: FSMContext):
     currency = data["currency"]
     category = data["category"]
 
+    # Факт запрашиваем параллельно с записью траты и ждём его ограниченное время
+    fact_task = asyncio.ensure_future(get_fact(int(float(amount))))
     await add_expense(
         user_id=message.from_user.id,
         amount=amount,
         currency=currency,
         category=category,
-        comment=comment
+        comment=comment,
+        session=session
     )
 
-    fact = await get_fact(int(float(amount)))
-    await message.answer(f"The expense is saved!\n\nFact: {fact}")
+    fact = await fact_client.within_budget(fact_task)
     await state.clear()
     await state.set_state(Form.menu)
-    await command_start(message, state)
+    await command_start(message, state, session, notice=f"The expense is saved!\n\nFact: {fact}")
 
 
-async def report_process(message: Message, state: FSMContext):
+async def report_process(message: Message, state: FSMContext, session: AsyncSession):
     await state.set_state(Form.report_get_data)
     await message.answer(
         f"Выберете сколько дней учитывать в отчете:",
@@ -292,7 +567,7 @@ async def report_process(message: Message, state: FSMContext):
     )
 
 
-async def report_process_get_data(message: Message, state: FSMContext):
+async def report_process_get_data(message: Message, state: FSMContext, session: AsyncSession):
     await message.answer(
         f"Ваш запрос принят. Подождите..."
     )
@@ -300,172 +575,378 @@ async def report_process_get_data(message: Message, state: FSMContext):
     if message.text == "За весь период":
         days = "10000"
     try:
-        async for session in get_session():
-            buf: BytesIO = await generate_expense_report(int(days), message.from_user.id, session)
+        key, entry = await generate_expense_report(int(days), message.from_user.id, session)
+
+        if entry.file_id is not None:
+            # Такой отчёт уже отправляли — не рисуем и не загружаем заново
+            await message.answer_photo(entry.file_id, caption="Вот ваш отчёт")
+        else:
+            # Отдаём буфер из памяти напрямую, без временного файла на диске
+            photo = BufferedInputFile(entry.png, filename=f"report.{REPORT_IMAGE_EXT}")
+            sent = await message.answer_photo(photo, caption="Вот ваш отчёт")
+            logging.info("Отчёт загружен из памяти: %d байт %s", len(entry.png), REPORT_IMAGE_EXT)
+            report_cache.remember_file_id(key, sent.photo[-1].file_id)
+        await command_start(message, state, session)
 
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-            buf.seek(0)
-            tmp.write(buf.read())
-            tmp_path = tmp.name
+    except ValueError:
+        await message.answer(
+            f"Не получилось понять сколько это дней... Попробуйте написать количество дней"
+        )
+    except RendererBusy:
+        await message.answer("Сейчас слишком много запросов на отчёты. Попробуйте через минуту.")
 
-        photo = FSInputFile(tmp_path)
-        await message.answer_photo(photo, caption="Вот ваш отчёт")
 
-        import os
-        os.remove(tmp_path)
-        await command_start(message, state)
+async def trends_report(message: Message, state: FSMContext, session: AsyncSession):
+    from analytics import TRENDS_DAYS
 
+    await resolve_user(message.from_user.id, session)
+    # /trends 30 — за последние 30 дней, без числа — за TRENDS_DAYS
+    parts = message.text.split()
+    try:
+        days = int(parts[1]) if len(parts) > 1 else TRENDS_DAYS
     except ValueError:
+        days = 0
+    if not 1 < days <= 3660:
+        await message.answer("Напишите количество дней, например: /trends 90")
+        return
+
+    try:
+        key, entry = await generate_trends_report(days, message.from_user.id, session)
+    except RendererBusy:
+        await message.answer("Сейчас слишком много запросов на отчёты. Попробуйте через минуту.")
+        return
+
+    if entry.file_id is not None:
+        await message.answer_photo(entry.file_id)
+    else:
+        photo = BufferedInputFile(entry.png, filename=f"trends.{REPORT_IMAGE_EXT}")
+        sent = await message.answer_photo(photo)
+        report_cache.remember_file_id(key, sent.photo[-1].file_id)
+    # Подпись к фото ограничена 1024 символами, поэтому сводку шлём отдельно
+    await message.answer(entry.caption)
+
+
+async def members_report(message: Message, state: FSMContext, session: AsyncSession):
+    user = await get_or_create_user(message.from_user.id, session, message.from_user.full_name)
+    if user.account_id is None:
+        await message.answer("Разбивка по участникам есть только у общего счёта. "
+                             "Создайте его или подключитесь в /settings.")
+        return
+
+    # /members 90 — за последние 90 дней, без числа — за MEMBERS_DAYS
+    parts = message.text.split()
+    try:
+        days = int(parts[1]) if len(parts) > 1 else MEMBERS_DAYS
+    except ValueError:
+        days = 0
+    if not 0 < days <= 10000:
+        await message.answer("Напишите количество дней, например: /members 30")
+        return
+
+    try:
+        key, entry, caption = await generate_members_report(days, message.from_user.id, session)
+    except RendererBusy:
+        await message.answer("Сейчас слишком много запросов на отчёты. Попробуйте через минуту.")
+        return
+
+    if entry.file_id is not None:
+        await message.answer_photo(entry.file_id)
+    else:
+        photo = BufferedInputFile(entry.png, filename=f"members.{REPORT_IMAGE_EXT}")
+        sent = await message.answer_photo(photo)
+        report_cache.remember_file_id(key, sent.photo[-1].file_id)
+    # Список переводов может не влезть в подпись к фото
+    await message.answer(caption)
+
+
+async def digest_command(message: Message, state: FSMContext, session: AsyncSession):
+    user = await resolve_user(message.from_user.id, session)
+    parts = message.text.split()
+    kinds = {"неделя": "week", "месяц": "month", "выкл": None}
+    if len(parts) != 2 or parts[1].casefold() not in kinds:
+        digest = await session.scalar(select(User.digest).where(User.tg_id == user.tg_id))
+        current = f"за {DIGESTS[digest][1]}" if digest else "выключена"
         await message.answer(
-            f"Не получилось понять сколько это дней... Попробуйте написать количество дней"
+            f"Сводка трат сейчас: {current}.\n\n"
+            "Включить: /digest неделя или /digest месяц\nВыключить: /digest выкл"
         )
+        return
 
+    kind = kinds[parts[1].casefold()]
+    # Первый выпуск — в начале следующего периода, а не сразу после подписки
+    await session.execute(
+        update(User).where(User.tg_id == user.tg_id)
+        .values(digest=kind, digest_sent_on=datetime.utcnow().date())
+    )
+    await session.commit()
+    if kind is None:
+        await message.answer("Сводка трат выключена.")
+    else:
+        start = "в понедельник" if kind == "week" else "1-го числа"
+        await message.answer(f"Готово: сводка за {DIGESTS[kind][1]} будет приходить {start} после {DIGEST_HOUR}:00 UTC.")
+
+
+async def export_expenses(message: Message, state: FSMContext, session: AsyncSession):
+    user = await resolve_user(message.from_user.id, session)
+    await expense_writer.flush()
+
+    # Файл формируется по ходу загрузки, целиком в память он не попадает
+    document = ExpenseCsvFile(
+        session,
+        user.account_id,
+        user.tg_id,
+        filename=f"expenses_{datetime.utcnow():%Y-%m-%d}.csv"
+    )
+    await message.answer_document(document, caption="Все ваши траты в CSV")
+    logging.info("Экспорт: %d трат", document.rows_written)
+    await command_start(message, state, session)
 
-async def leave_account(message: Message, state: FSMContext):
-    async for session in get_session():
-        user = await get_or_create_user(message.from_user.id, session)
 
-        if not user.account_id:
-            await message.answer("Вы не подключены ни к какому счёту.")
+async def import_start(message: Message, state: FSMContext, session: AsyncSession):
+    await state.set_state(Form.import_file)
+    await message.answer(
+        "Пришлите CSV или XLSX файл с колонками:\n"
+        f"{', '.join(CSV_COLUMNS)}\n\n"
+        f"Категории: {', '.join(DEFAULT_CATEGORIES)}\n"
+        "Дата в формате 2024-01-31 12:00, если её нет — будет текущая.",
+        reply_markup=cancel_keyboard
+    )
+
+
+async def import_expenses_file(message: Message, state: FSMContext, session: AsyncSession):
+    user = await resolve_user(message.from_user.id, session)
+    document = message.document
+    await message.answer("Загружаю траты, это может занять время...")
+
+    # Небольшие файлы остаются в памяти, большие уходят на диск — разбираем потоком
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE) as f:
+        await message.bot.download(document, destination=f)
+        try:
+            imported, errors = await import_expenses(
+                session, iter_import_rows(f, document.file_name or ""), user.tg_id, user.account_id,
+                on_budget_alerts=expense_writer.on_budget_alerts
+            )
+        except ImportFileError as e:
+            text = str(e)
+            if e.imported:
+                # Пачки до этого места уже в базе: повторно присылать нужно только остаток файла
+                text += f"\n\nСтроки начиная с {e.line} не загружены, до неё добавлено трат: {e.imported}."
+            await message.answer(text)
             return
 
-        user.account_id = None
-        await session.commit()
+    text = f"Добавлено трат: {imported}"
+    if errors:
+        text += "\n\nПропущены строки с ошибками:\n" + "\n".join(errors)
+    await state.set_state(Form.menu)
+    await command_start(message, state, session, notice=text)
+
+
+async def leave_account(message: Message, state: FSMContext, session: AsyncSession):
+    user = await get_or_create_user(message.from_user.id, session, message.from_user.full_name)
+
+    if not user.account_id:
+        await message.answer("Вы не подключены ни к какому счёту.")
+        return
+
+    await bump_data_version(session, user_id=user.tg_id, account_id=user.account_id)
+    user.account_id = None
+    await session.commit()
+    user_cache.invalidate(user.tg_id)
 
-    await message.answer("Вы вышли из общего счёта. Ваши старые траты сохранены.")
     await state.set_state(Form.menu)
-    await command_start(message, state)
+    await command_start(message, state, session, notice="Вы вышли из общего счёта. Ваши старые траты сохранены.")
 
 
-async def create_account(message: Message, state: FSMContext):
-    async for session in get_session():
-        user = await get_or_create_user(message.from_user.id, session)
+async def create_account(message: Message, state: FSMContext, session: AsyncSession):
+    user = await get_or_create_user(message.from_user.id, session, message.from_user.full_name)
 
-        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        password = ''.join(random.choices(string.ascii_letters + string.digits, k=6))
+    code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+    password = ''.join(random.choices(string.ascii_letters + string.digits, k=6))
 
-        account = Account(code=code, password=password)
-        session.add(account)
-        await session.flush()
+    account = Account(code=code, password=password)
+    session.add(account)
+    await session.flush()
 
-        user.account_id = account.id
-        await session.commit()
+    user.account_id = account.id
+    await session.commit()
+    user_cache.invalidate(user.tg_id)
 
-    await message.answer(
+    await state.set_state(Form.menu)
+    await command_start(message, state, session, notice=(
         f"Новый счёт создан!\n\n"
         f"Код счёта: {code}\n"
         f"Пароль: {password}\n\n"
         "Передайте эти данные тем, с кем хотите поделиться."
-    )
-
-    await state.set_state(Form.menu)
-    await command_start(message, state)
+    ))
 
 
-async def process_join(message: Message, state: FSMContext):
+async def process_join(message: Message, state: FSMContext, session: AsyncSession):
     parts = message.text.strip().split()
     if len(parts) != 2:
         await message.answer("Неверный формат. Попробуйте ещё раз:\n<code>код пароль</code>")
         return
 
     code, password = parts
-    async for session in get_session():
-        account = await session.scalar(
-            select(Account).where(Account.code == code, Account.password == password)
-        )
-        if not account:
-            await message.answer("Неверный код или пароль. Попробуйте ещё.")
-            return
+    account = await session.scalar(
+        select(Account).where(Account.code == code, Account.password == password)
+    )
+    if not account:
+        await message.answer("Неверный код или пароль. Попробуйте ещё.")
+        return
 
-        user = await get_or_create_user(message.from_user.id, session)
-        user.account_id = account.id
-        await session.commit()
+    user = await get_or_create_user(message.from_user.id, session, message.from_user.full_name)
+    await bump_data_version(session, user_id=user.tg_id, account_id=user.account_id)
+    await bump_data_version(session, account_id=account.id)
+    user.account_id = account.id
+    await session.commit()
+    user_cache.invalidate(user.tg_id)
 
-    await message.answer("Вы успешно подключились к счёту!")
     await state.clear()
     await state.set_state(Form.menu)
-    await command_start(message, state)
+    await command_start(message, state, session, notice="Вы успешно подключились к счёту!")
 
 
-async def show_account_credentials(message: Message, state: FSMContext):
-    async for session in get_session():
-        user: User = await get_or_create_user(message.from_user.id, session)
+async def show_account_credentials(message: Message, state: FSMContext, session: AsyncSession):
+    user = await resolve_user(message.from_user.id, session)
 
-        if not user.account_id:
-            await message.answer("Вы не подключены ни к какому счёту.")
-            await state.set_state(Form.menu)
-            await command_start(message, state)
-            return
+    if not user.account_id:
+        await state.set_state(Form.menu)
+        await command_start(message, state, session, notice="Вы не подключены ни к какому счёту.")
+        return
 
-        account: Account = await session.scalar(
-            select(Account).where(Account.id == user.account_id)
-        )
-        if not account:
-            await message.answer("Ошибка: ваш счёт не найден. Обратитесь к администратору.")
-            await state.set_state(Form.menu)
-            await command_start(message, state)
-            return
+    account: Account = await session.scalar(
+        select(Account).where(Account.id == user.account_id)
+    )
+    if not account:
+        await state.set_state(Form.menu)
+        await command_start(message, state, session,
+                            notice="Ошибка: ваш счёт не найден. Обратитесь к администратору.")
+        return
 
-        await message.answer(
-            f"Если вы хотите поделиться счетом, то пусть человек перешлет следующее сообщение сюда же (Код и пароль):"
-        )
-        await message.answer(
-            f"{account.code} {account.password}"
-        )
+    # Код и пароль уходят отдельным сообщением ровно в том виде, какой ждёт
+    # process_join: его пересылают целиком. Разметка entities не даёт очереди
+    # отправки склеить его с соседними сообщениями (send_queue._mergeable)
+    credentials = f"{account.code} {account.password}"
+    await message.answer(credentials, entities=[MessageEntity(type="code", offset=0, length=len(credentials))])
 
     await state.set_state(Form.menu)
-    await command_start(message, state)
+    await command_start(message, state, session, notice=(
+        "Если вы хотите поделиться счетом, то пусть человек перешлет сообщение выше сюда же (Код и пароль)."
+    ))
 
 
-async def show_last_expenses(message: Message, state: FSMContext):
-    async for session in get_session():
-        user = await session.scalar(select(User).where(User.tg_id == message.from_user.id))
-        if not user:
-            await message.answer("Вы ещё не зарегистрированы.")
-            await command_start(message, state)
-            return
+async def show_last_expenses(message: Message, state: FSMContext, session: AsyncSession):
+    user = await resolve_user(message.from_user.id, session, create=False)
+    if not user:
+        await command_start(message, state, session, notice="Вы ещё не зарегистрированы.")
+        return
 
-        q = (
-            select(Expense)
-            .where(Expense.user_id == user.tg_id)
-            .order_by(Expense.created_at.desc())
-            .limit(3)
-        )
-        result = await session.execute(q)
-        expenses = result.scalars().all()
+    await expense_writer.flush()
+    page = await fetch_page(session, user.account_id, user.tg_id, limit=3)
 
-        if not expenses:
-            await message.answer("У вас пока нет трат.")
-            await command_start(message, state)
-            return
+    if not page.expenses:
+        await command_start(message, state, session, notice="У вас пока нет трат.")
+        return
+
+    await state.set_state(Form.menu)
+    await command_start(message, state, session, notice="Последние траты:\n\n" + format_expenses(page.expenses))
 
-        text = "Последние траты:\n\n"
-        for e in expenses:
-            text += f"{e.amount} {e.currency} — {e.category}\n {e.created_at.strftime('%d.%m.%Y %H:%M')}\n {e.comment or '—'}\n\n"
 
-        await message.answer(text.strip())
-        await state.set_state(Form.menu)
-        await command_start(message, state)
+async def history_command(message: Message, state: FSMContext, session: AsyncSession):
+    user = await resolve_user(message.from_user.id, session)
+    await expense_writer.flush()
+    page = await fetch_page(session, user.account_id, user.tg_id)
+    if not page.expenses:
+        await message.answer("У вас пока нет трат.")
+        return
+    await message.answer("История трат:\n\n" + format_expenses(page.expenses), reply_markup=page_keyboard(page))
+
+
+async def history_page(callback: CallbackQuery, callback_data: HistoryPage, session: AsyncSession):
+    user = await resolve_user(callback.from_user.id, session)
+    await expense_writer.flush()
+    page = await fetch_page(session, user.account_id, user.tg_id, callback_data)
+    if not page.expenses:
+        # Траты за границей страницы успели удалить
+        await callback.answer("Дальше трат нет")
+        return
+    # Листаем в том же сообщении, а не присылаем новое
+    try:
+        await callback.message.edit_text("История трат:\n\n" + format_expenses(page.expenses),
+                                         reply_markup=page_keyboard(page))
+    except TelegramBadRequest as e:
+        # «message is not modified» — страница не изменилась, это не ошибка
+        if "not modified" not in str(e):
+            raise
+    await callback.answer()
+
+
+async def show_search_page(user: CachedUser, query: str, days: int, page: int,
+                           session: AsyncSession) -> tuple[str, InlineKeyboardMarkup | None]:
+    since = datetime.utcnow() - timedelta(days=days) if days else None
+    found = await search_expenses(session, user.account_id, user.tg_id, query, since,
+                                  limit=SEARCH_PAGE_SIZE, offset=page * SEARCH_PAGE_SIZE)
+    period = f" за {days} дн." if days else ""
+    if not found.expenses:
+        return f"По запросу «{query}»{period} ничего не нашлось.", None
+    text = f"Найдено по запросу «{query}»{period}:\n\n" + format_expenses(found.expenses)
+    return text, results_keyboard(page, days, query_key(query), found.has_more)
+
+
+async def search_command(message: Message, state: FSMContext, session: AsyncSession):
+    user = await resolve_user(message.from_user.id, session)
+    query, days = parse_search(message.text)
+    if not query:
+        await message.answer("Напишите, что искать, и, если нужно, за сколько дней: /search кофе 30")
+        return
+
+    await expense_writer.flush()
+    await state.update_data(search_query=query)
+    text, keyboard = await show_search_page(user, query, days, 0, session)
+    await message.answer(text, reply_markup=keyboard)
+
+
+async def search_page(callback: CallbackQuery, callback_data: SearchResults, state: FSMContext,
+                      session: AsyncSession):
+    query = (await state.get_data()).get("search_query")
+    if query is None or query_key(query) != callback_data.key:
+        await callback.answer("Этот поиск устарел, повторите /search")
+        return
+
+    user = await resolve_user(callback.from_user.id, session)
+    text, keyboard = await show_search_page(user, query, callback_data.days, callback_data.page, session)
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest as e:
+        if "not modified" not in str(e):
+            raise
+    await callback.answer()
 
 
-async def err_mess(message: Message, state: FSMContext):
+async def err_mess(message: Message, state: FSMContext, session: AsyncSession):
     await state.set_state(Form.menu)
-    await message.answer(
-        f"Непонятки"
-    )
-    await command_start(message, state)
+    await command_start(message, state, session, notice="Непонятки")
 
 
-async def main():
-    logging.basicConfig(
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        level=logging.INFO,
-    )
+def create_bot() -> Bot:
+    # TELEGRAM_API_URL позволяет работать через свой Bot API сервер или заглушку
+    session = None
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    bot = Bot(token=BOT_TOKEN, session=session)
+    # Всё исходящее идёт через общую очередь с лимитами Telegram
+    bot.session.middleware(send_scheduler)
+    return bot
 
-    await init_db()
 
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher()
+def build_dispatcher() -> Dispatcher:
+    storage = create_fsm_storage()
+    dp = Dispatcher(storage=storage)
+    dp.update.middleware(UpdateTimingMiddleware())
+    dp.update.middleware(FsmFlushMiddleware(storage))
+    dp.update.middleware(DbSessionMiddleware())
+    dp.message.middleware(HandlerTimingMiddleware())
+    dp.callback_query.middleware(HandlerTimingMiddleware())
 
     dp.message.register(command_start, CommandStart())
     dp.message.register(cancel_handler, Command("cancel"))
@@ -474,8 +955,14 @@ async def main():
     dp.message.register(add_expense_start, F.text.casefold() == "добавить трату")
     dp.message.register(report_process, Command("report"))
     dp.message.register(report_process, F.text.casefold() == "получить отчет")
-    dp.message.register(report_process, Command("last"))
+    dp.message.register(trends_report, Command("trends"))
+    dp.message.register(members_report, Command("members"))
+    dp.message.register(show_last_expenses, Command("last"))
     dp.message.register(show_last_expenses, F.text.casefold() == "последние 3 траты")
+    dp.message.register(history_command, Command("history"))
+    dp.callback_query.register(history_page, HistoryPage.filter())
+    dp.message.register(search_command, Command("search"))
+    dp.callback_query.register(search_page, SearchResults.filter())
     dp.message.register(report_process_get_data, Form.report_get_data)
     dp.message.register(add_expense_amount, Form.amount)
     dp.message.register(navigation_settings, Form.settings)
@@ -483,13 +970,95 @@ async def main():
     dp.message.register(settings_menu, Command("settings"))
     dp.message.register(settings_menu, F.text.casefold() == "настройки")
 
-    # dp.message.register(add_expense_currency, Form.currency)
+    dp.message.register(set_base_currency, Command("base"))
+    dp.message.register(budget_command, Command("budget"))
+    dp.message.register(recurring_command, Command("recurring"))
+    dp.message.register(digest_command, Command("digest"))
+    dp.message.register(export_expenses, Command("export"))
+    dp.message.register(import_start, Command("import"))
+    dp.message.register(import_expenses_file, Form.import_file, F.document)
+    dp.message.register(import_start, Form.import_file)
+    dp.message.register(add_expense_currency, Form.currency)
     dp.message.register(add_expense_category, Form.category)
     dp.message.register(process_comment, Form.comment)
     dp.message.register(err_mess, Form.menu)
 
+    dp.startup.register(start_services)
+    dp.shutdown.register(stop_services)
+    return dp
+
+
+async def start_services(dispatcher: Dispatcher, bot: Bot):
+    # Пул отрисовки прогревается в фоне и не задерживает первые апдейты
+    dispatcher["render_prewarm"] = asyncio.create_task(renderer.prewarm()) if RENDER_PREWARM else None
+    dispatcher["budget_notifier"] = expense_writer.on_budget_alerts = BudgetNotifier(bot)
+    expense_writer.start()
+    await refresh_rates()
+    dispatcher["fsm_cleanup"] = asyncio.create_task(expire_periodically(dispatcher.storage))
+    dispatcher["fx_refresh"] = asyncio.create_task(refresh_periodically())
+    dispatcher["budget_reconcile"] = asyncio.create_task(reconcile_periodically())
+    # В webhook-режиме планировщик работает только в одном процессе
+    dispatcher["recurring"] = None
+    if dispatcher.get("run_recurring", True):
+        recurring_scheduler.on_budget_alerts = dispatcher["budget_notifier"]
+        dispatcher["recurring"] = asyncio.create_task(recurring_scheduler.run_periodically())
+    # Перенос старых трат в архив, как и планировщик, — в одном процессе
+    dispatcher["archive"] = None
+    if ARCHIVE_AFTER_DAYS and dispatcher.get("run_archive", True):
+        dispatcher["archive"] = asyncio.create_task(ArchiveJob().run_periodically())
+    # В webhook-режиме каждый процесс рассылает дайджест своему шарду пользователей
+    shard, shards = dispatcher.get("digest_shard", (0, 1))
+    dispatcher["digest"] = asyncio.create_task(DigestJob(bot, shard, shards).run_periodically())
+    # В webhook-режиме у каждого процесса свой порт, см. webhook.py
+    dispatcher["metrics_server"] = await start_metrics_server(dispatcher.get("metrics_port", METRICS_PORT))
+
+
+async def stop_services(dispatcher: Dispatcher):
+    dispatcher["fsm_cleanup"].cancel()
+    dispatcher["fx_refresh"].cancel()
+    dispatcher["budget_reconcile"].cancel()
+    if dispatcher["recurring"] is not None:
+        dispatcher["recurring"].cancel()
+    dispatcher["digest"].cancel()
+    if dispatcher["archive"] is not None:
+        dispatcher["archive"].cancel()
+    if dispatcher["render_prewarm"] is not None:
+        dispatcher["render_prewarm"].cancel()
+    await dispatcher.storage.close()
+    await expense_writer.stop()
+    await dispatcher["budget_notifier"].close()
+    await send_scheduler.close()
+    if dispatcher["metrics_server"] is not None:
+        await dispatcher["metrics_server"].cleanup()
+    await fact_client.close()
+    renderer.shutdown()
+
+
+async def main():
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+
+    await check_db()
+
+    bot = create_bot()
+    dp = build_dispatcher()
     await dp.start_polling(bot)
 
 
+async def migrate():
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    await init_db()
+    await engine.dispose()
+    logging.info("Схема базы обновлена до версии %d", SCHEMA_VERSION)
+
+
 if __name__ == '__main__':
-    asyncio.run(main())
+    if sys.argv[1:] == ["migrate"]:
+        asyncio.run(migrate())
+    else:
+        asyncio.run(main())
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from sqlalchemy import select
+
+from db.budgets import BudgetAlert, reconcile_budgets
+from db.database import AsyncSessionLocal
+from db.models import User
+
+# Telegram пропускает около 30 сообщений в секунду от одного бота
+BUDGET_NOTIFY_BATCH = int(os.getenv("BUDGET_NOTIFY_BATCH", "25"))
+BUDGET_NOTIFY_INTERVAL = float(os.getenv("BUDGET_NOTIFY_INTERVAL", "1"))
+BUDGET_RECONCILE_INTERVAL = float(os.getenv("BUDGET_RECONCILE_INTERVAL", "3600"))
+
+
+def alert_text(alert: BudgetAlert) -> str:
+    if alert.level >= 100:
+        head = f"Бюджет «{alert.category}» на этот месяц исчерпан"
+    else:
+        head = f"Потрачено {alert.level}% бюджета «{alert.category}» на этот месяц"
+    return f"{head}: {alert.spent:.2f} из {alert.amount:.2f} {alert.currency}."
+
+
+async def scope_members(session, scopes: set[str]) -> dict[str, list[int]]:
+    """Telegram id всех, кого касается область трат: участники счёта или сам пользователь."""
+    members = {scope: [] for scope in scopes}
+    account_ids = {}
+    for scope in scopes:
+        kind, _, ident = scope.partition(":")
+        if kind == "account":
+            account_ids[int(ident)] = scope
+        else:
+            members[scope].append(int(ident))
+    if account_ids:
+        rows = await session.execute(
+            select(User.account_id, User.tg_id).where(User.account_id.in_(account_ids))
+        )
+        for account_id, tg_id in rows:
+            members[account_ids[account_id]].append(tg_id)
+    return members
+
+
+async def _send(bot: Bot, chat_id: int, text: str) -> bool:
+    # Повторы после 429 делает SendScheduler, здесь только не даём ошибке
+    # одного получателя сорвать рассылку остальным
+    try:
+        await bot.send_message(chat_id, text)
+    except TelegramAPIError as e:
+        # Например, пользователь заблокировал бота — остальным всё равно отправляем
+        logging.warning("Не удалось предупредить %s о бюджете: %r", chat_id, e)
+        return False
+    return True
+
+
+async def send_batched(bot: Bot, messages: list[tuple[int, str]],
+                       batch_size: int = BUDGET_NOTIFY_BATCH, interval: float = BUDGET_NOTIFY_INTERVAL) -> int:
+    """Рассылает сообщения пачками: внутри пачки параллельно, между пачками пауза,
+    чтобы большой счёт не упирался в лимит Telegram. Возвращает число доставленных."""
+    delivered = 0
+    for start in range(0, len(messages), batch_size):
+        if start:
+            await asyncio.sleep(interval)
+        results = await asyncio.gather(*(_send(bot, chat_id, text)
+                                         for chat_id, text in messages[start:start + batch_size]))
+        delivered += sum(results)
+    return delivered
+
+
+class BudgetNotifier:
+    """Получает пересечённые пороги от ``ExpenseWriter`` и рассылает их в фоне,
+    не задерживая запись следующих трат."""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._tasks: set[asyncio.Task] = set()
+
+    def __call__(self, alerts: list[BudgetAlert]):
+        task = asyncio.create_task(self.notify(alerts))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def notify(self, alerts: list[BudgetAlert]):
+        try:
+            async with AsyncSessionLocal() as session:
+                members = await scope_members(session, {a.scope for a in alerts})
+            messages = [(chat_id, alert_text(a)) for a in alerts for chat_id in members[a.scope]]
+            await send_batched(self.bot, messages)
+        except Exception:
+            logging.exception("Не удалось разослать предупреждения о бюджетах")
+
+    async def close(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+async def reconcile_periodically(interval: float = BUDGET_RECONCILE_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with AsyncSessionLocal() as session:
+                count = await reconcile_budgets(session)
+                await session.commit()
+            logging.debug("Сверено бюджетов: %d", count)
+        except Exception:
+            logging.exception("Не удалось сверить бюджеты")
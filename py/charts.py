@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import TYPE_CHECKING
+
+from metrics import RENDER_SECONDS
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
+# Сколько процессов рисуют графики и сколько задач может ждать своей очереди
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+RENDER_QUEUE_DEPTH = int(os.getenv("RENDER_QUEUE_DEPTH", str(RENDER_WORKERS * 4)))
+# RENDER_PREWARM=0 — не прогревать пул при старте, matplotlib загрузится на первом отчёте
+RENDER_PREWARM = os.getenv("RENDER_PREWARM", "1") == "1"
+
+# Формат картинки отчёта: png — как есть, png8 — PNG с палитрой на 256 цветов,
+# webp — WebP без потерь. Оба сжатых варианта заметно меньше при загрузке.
+REPORT_IMAGE_FORMAT = os.getenv("REPORT_IMAGE_FORMAT", "png").lower()
+REPORT_IMAGE_EXT = "webp" if REPORT_IMAGE_FORMAT == "webp" else "png"
+
+
+class RendererBusy(Exception):
+    """Очередь отрисовки переполнена, нужно попросить пользователя подождать."""
+
+
+def _figure(**kwargs) -> Figure:
+    # matplotlib (и numpy) импортируются только в процессах пула, при первой
+    # отрисовке, — сам бот стартует без них
+    from matplotlib.figure import Figure
+    return Figure(**kwargs)
+
+
+def _encode(fig: Figure) -> bytes:
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    FigureCanvasAgg(fig)
+    buf = BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    if REPORT_IMAGE_FORMAT not in ("png8", "webp"):
+        return buf.getvalue()
+
+    # Pillow ставится вместе с matplotlib, отдельная зависимость не нужна
+    from PIL import Image
+
+    buf.seek(0)
+    image = Image.open(buf).convert("RGB")
+    out = BytesIO()
+    if REPORT_IMAGE_FORMAT == "webp":
+        image.save(out, format="WEBP", lossless=True, method=4)
+    else:
+        image.quantize(colors=256).save(out, format="PNG", optimize=True)
+    return out.getvalue()
+
+
+def render_empty(text: str = "Нет трат за период") -> bytes:
+    # Работает в отдельном процессе, поэтому только объектный API без pyplot
+    fig = _figure(figsize=(4, 4))
+    fig.text(0.5, 0.5, text, ha="center", va="center", fontsize=14)
+    return _encode(fig)
+
+
+def render_pie(categories: list[str], totals: list[float], days: int, currency: str) -> bytes:
+    total_sum = sum(totals)
+
+    fig = _figure(figsize=(6, 6))
+    ax = fig.subplots()
+    ax.pie(totals, labels=categories, autopct="%1.1f%%", startangle=90)
+    ax.set_title(f"Траты за {days} дн.", fontsize=14)
+    fig.text(0.5, 0.02, f"Всего потрачено: {total_sum:.2f} {currency}", ha="center", fontsize=12)
+    return _encode(fig)
+
+
+def render_trends(dates, daily, rolling, week_starts, weekly, outlier_days, currency: str) -> bytes:
+    fig = _figure(figsize=(8, 7))
+    ax_daily, ax_weekly = fig.subplots(2, 1, sharex=True)
+
+    ax_daily.plot(dates, daily, color="tab:blue", alpha=0.4, label="За день")
+    ax_daily.plot(dates, rolling, color="tab:blue", linewidth=2, label="Скользящее среднее")
+    if len(outlier_days):
+        ax_daily.scatter(dates[outlier_days], daily[outlier_days], color="tab:red", zorder=3,
+                         label="Необычные траты")
+    ax_daily.set_title("Траты по дням", fontsize=14)
+    ax_daily.set_ylabel(currency)
+    ax_daily.legend(loc="upper left")
+
+    ax_weekly.bar(week_starts, weekly, width=5, align="edge", color="tab:green")
+    ax_weekly.set_title("Траты по неделям", fontsize=14)
+    ax_weekly.set_ylabel(currency)
+
+    fig.autofmt_xdate()
+    return _encode(fig)
+
+
+def render_members(labels: list[str], categories: list[str], rows: list[list[float]], days: int,
+                   currency: str) -> bytes:
+    # Горизонтальные столбцы: участник — строка, категории — отрезки столбца
+    fig = _figure(figsize=(8, 1.5 + 0.4 * len(labels)))
+    ax = fig.subplots()
+    # Позиции числами: у двух участников может быть одинаковое имя
+    positions = range(len(labels))
+    left = [0.0] * len(labels)
+    for j, category in enumerate(categories):
+        widths = [row[j] for row in rows]
+        ax.barh(positions, widths, left=left, label=category)
+        left = [a + b for a, b in zip(left, widths)]
+    ax.set_yticks(positions, labels)
+    ax.invert_yaxis()
+    ax.set_title(f"Траты участников за {days} дн.", fontsize=14)
+    ax.set_xlabel(currency)
+    ax.legend(loc="lower right", fontsize=8)
+    return _encode(fig)
+
+
+class ChartRenderer:
+    """Пул процессов для matplotlib, чтобы отрисовка не блокировала event loop.
+
+    Одновременно в работе и в очереди держим не больше ``queue_depth`` задач:
+    остальные ждут на семафоре (backpressure), а если ждущих тоже слишком
+    много — сразу получают ``RendererBusy``.
+    """
+
+    def __init__(self, workers: int = RENDER_WORKERS, queue_depth: int = RENDER_QUEUE_DEPTH):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self._executor: ProcessPoolExecutor | None = None
+        self._slots = asyncio.Semaphore(queue_depth)
+        self._waiting = 0
+
+    def start(self):
+        if self._executor is None:
+            # spawn, а не fork: форк копировал бы работающий event loop, открытые
+            # соединения с базой и потоки бота в каждый процесс пула
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+
+    async def prewarm(self):
+        """Запускает процессы пула и рисует в каждом пустую картинку, чтобы
+        импорт matplotlib и загрузка шрифтов не достались первому отчёту."""
+        self.start()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            await asyncio.gather(*(
+                loop.run_in_executor(self._executor, render_empty) for _ in range(self.workers)
+            ))
+        except Exception:
+            logging.exception("Не удалось прогреть пул отрисовки")
+            return
+        logging.info("Пул отрисовки прогрет за %.2f с", loop.time() - started)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, func, *args) -> bytes:
+        if self._slots.locked() and self._waiting >= self.queue_depth:
+            raise RendererBusy()
+
+        self.start()
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        try:
+            loop = asyncio.get_running_loop()
+            with RENDER_SECONDS.time(func.__name__):
+                return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._slots.release()
+
+
+renderer = ChartRenderer()
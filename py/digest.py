@@ -0,0 +1,200 @@
+"""Дайджест трат за неделю или месяц, который бот присылает сам.
+
+Раз в ``DIGEST_CHECK_INTERVAL`` задача смотрит, кому из подписчиков ещё не
+отправлен выпуск за текущий период (неделя с понедельника, месяц с 1-го
+числа, не раньше ``DIGEST_HOUR`` UTC). Подписчики обрабатываются порциями:
+на порцию — один запрос за версиями данных и один за суммами по категориям,
+картинки рисуются параллельно в пуле процессов и кладутся в ``report_cache``
+под тем же ключом, что и у /report, а рассылка растягивается на
+``DIGEST_WINDOW`` секунд.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+from aiogram.types import BufferedInputFile
+from sqlalchemy import func, or_, select, update
+
+from charts import renderer, render_pie, REPORT_IMAGE_EXT
+from db.database import AsyncSessionLocal
+from db.models import Account, DailyCategoryTotal, User
+from db.rollup import expense_scope
+from expense_writer import expense_writer
+from fx import fx_rates, BASE_CURRENCY
+from report_cache import report_cache, report_key, report_since
+
+DIGEST_HOUR = int(os.getenv("DIGEST_HOUR", "9"))
+DIGEST_WINDOW = float(os.getenv("DIGEST_WINDOW", "3600"))
+DIGEST_CHUNK = int(os.getenv("DIGEST_CHUNK", "500"))
+DIGEST_CHECK_INTERVAL = float(os.getenv("DIGEST_CHECK_INTERVAL", "300"))
+
+# Период дайджеста -> (число дней отчёта, как в кнопках /report; подпись)
+DIGESTS = {
+    "week": (7, "неделю"),
+    "month": (30, "месяц"),
+}
+
+
+def period_start(kind: str, today: date) -> date:
+    if kind == "week":
+        return today - timedelta(days=today.weekday())
+    return today.replace(day=1)
+
+
+class DigestJob:
+    """Рассылка дайджестов для своей доли пользователей.
+
+    В webhook-режиме каждый процесс берёт пользователей своего шарда
+    (``tg_id % shards == shard``) — тех же, чьи апдейты он обрабатывает, —
+    поэтому готовые отчёты оказываются в кэше того процесса, куда придёт /report.
+    """
+
+    def __init__(self, bot: Bot, shard: int = 0, shards: int = 1,
+                 window: float = DIGEST_WINDOW, chunk: int = DIGEST_CHUNK):
+        self.bot = bot
+        self.shard = shard
+        self.shards = shards
+        self.window = window
+        self.chunk = chunk
+
+    async def due(self, kind: str, now: datetime) -> list:
+        start = period_start(kind, now.date())
+        if now < datetime.combine(start, datetime.min.time()) + timedelta(hours=DIGEST_HOUR):
+            return []
+        async with AsyncSessionLocal() as session:
+            rows = await session.execute(
+                select(User.tg_id, User.account_id, User.base_currency,
+                       func.coalesce(Account.data_version, User.data_version).label("version"))
+                .outerjoin(Account, Account.id == User.account_id)
+                .where(
+                    User.digest == kind,
+                    or_(User.digest_sent_on.is_(None), User.digest_sent_on < start),
+                    User.tg_id % self.shards == self.shard,
+                )
+                .order_by(User.tg_id)
+            )
+            return rows.all()
+
+    async def run(self, kind: str, now: datetime | None = None) -> int:
+        """Рассылает выпуск всем, кому он положен; возвращает число отправленных."""
+        now = now or datetime.utcnow()
+        subscribers = await self.due(kind, now)
+        if not subscribers:
+            return 0
+
+        await expense_writer.flush()
+        # Пауза между отправками, чтобы уложить всех в окно, но не тянуть дольше секунды
+        pause = min(self.window / len(subscribers), 1.0)
+        sent = 0
+        for start in range(0, len(subscribers), self.chunk):
+            sent += await self._run_chunk(kind, subscribers[start:start + self.chunk], pause, now.date())
+        logging.info("Дайджест %s: отправлено %d из %d", kind, sent, len(subscribers))
+        return sent
+
+    async def _run_chunk(self, kind: str, subscribers: list, pause: float, today: date) -> int:
+        days, title = DIGESTS[kind]
+        # Граница периода та же, что в ключе кэша у /report
+        since = report_since(days)
+        scopes = {expense_scope(s.account_id, s.tg_id) for s in subscribers}
+
+        # Один запрос на всю порцию; в валюту каждого подписчика переводим уже в Python
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(
+                select(DailyCategoryTotal.scope, DailyCategoryTotal.category, DailyCategoryTotal.currency,
+                       func.sum(DailyCategoryTotal.total))
+                .where(DailyCategoryTotal.scope.in_(scopes), DailyCategoryTotal.day >= since)
+                .group_by(DailyCategoryTotal.scope, DailyCategoryTotal.category, DailyCategoryTotal.currency)
+            )).all()
+        by_scope = defaultdict(list)
+        for scope, category, currency, total in rows:
+            by_scope[scope].append((category, currency, total))
+
+        # Участники одного счёта с одной валютой получают одну и ту же картинку
+        targets = []
+        renders = {}
+        # Кому выпуск за период больше не нужен: отправлен или за период трат не было
+        done = []
+        for s in subscribers:
+            scope = expense_scope(s.account_id, s.tg_id)
+            if not by_scope[scope]:
+                done.append(s.tg_id)  # за период трат не было — не беспокоим
+                continue
+            base = s.base_currency or BASE_CURRENCY
+            key = report_key(scope, s.version, days, since, base, fx_rates.as_of)
+            targets.append((s.tg_id, key))
+            if key not in renders and report_cache.get(key) is None:
+                renders[key] = self._render(by_scope[scope], days, base)
+
+        if renders:
+            keys = list(renders)
+            images = await asyncio.gather(*renders.values(), return_exceptions=True)
+            for key, png in zip(keys, images):
+                if isinstance(png, Exception):
+                    logging.error("Не удалось нарисовать дайджест %s: %r", key, png)
+                else:
+                    report_cache.put(key, png)
+
+        sent = 0
+        for tg_id, key in targets:
+            try:
+                delivered = await self._send(tg_id, key, title)
+            except TelegramForbiddenError:
+                # Бот заблокирован: до конца периода повторять бессмысленно
+                logging.info("Дайджест %s не отправлен: бот заблокирован", tg_id)
+                done.append(tg_id)
+                continue
+            except Exception:
+                logging.exception("Не удалось отправить дайджест %s", tg_id)
+                delivered = False
+            if delivered:
+                sent += 1
+                done.append(tg_id)
+            await asyncio.sleep(pause)
+
+        # Кому не удалось нарисовать или отправить, получат выпуск при следующей проверке
+        if done:
+            async with AsyncSessionLocal() as session:
+                await session.execute(update(User).where(User.tg_id.in_(done)).values(digest_sent_on=today))
+                await session.commit()
+        return sent
+
+    async def _render(self, totals: list[tuple], days: int, base: str) -> bytes:
+        categories = defaultdict(float)
+        for category, currency, total in totals:
+            categories[category] += fx_rates.convert(total, currency, base)
+        return await renderer.render(render_pie, list(categories), list(categories.values()), days, base)
+
+    async def _send(self, tg_id: int, key: tuple, title: str) -> bool:
+        entry = report_cache.get(key)
+        if entry is None:
+            return False
+        caption = f"Ваши траты за {title}"
+        try:
+            if entry.file_id is not None:
+                await self.bot.send_photo(tg_id, entry.file_id, caption=caption)
+            else:
+                photo = BufferedInputFile(entry.png, filename=f"report.{REPORT_IMAGE_EXT}")
+                message = await self.bot.send_photo(tg_id, photo, caption=caption)
+                # Остальным участникам счёта и повторному /report — уже по file_id
+                report_cache.remember_file_id(key, message.photo[-1].file_id)
+        except TelegramForbiddenError:
+            raise
+        except TelegramAPIError as e:
+            logging.warning("Не удалось отправить дайджест %s: %r", tg_id, e)
+            return False
+        return True
+
+    async def run_periodically(self, interval: float = DIGEST_CHECK_INTERVAL):
+        while True:
+            for kind in DIGESTS:
+                try:
+                    await self.run(kind)
+                except Exception:
+                    logging.exception("Не удалось разослать дайджест %s", kind)
+            await asyncio.sleep(interval)
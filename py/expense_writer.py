@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from typing import Callable
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from db.database import AsyncSessionLocal
+from db.expenses import insert_expenses
+
+# Пачка сбрасывается в базу, когда набралось столько трат или прошло столько секунд
+EXPENSE_BATCH_SIZE = int(os.getenv("EXPENSE_BATCH_SIZE", "200"))
+EXPENSE_FLUSH_INTERVAL = float(os.getenv("EXPENSE_FLUSH_INTERVAL", "0.5"))
+
+
+class ExpenseWriter:
+    """Отложенная запись трат пачками.
+
+    Хендлер кладёт проверенную трату в очередь и сразу отвечает пользователю,
+    а фоновая задача записывает накопившееся одной транзакцией. Перед чтением
+    (отчёт, последние траты) нужно вызвать ``flush``, чтобы увидеть свои записи.
+    """
+
+    def __init__(self, batch_size: int = EXPENSE_BATCH_SIZE, flush_interval: float = EXPENSE_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: list[dict] = []
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        # Вызывается после коммита пачки, если она пересекла пороги бюджетов
+        self.on_budget_alerts: Callable[[list], None] | None = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            # Не отменяем задачу посреди записи пачки: просим цикл выйти и ждём его
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        # При остановке дописываем всё, что осталось в очереди; если база так
+        # и не ответила, не мешаем остановить остальные сервисы
+        try:
+            await self.flush()
+        except Exception:
+            logging.exception("При остановке не записано трат: %d", self.pending)
+
+    async def add(self, row: dict):
+        self._pending.append(row)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        if self._task is None:
+            await self.flush()
+
+    async def flush(self):
+        # Пустая очередь ещё не значит, что всё записано: фоновая задача могла
+        # забрать пачку и ждать коммита, поэтому проверяем под блокировкой
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            try:
+                alerts = await self._insert(batch)
+            except (IntegrityError, DataError):
+                # Пачку испортила какая-то строка, и повтор не поможет: пишем по
+                # одной, чтобы она не держала очередь и траты других пользователей
+                alerts = await self._insert_each(batch)
+            except BaseException:
+                # Не теряем траты, даже если задачу отменили посреди записи или
+                # база занята: вернём их в начало очереди до следующей попытки
+                self._pending = batch + self._pending
+                raise
+            else:
+                logging.debug("Записано трат пачкой: %d", len(batch))
+            if alerts and self.on_budget_alerts is not None:
+                self.on_budget_alerts(alerts)
+
+    @staticmethod
+    async def _insert(rows: list[dict]) -> list:
+        async with AsyncSessionLocal() as session:
+            alerts = await insert_expenses(session, rows)
+            await session.commit()
+        return alerts
+
+    async def _insert_each(self, batch: list[dict]) -> list:
+        alerts = []
+        for i, row in enumerate(batch):
+            try:
+                alerts += await self._insert([row])
+            except (IntegrityError, DataError) as e:
+                logging.error("Трата не записана и отброшена: %r: %s", row, e.orig)
+            except BaseException:
+                self._pending = batch[i:] + self._pending
+                # Уже записанные траты закоммичены — о порогах предупреждаем сразу
+                if alerts and self.on_budget_alerts is not None:
+                    self.on_budget_alerts(alerts)
+                raise
+        return alerts
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("Не удалось записать пачку трат")
+
+
+expense_writer = ExpenseWriter()
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import aiohttp
+
+from metrics import FACT_SECONDS
+
+# Адрес можно подменить на локальную заглушку, например http://127.0.0.1:8081
+FACTS_API_URL = os.getenv("FACTS_API_URL", "http://numbersapi.com").rstrip("/")
+FACT_TIMEOUT = float(os.getenv("FACT_TIMEOUT", "2"))
+# Сколько секунд ответ «трата сохранена» готов подождать факт
+FACT_BUDGET = float(os.getenv("FACT_BUDGET", "0.3"))
+FACT_CACHE_SIZE = int(os.getenv("FACT_CACHE_SIZE", "4096"))
+FACT_CACHE_TTL = float(os.getenv("FACT_CACHE_TTL", str(24 * 3600)))
+FACT_POOL_SIZE = int(os.getenv("FACT_POOL_SIZE", "20"))
+# JSON вида {"100": "факт", ...} — дополняет встроенные офлайн-факты
+FACTS_FILE = os.getenv("FACTS_FILE")
+
+FACT_UNAVAILABLE = "Не удалось получить забавный факт"
+
+# Факты для самых частых сумм: отвечаем сразу, даже если API недоступен
+OFFLINE_FACTS = {
+    0: "0 is the additive identity: adding it to any number leaves the number unchanged.",
+    1: "1 is the multiplicative identity: multiplying by it leaves any number unchanged.",
+    7: "7 is the number of days in a week.",
+    10: "10 is the base of the decimal number system.",
+    12: "12 is the number of months in a year.",
+    42: "42 is the answer to the Ultimate Question of Life, the Universe, and Everything "
+        "in The Hitchhiker's Guide to the Galaxy.",
+    100: "100 is the number of years in a century.",
+    365: "365 is the number of days in a common year.",
+    1000: "1000 is the number of years in a millennium.",
+}
+
+
+def load_offline_facts(path: str | None = FACTS_FILE) -> dict[int, str]:
+    facts = dict(OFFLINE_FACTS)
+    if path:
+        with open(path, encoding="utf-8") as f:
+            facts.update({int(k): v for k, v in json.load(f).items()})
+    return facts
+
+
+class FactClient:
+    """Общий HTTP-клиент для numbersapi с LRU/TTL-кэшем фактов.
+
+    Одна ``ClientSession`` живёт всё время работы бота и держит keep-alive
+    соединения. Одновременные запросы одного и того же числа склеиваются.
+    """
+
+    def __init__(self, base_url: str = FACTS_API_URL, timeout: float = FACT_TIMEOUT,
+                 cache_size: int = FACT_CACHE_SIZE, cache_ttl: float = FACT_CACHE_TTL):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.offline = load_offline_facts()
+        self._session: aiohttp.ClientSession | None = None
+        self._cache: OrderedDict[int, tuple[float, str]] = OrderedDict()
+        self._inflight: dict[int, asyncio.Future] = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=FACT_POOL_SIZE, ttl_dns_cache=300),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def cached(self, number: int) -> str | None:
+        item = self._cache.get(number)
+        if item is not None:
+            expires_at, fact = item
+            if expires_at >= time.monotonic():
+                self._cache.move_to_end(number)
+                return fact
+            del self._cache[number]
+        return self.offline.get(number)
+
+    def _remember(self, number: int, fact: str):
+        self._cache[number] = (time.monotonic() + self.cache_ttl, fact)
+        self._cache.move_to_end(number)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def get(self, number: int) -> str:
+        fact = self.cached(number)
+        if fact is not None:
+            return fact
+
+        future = self._inflight.get(number)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(number))
+            self._inflight[number] = future
+            future.add_done_callback(lambda _: self._inflight.pop(number, None))
+        return await asyncio.shield(future)
+
+    async def _fetch(self, number: int) -> str:
+        try:
+            async with self._get_session().get(f"{self.base_url}/{number}") as resp:
+                if resp.status != 200:
+                    return FACT_UNAVAILABLE
+                fact = await resp.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning("numbersapi недоступен: %r", e)
+            return FACT_UNAVAILABLE
+        self._remember(number, fact)
+        return fact
+
+    async def within_budget(self, task: asyncio.Future, budget: float = FACT_BUDGET) -> str:
+        """Ждёт факт не дольше ``budget`` секунд; запрос при этом не отменяется
+        и, завершившись, всё равно попадёт в кэш."""
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout=budget)
+        except asyncio.TimeoutError:
+            return FACT_UNAVAILABLE
+
+
+fact_client = FactClient()
+
+
+async def get_fact(number: int) -> str:
+    source = "cache" if fact_client.cached(number) is not None else "api"
+    with FACT_SECONDS.time(source):
+        return await fact_client.get(number)
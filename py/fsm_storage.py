@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import TelegramObject
+from sqlalchemy import delete, select
+
+from db.database import AsyncSessionLocal, upsert
+from db.models import FsmRecord
+
+# sql — таблица fsm_states в нашей базе, memory — как раньше, в памяти,
+# redis://host:port/0 — Redis или совместимый сервер (нужен пакет redis)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sql")
+# Через сколько секунд бездействия недописанная трата считается брошенной
+FSM_TTL = int(os.getenv("FSM_TTL", str(24 * 3600)))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+
+
+class SQLAlchemyStorage(BaseStorage):
+    """FSM-хранилище в той же базе, что и траты.
+
+    Состояние и данные лежат в одной строке. Изменения копятся в памяти и
+    записываются одним UPSERT в конце апдейта (см. ``FsmFlushMiddleware``),
+    поэтому ``set_state`` + ``update_data`` в хендлере — это одна запись.
+    Чтения обслуживаются из кэша; апдейты одного чата должны приходить в один
+    процесс (в webhook-режиме это обеспечивает шардирование по chat id).
+    """
+
+    def __init__(self, cache_size: int = FSM_CACHE_SIZE):
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.cache_size = cache_size
+        self._records: OrderedDict[str, tuple[Optional[str], Dict[str, Any]]] = OrderedDict()
+        self._dirty: set[str] = set()
+
+    async def _load(self, key: StorageKey) -> tuple[str, Optional[str], Dict[str, Any]]:
+        db_key = self.key_builder.build(key)
+        record = self._records.get(db_key)
+        if record is not None:
+            self._records.move_to_end(db_key)
+            return db_key, *record
+
+        async with AsyncSessionLocal() as session:
+            row = (await session.execute(
+                select(FsmRecord.state, FsmRecord.data).where(FsmRecord.key == db_key)
+            )).first()
+        state, data = (row.state, dict(row.data or {})) if row else (None, {})
+        self._remember(db_key, state, data, dirty=False)
+        return db_key, state, data
+
+    def _remember(self, db_key: str, state: Optional[str], data: Dict[str, Any], dirty: bool):
+        self._records[db_key] = (state, data)
+        self._records.move_to_end(db_key)
+        if dirty:
+            self._dirty.add(db_key)
+        # Вытесняем только то, что уже записано в базу
+        for old_key in list(self._records):
+            if len(self._records) <= self.cache_size:
+                break
+            if old_key not in self._dirty:
+                del self._records[old_key]
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        db_key, _, data = await self._load(key)
+        self._remember(db_key, state.state if isinstance(state, State) else state, data, dirty=True)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, state, _ = await self._load(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        db_key, state, _ = await self._load(key)
+        self._remember(db_key, state, data.copy(), dirty=True)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, _, data = await self._load(key)
+        return data.copy()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        now = datetime.utcnow()
+        rows = [
+            dict(key=k, state=self._records[k][0], data=self._records[k][1], updated_at=now)
+            for k in keys if k in self._records
+        ]
+        stmt = upsert(FsmRecord)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["key"],
+            set_={"state": stmt.excluded.state, "data": stmt.excluded.data, "updated_at": stmt.excluded.updated_at},
+        )
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(stmt, rows)
+                await session.commit()
+        except Exception:
+            self._dirty |= keys
+            raise
+
+    async def expire(self, ttl: int = FSM_TTL) -> int:
+        """Удаляет брошенные на полпути сценарии, к которым не возвращались ``ttl`` секунд."""
+        await self.flush()
+        threshold = datetime.utcnow() - timedelta(seconds=ttl)
+        async with AsyncSessionLocal() as session:
+            expired = (await session.scalars(
+                delete(FsmRecord).where(FsmRecord.updated_at < threshold).returning(FsmRecord.key)
+            )).all()
+            await session.commit()
+        for db_key in expired:
+            if db_key not in self._dirty:
+                self._records.pop(db_key, None)
+        return len(expired)
+
+    async def close(self) -> None:
+        await self.flush()
+
+
+class FsmFlushMiddleware(BaseMiddleware):
+    """Записывает накопленные за апдейт изменения FSM одним запросом."""
+
+    def __init__(self, storage: BaseStorage):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            if isinstance(self.storage, SQLAlchemyStorage):
+                try:
+                    await self.storage.flush()
+                except Exception:
+                    logging.exception("Не удалось сохранить состояние FSM")
+
+
+async def expire_periodically(storage: BaseStorage, interval: float = 3600):
+    if not isinstance(storage, SQLAlchemyStorage):
+        return  # Redis сам удаляет ключи по TTL
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            expired = await storage.expire()
+            if expired:
+                logging.info("Удалено брошенных сценариев FSM: %d", expired)
+        except Exception:
+            logging.exception("Не удалось очистить брошенные сценарии FSM")
+
+
+def create_fsm_storage(url: str = FSM_STORAGE) -> BaseStorage:
+    if url == "memory":
+        return MemoryStorage()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        # Импортируем только при необходимости: пакет redis не обязателен
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(url, state_ttl=FSM_TTL, data_ttl=FSM_TTL)
+    return SQLAlchemyStorage()
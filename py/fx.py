@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+from datetime import date, datetime
+from pathlib import Path
+
+from constants import POPULAR_CURRENCIES
+from db.database import AsyncSessionLocal, upsert
+from db.models import FxRate
+
+# Снимок курсов: {"date": "...", "base": "USD", "rates": {"RUB": 89.5, ...}},
+# где rates — сколько единиц валюты дают за одну единицу base
+FX_RATES_FILE = os.getenv("FX_RATES_FILE", str(Path(__file__).with_name("fx_rates.json")))
+# Необязательный HTTP-источник того же формата (можно поднять заглушку)
+FX_RATES_URL = os.getenv("FX_RATES_URL")
+FX_REFRESH_INTERVAL = float(os.getenv("FX_REFRESH_INTERVAL", str(24 * 3600)))
+# Валюта отчётов, если пользователь не выбрал свою
+BASE_CURRENCY = os.getenv("BASE_CURRENCY", "RUB")
+# Валюты, в которые переводятся суммы: отчётов (/base) и бюджетов
+TARGET_CURRENCIES = {BASE_CURRENCY, *POPULAR_CURRENCIES}
+
+
+class FxRates:
+    """Курсы валют за один день, загружаются целиком и держатся в памяти."""
+
+    def __init__(self):
+        self.rates: dict[str, float] = {}
+        self.as_of: date | None = None
+
+    def load(self, snapshot: dict):
+        rates = {code.upper(): float(rate) for code, rate in snapshot["rates"].items()}
+        rates.setdefault(snapshot["base"].upper(), 1.0)
+        missing = TARGET_CURRENCIES - rates.keys()
+        if missing:
+            raise ValueError(f"В снимке курсов нет валют отчётов: {', '.join(sorted(missing))}")
+        self.rates = rates
+        self.as_of = datetime.strptime(snapshot["date"], "%Y-%m-%d").date()
+
+    def rate(self, currency: str) -> float:
+        """Курс валюты отчёта или бюджета; у них он есть всегда, это проверяет load."""
+        return self.rates[currency]
+
+    def convert(self, amount: float, currency: str, to: str) -> float:
+        # Сумму, у валюты которой нет курса, не пересчитываем: считаем, что она
+        # уже в валюте to. Так же считают отчёты в SQL — coalesce(FxRate.rate,
+        # base_rate) — и бюджеты в db/budgets.py
+        if currency == to or currency not in self.rates or to not in self.rates:
+            return amount
+        return amount / self.rates[currency] * self.rates[to]
+
+    async def store(self):
+        """Кладёт снимок в таблицу fx_rates, чтобы отчёты пересчитывали суммы прямо в SQL."""
+        if not self.rates:
+            return
+        stmt = upsert(FxRate)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["currency"],
+            set_={"rate": stmt.excluded.rate, "as_of": stmt.excluded.as_of},
+        )
+        async with AsyncSessionLocal() as session:
+            await session.execute(stmt, [
+                dict(currency=code, rate=rate, as_of=self.as_of) for code, rate in self.rates.items()
+            ])
+            await session.commit()
+
+
+fx_rates = FxRates()
+
+
+async def _fetch_snapshot(url: str) -> dict:
+    import aiohttp
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+        async with session.get(url) as resp:
+            resp.raise_for_status()
+            return await resp.json(content_type=None)
+
+
+async def refresh_rates():
+    loaded = False
+    if FX_RATES_URL:
+        try:
+            fx_rates.load(await _fetch_snapshot(FX_RATES_URL))
+            loaded = True
+        except Exception as e:
+            logging.warning("Не удалось загрузить курсы с %s: %r", FX_RATES_URL, e)
+    if not loaded:
+        with open(FX_RATES_FILE, encoding="utf-8") as f:
+            fx_rates.load(json.load(f))
+    await fx_rates.store()
+    logging.info("Курсы валют на %s загружены: %d валют", fx_rates.as_of, len(fx_rates.rates))
+
+
+async def refresh_periodically(interval: float = FX_REFRESH_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh_rates()
+        except Exception:
+            logging.exception("Не удалось обновить курсы валют")
@@ -0,0 +1,105 @@
+"""История трат по страницам.
+
+Страницы выбираются по ключу (created_at, id), а не через OFFSET: запрос
+«траты старше такой-то» идёт по индексу ``(account_id|user_id, created_at)``
+и стоит одинаково и на первой странице, и на миллионной. Положение страницы
+хранится прямо в ``callback_data`` кнопок. Старые траты, ушедшие в архив,
+выбираются тем же запросом из ``archive.expenses`` и сливаются с живыми.
+"""
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import or_, select
+
+from db.expenses import expense_filter
+from db.models import ArchivedExpense, Expense
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class HistoryPage(CallbackData, prefix="history"):
+    # Граница страницы: created_at в микросекундах от эпохи и id траты
+    older: bool
+    at: int
+    id: int
+
+
+@dataclass
+class Page:
+    expenses: list
+    has_newer: bool
+    has_older: bool
+
+
+async def fetch_page(session, account_id: int | None, user_id: int,
+                     cursor: HistoryPage | None = None, limit: int = HISTORY_PAGE_SIZE) -> Page:
+    """Страница трат от новых к старым. Без ``cursor`` — самые свежие,
+    иначе следующая за границей в направлении ``cursor.older``."""
+    older = cursor is None or cursor.older
+    # Та же выборка из архива (db/archive.py): страница может оказаться на
+    # стыке слоёв, а по индексу архива пустой ответ почти ничего не стоит
+    expenses = {}
+    for model in (ArchivedExpense, Expense):
+        for expense in await _fetch_side(session, model, account_id, user_id, cursor, older, limit):
+            # Пока трату переносят, она есть в обоих слоях
+            expenses[expense.id] = expense
+    # Лишняя строка говорит, есть ли что-то дальше
+    expenses = sorted(expenses.values(), key=lambda e: (e.created_at, e.id), reverse=older)
+    more = len(expenses) > limit
+    del expenses[limit:]
+
+    if older:
+        return Page(expenses, has_newer=cursor is not None, has_older=more)
+    expenses.reverse()
+    return Page(expenses, has_newer=more, has_older=True)
+
+
+async def _fetch_side(session, model, account_id, user_id, cursor, older, limit) -> list:
+    q = select(model).where(expense_filter(account_id, user_id, model))
+    if cursor is not None:
+        at = _EPOCH + cursor.at * _MICROSECOND
+        # Та же граница, что и (created_at, id) < (at, id), но условие на
+        # created_at отдельно — его база берёт из индекса
+        if older:
+            q = q.where(model.created_at <= at, or_(model.created_at < at, model.id < cursor.id))
+        else:
+            q = q.where(model.created_at >= at, or_(model.created_at > at, model.id > cursor.id))
+
+    if older:
+        q = q.order_by(model.created_at.desc(), model.id.desc())
+    else:
+        q = q.order_by(model.created_at, model.id)
+    return list((await session.scalars(q.limit(limit + 1))).all())
+
+
+def format_expenses(expenses: list) -> str:
+    return "\n\n".join(
+        f"{e.amount} {e.currency} — {e.category}\n {e.created_at:%d.%m.%Y %H:%M}\n {e.comment or '—'}"
+        for e in expenses
+    )
+
+
+def _boundary(expense, older: bool) -> HistoryPage:
+    return HistoryPage(older=older, at=(expense.created_at.replace(tzinfo=None) - _EPOCH) // _MICROSECOND,
+                       id=expense.id)
+
+
+def page_keyboard(page: Page) -> InlineKeyboardMarkup | None:
+    if not page.expenses:
+        return None
+    buttons = []
+    if page.has_newer:
+        buttons.append(InlineKeyboardButton(text="← Новее",
+                                            callback_data=_boundary(page.expenses[0], False).pack()))
+    if page.has_older:
+        buttons.append(InlineKeyboardButton(text="Старее →",
+                                            callback_data=_boundary(page.expenses[-1], True).pack()))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
@@ -0,0 +1,161 @@
+"""Разбивка трат общего счёта по участникам и категориям и расчёт долгов.
+
+Суммы по (участник, категория) берутся одним сгруппированным запросом по
+тратам счёта за период, включая архив (db/archive.py), с переводом в
+валюту отчёта прямо в агрегации, как в /report. Сколько бы ни было
+участников, запросов два: этот и список участников. Дальше — один проход
+по строкам результата, которых не больше «участники × категории».
+"""
+from __future__ import annotations
+
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime, time
+
+from sqlalchemy import func, select, union_all
+
+from db.archive import archived_filter
+from db.models import ArchivedExpense, Expense, FxRate, User
+
+MEMBERS_DAYS = int(os.getenv("MEMBERS_DAYS", "30"))
+# Сколько участников рисовать отдельными столбцами, остальные — одним
+MEMBERS_CHART_TOP = int(os.getenv("MEMBERS_CHART_TOP", "15"))
+# Сколько переводов перечислять в сообщении; свои — в первую очередь
+MEMBERS_SETTLEMENT_LINES = int(os.getenv("MEMBERS_SETTLEMENT_LINES", "20"))
+NAME_LENGTH = 32
+# Долги меньше копейки не показываем
+EPSILON = 0.005
+
+
+@dataclass
+class Breakdown:
+    # Участники по убыванию трат; totals[i][j] — траты members[i] в categories[j]
+    members: list[int]
+    names: dict[int, str]
+    categories: list[str]
+    totals: list[list[float]]
+
+    def paid(self) -> dict[int, float]:
+        return {member: sum(row) for member, row in zip(self.members, self.totals)}
+
+
+async def load_breakdown(session, account_id: int, since: date, base_rate: float) -> Breakdown:
+    """Траты счёта с ``since`` по участникам и категориям, в валюте с курсом ``base_rate``."""
+    start = datetime.combine(since, time())
+    # Строки счёта сворачиваются в суммы по (участник, категория, валюта)
+    # ещё в каждой части объединения, курс применяется уже к суммам
+    totals = union_all(*(
+        select(model.user_id, model.category, model.currency, func.sum(model.amount).label("total"))
+        .where(where, model.created_at >= start)
+        .group_by(model.user_id, model.category, model.currency)
+        for model, where in (
+            (Expense, Expense.account_id == account_id),
+            (ArchivedExpense, archived_filter(account_id, 0)),
+        )
+    )).subquery()
+    rows = (await session.execute(
+        select(totals.c.user_id, totals.c.category,
+               func.sum(totals.c.total / func.coalesce(FxRate.rate, base_rate)))
+        .outerjoin(FxRate, FxRate.currency == totals.c.currency)
+        .group_by(totals.c.user_id, totals.c.category)
+    )).all()
+
+    # Участники без трат тоже делят расходы; ушедшие из счёта, но тратившие, — тоже
+    names = dict((await session.execute(
+        select(User.tg_id, User.name).where(User.account_id == account_id)
+    )).all())
+    spenders = {user_id for user_id, _, _ in rows} - names.keys()
+    if spenders:
+        names.update(dict.fromkeys(spenders))
+        names.update((await session.execute(select(User.tg_id, User.name).where(User.tg_id.in_(spenders)))).all())
+
+    by_member = defaultdict(dict)
+    category_sums = defaultdict(float)
+    for user_id, category, total in rows:
+        total *= base_rate
+        by_member[user_id][category] = total
+        category_sums[category] += total
+    categories = sorted(category_sums, key=category_sums.get, reverse=True)
+    members = sorted(names, key=lambda m: sum(by_member[m].values()), reverse=True)
+    return Breakdown(
+        members=members,
+        names={m: _name(m, names[m]) for m in members},
+        categories=categories,
+        totals=[[by_member[m].get(c, 0.0) for c in categories] for m in members],
+    )
+
+
+def _name(tg_id: int, name: str | None) -> str:
+    # Имя сохраняется, когда участник создаёт счёт или входит в него
+    if not name:
+        return f"Участник {tg_id}"
+    return name if len(name) <= NAME_LENGTH else name[:NAME_LENGTH - 1] + "…"
+
+
+def settle(paid: dict[int, float]) -> list[tuple[int, int, float]]:
+    """Переводы (кто, кому, сколько), после которых все потратили поровну.
+
+    Самый большой долг гасится самому большому кредитору, пока кто-то из них
+    не обнулится, — переводов не больше, чем участников минус один.
+    """
+    if not paid:
+        return []
+    share = sum(paid.values()) / len(paid)
+    debtors = sorted(((share - p, m) for m, p in paid.items() if share - p > EPSILON), reverse=True)
+    creditors = sorted(((p - share, m) for m, p in paid.items() if p - share > EPSILON), reverse=True)
+
+    transfers = []
+    i = j = 0
+    while i < len(debtors) and j < len(creditors):
+        debt, debtor = debtors[i]
+        credit, creditor = creditors[j]
+        amount = min(debt, credit)
+        transfers.append((debtor, creditor, amount))
+        debtors[i] = (debt - amount, debtor)
+        creditors[j] = (credit - amount, creditor)
+        if debtors[i][0] <= EPSILON:
+            i += 1
+        if creditors[j][0] <= EPSILON:
+            j += 1
+    return transfers
+
+
+def chart_data(breakdown: Breakdown, top: int = MEMBERS_CHART_TOP) -> tuple[list[str], list[list[float]]]:
+    """Подписи и строки для графика: первые ``top`` участников и «остальные» одной строкой."""
+    labels = [breakdown.names[m] for m in breakdown.members[:top]]
+    rows = breakdown.totals[:top]
+    rest = breakdown.totals[top:]
+    if rest:
+        labels.append(f"Остальные ({len(rest)})")
+        rows = rows + [[sum(column) for column in zip(*rest)]]
+    return labels, rows
+
+
+def settlement_summary(breakdown: Breakdown, viewer: int, days: int, currency: str,
+            lines: int = MEMBERS_SETTLEMENT_LINES) -> str:
+    paid = breakdown.paid()
+    total = sum(paid.values())
+    share = total / len(paid)
+    text = [f"Всего за {days} дн.: {total:.2f} {currency}, "
+            f"на каждого из {len(paid)} участников — {share:.2f} {currency}."]
+
+    own = paid.get(viewer, 0.0) - share
+    if own > EPSILON:
+        text.append(f"Вы потратили {paid.get(viewer, 0.0):.2f} — вам должны {own:.2f} {currency}.")
+    elif own < -EPSILON:
+        text.append(f"Вы потратили {paid.get(viewer, 0.0):.2f} — с вас {-own:.2f} {currency}.")
+    else:
+        text.append("Вы потратили ровно свою долю.")
+
+    transfers = settle(paid)
+    if not transfers:
+        return "\n".join(text)
+    # Сначала переводы, где участвует сам пользователь, потом самые крупные
+    transfers.sort(key=lambda t: (viewer not in t[:2], -t[2]))
+    text.append("\nКто кому переводит:")
+    for debtor, creditor, amount in transfers[:lines]:
+        text.append(f"{breakdown.names[debtor]} → {breakdown.names[creditor]}: {amount:.2f} {currency}")
+    if len(transfers) > lines:
+        text.append(f"…и ещё {len(transfers) - lines} переводов")
+    return "\n".join(text)
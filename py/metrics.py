@@ -0,0 +1,283 @@
+"""Метрики в формате Prometheus и профилировщик медленных апдейтов.
+
+Гистограммы копятся в памяти процесса и отдаются на ``/metrics``
+(сервер поднимается, только если задан ``METRICS_PORT``). Свой небольшой
+реестр вместо prometheus_client, чтобы не тянуть лишнюю зависимость.
+"""
+from __future__ import annotations
+
+import bisect
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy import event
+
+from db.database import engine
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 — сервер метрик не запускаем
+# SLOW_UPDATE_PROFILE=1 — снимать стеки во время апдейтов и сохранять их для медленных
+SLOW_UPDATE_PROFILE = os.getenv("SLOW_UPDATE_PROFILE", "0") == "1"
+SLOW_UPDATE_SECONDS = float(os.getenv("SLOW_UPDATE_SECONDS", "1"))
+SLOW_UPDATE_DIR = os.getenv("SLOW_UPDATE_DIR", "slow_updates")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [счётчики по корзинам (последняя — +Inf), сумма]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+REGISTRY: list[Histogram | Counter] = []
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время работы хендлера", ("handler", "state"))
+UPDATE_SECONDS = Histogram("bot_update_seconds", "Полное время обработки апдейта")
+UPDATE_QUERIES = Histogram("bot_update_queries", "SQL-запросов за апдейт", buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34))
+SLOW_UPDATES = Counter("bot_slow_updates_total", "Апдейты дольше SLOW_UPDATE_SECONDS")
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Время SQL-запроса", ("statement",), buckets=DB_BUCKETS)
+RENDER_SECONDS = Histogram("chart_render_seconds", "Отрисовка графика в пуле процессов", ("chart",))
+FACT_SECONDS = Histogram("fact_seconds", "Получение факта о числе", ("source",))
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+@lru_cache(maxsize=1024)
+def statement_label(statement: str) -> str:
+    """«SELECT users», «INSERT expenses» — чтобы не плодить метку на каждый текст запроса."""
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    if verb == "UPDATE":
+        table = re.match(r'\s*UPDATE\s+"?(\w+)', statement, re.I)
+    else:
+        table = re.search(r'\b(?:FROM|INTO)\s+"?(\w+)', statement, re.I)
+    return f"{verb} {table.group(1)}" if table else verb
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started", None)
+    if started is not None:
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, statement_label(statement))
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Время хендлера с разбивкой по имени и состоянию FSM. Вешается на
+    ``dp.message``/``dp.callback_query``, чтобы знать, какой хендлер выбран."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        with HANDLER_SECONDS.time(name, data.get("raw_state") or "none"):
+            return await handler(event, data)
+
+
+class StackSampler:
+    """Простой семплирующий профилировщик: фоновый поток раз в ``interval``
+    снимает стек потока с event loop и засчитывает его всем апдейтам в работе.
+
+    Апдейты в одном loop идут вперемешку, поэтому у параллельных апдейтов
+    в профиле окажутся и чужие стеки — для поиска узких мест этого хватает.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self._active: dict[int, StackCounter] = {}
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._target: int | None = None
+
+    def begin(self, key: int):
+        with self._lock:
+            self._active[key] = StackCounter()
+        if self._thread is None:
+            self._target = threading.get_ident()
+            self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+            self._thread.start()
+
+    def end(self, key: int) -> StackCounter:
+        with self._lock:
+            return self._active.pop(key, StackCounter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frame = sys._current_frames().get(self._target)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{Path(code.co_filename).name}:{code.co_name}")
+                    frame = frame.f_back
+                # Формат «collapsed stacks»: корень слева, подходит для flamegraph.pl/speedscope
+                collapsed = ";".join(reversed(stack))
+                for samples in self._active.values():
+                    samples[collapsed] += 1
+
+
+sampler = StackSampler()
+
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """Общее время апдейта; при ``SLOW_UPDATE_PROFILE`` сохраняет стеки медленных апдейтов."""
+
+    def __init__(self, profile: bool = SLOW_UPDATE_PROFILE, threshold: float = SLOW_UPDATE_SECONDS,
+                 dump_dir: str = SLOW_UPDATE_DIR):
+        self.profile = profile
+        self.threshold = threshold
+        self.dump_dir = Path(dump_dir)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        key = id(event)
+        if self.profile:
+            sampler.begin(key)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            UPDATE_SECONDS.observe(elapsed)
+            samples = sampler.end(key) if self.profile else None
+            if elapsed >= self.threshold:
+                SLOW_UPDATES.inc()
+                if samples:
+                    self._dump(event, elapsed, samples)
+
+    def _dump(self, event: TelegramObject, elapsed: float, samples: StackCounter):
+        update_id = getattr(event, "update_id", None) or int(time.time() * 1000)
+        path = self.dump_dir / f"update-{update_id}.txt"
+        try:
+            self.dump_dir.mkdir(parents=True, exist_ok=True)
+            path.write_text("".join(f"{stack} {count}\n" for stack, count in samples.most_common()))
+        except OSError:
+            logging.exception("Не удалось сохранить профиль апдейта")
+            return
+        logging.warning("Медленный апдейт %s: %.2f с, профиль в %s", update_id, elapsed, path)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    from aiohttp import web
+
+    return web.Response(text=render_metrics(), content_type="text/plain")
+
+
+async def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> web.AppRunner | None:
+    if not port:
+        return None
+    # Серверная часть aiohttp нужна только с METRICS_PORT
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Метрики на http://%s:%d/metrics", host, port)
+    return runner
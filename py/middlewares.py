@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import logging
+import statistics
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy import event
+
+from db.database import engine, AsyncSessionLocal
+from metrics import UPDATE_QUERIES
+
+# Счётчик SQL-запросов текущего апдейта (список, чтобы менять его из хука)
+_query_count: ContextVar[list[int] | None] = ContextVar("query_count", default=None)
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = _query_count.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+class QueryStats:
+    """Сколько запросов к базе ушло на последние N апдейтов."""
+
+    def __init__(self, window: int = 1000):
+        self.counts: deque[int] = deque(maxlen=window)
+
+    def add(self, count: int):
+        self.counts.append(count)
+
+    @property
+    def median(self) -> float:
+        return statistics.median(self.counts) if self.counts else 0.0
+
+
+query_stats = QueryStats()
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Открывает одну сессию на апдейт и передаёт её в хендлеры как ``session``."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        counter = [0]
+        token = _query_count.set(counter)
+        try:
+            async with AsyncSessionLocal() as session:
+                data["session"] = session
+                return await handler(event, data)
+        finally:
+            _query_count.reset(token)
+            query_stats.add(counter[0])
+            UPDATE_QUERIES.observe(counter[0])
+            logging.debug("Запросов к БД за апдейт: %d (медиана %.1f)", counter[0], query_stats.median)
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+
+REPORT_CACHE_ITEMS = int(os.getenv("REPORT_CACHE_ITEMS", "1024"))
+REPORT_CACHE_BYTES = int(os.getenv("REPORT_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+
+def report_since(days: int) -> date:
+    """Первый день окна отчёта за ``days`` дней; одинаковый у /report и у рассылки-дайджеста."""
+    # Отчёт строится по дневным суммам, поэтому окно считаем целыми днями
+    return (datetime.utcnow() - timedelta(days=days)).date()
+
+
+def report_key(scope: str, version: int, days: int, since: date, base: str, fx_as_of: date | None) -> tuple:
+    """Ключ отчёта за ``days`` дней начиная с ``since`` (см. report_since)."""
+    return (scope, version, days, since, base, fx_as_of)
+
+
+@dataclass
+class ReportEntry:
+    png: bytes | None = None
+    file_id: str | None = None
+    caption: str | None = None
+
+    @property
+    def size(self) -> int:
+        return len(self.png) if self.png else 0
+
+
+class ReportCache:
+    """LRU-кэш готовых отчётов.
+
+    Ключ — (область счёта, период, начало окна, версия данных), так что после
+    новой траты или смены участников старые записи просто перестают
+    запрашиваться и вытесняются. Как только Telegram вернул ``file_id``,
+    картинку из памяти выкидываем: повторно отправляем уже по id.
+    """
+
+    def __init__(self, max_items: int = REPORT_CACHE_ITEMS, max_bytes: int = REPORT_CACHE_BYTES):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, ReportEntry] = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: tuple) -> ReportEntry | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: tuple, png: bytes | None, caption: str | None = None) -> ReportEntry:
+        self._drop(key)
+        entry = ReportEntry(png=png, caption=caption)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        self._evict()
+        return entry
+
+    def remember_file_id(self, key: tuple, file_id: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = ReportEntry()
+        self._bytes -= entry.size
+        entry.png = None
+        entry.file_id = file_id
+        self._evict()
+
+    def _drop(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_items or self._bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+
+
+report_cache = ReportCache()
@@ -0,0 +1,41 @@
+"""/search: разбор запроса и кнопки страниц. Сам поиск — в db/search.py."""
+from __future__ import annotations
+
+import os
+import zlib
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "10"))
+
+
+class SearchResults(CallbackData, prefix="search"):
+    page: int
+    days: int
+    # Сам запрос в callback_data не помещается (64 байта) и лежит в данных FSM;
+    # контрольная сумма отличает кнопки старого поиска от текущего
+    key: int
+
+
+def query_key(query: str) -> int:
+    return zlib.crc32(query.encode())
+
+
+def parse_search(text: str) -> tuple[str, int]:
+    """«/search кофе 30» -> ("кофе", 30); без числа в конце — за всё время (0)."""
+    words = text.split()[1:]
+    if len(words) > 1 and words[-1].isdigit():
+        return " ".join(words[:-1]), int(words[-1])
+    return " ".join(words), 0
+
+
+def results_keyboard(page: int, days: int, key: int, has_more: bool) -> InlineKeyboardMarkup | None:
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(
+            text="← Назад", callback_data=SearchResults(page=page - 1, days=days, key=key).pack()))
+    if has_more:
+        buttons.append(InlineKeyboardButton(
+            text="Дальше →", callback_data=SearchResults(page=page + 1, days=days, key=key).pack()))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+# Лимиты Telegram: около 30 сообщений в секунду на бота, в личный чат —
+# примерно одно в секунду (короткие всплески допустимы), в группу — 20 в минуту
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+SEND_BUCKETS_SIZE = int(os.getenv("SEND_BUCKETS_SIZE", "10000"))
+
+MAX_MESSAGE_LENGTH = 4096
+# Поля, которые должны совпадать, чтобы два сообщения можно было склеить в одно
+_MERGE_FIELDS = ("business_connection_id", "message_thread_id", "parse_mode", "link_preview_options",
+                 "disable_notification", "protect_content", "message_effect_id", "disable_web_page_preview")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self) -> float:
+        """Через сколько секунд можно будет взять токен; 0 — можно сейчас."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        # После 429 Telegram сам говорит, сколько ждать
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+@dataclass
+class _Outgoing:
+    method: object
+    make_request: object
+    bot: object
+    futures: list[asyncio.Future] = field(default_factory=list)
+
+
+def _mergeable(first, second) -> bool:
+    if not isinstance(first, SendMessage) or not isinstance(second, SendMessage):
+        return False
+    # Клавиатура и ответ на сообщение имеют смысл только у последнего/первого куска.
+    # Сообщения с entities не склеиваются никогда: со смещениями разметки так
+    # отправляют и то, что должно прийти отдельным сообщением (код и пароль счёта)
+    if first.reply_markup is not None or first.entities or second.entities:
+        return False
+    if second.reply_parameters is not None or second.reply_to_message_id is not None:
+        return False
+    if len(first.text) + len(second.text) + 2 > MAX_MESSAGE_LENGTH:
+        return False
+    return all(getattr(first, name) == getattr(second, name) for name in _MERGE_FIELDS)
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Единая очередь исходящих сообщений бота.
+
+    Подключается к сессии бота (``bot.session.middleware``), поэтому через неё
+    проходит всё, что отправляют хендлеры. Запросы в один чат уходят строго по
+    очереди, с учётом лимита на чат и общего лимита бота. Пока чат ждёт своей
+    очереди, подряд идущие текстовые сообщения склеиваются в одно. На 429
+    запрос повторяется через ``retry_after``.
+    """
+
+    def __init__(self, global_rate: float = SEND_GLOBAL_RATE, chat_rate: float = SEND_CHAT_RATE,
+                 chat_burst: float = SEND_CHAT_BURST, group_rate: float = SEND_GROUP_RATE,
+                 max_retries: int = SEND_MAX_RETRIES, buckets_size: int = SEND_BUCKETS_SIZE):
+        # Общий лимит без запаса на всплеск: иначе в первую секунду ушло бы вдвое больше
+        self.global_bucket = TokenBucket(global_rate, 1)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.buckets_size = buckets_size
+        self._buckets: OrderedDict[int | str, TokenBucket] = OrderedDict()
+        self._queues: dict[int | str, deque[_Outgoing]] = {}
+        self._workers: dict[int | str, asyncio.Task] = {}
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+
+    def set_global_rate(self, rate: float):
+        # В webhook-режиме общий лимит делится между процессами
+        self.global_bucket = TokenBucket(rate, 1)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(chat_id, deque())
+        # Пока чат ждёт лимита, новый текст приклеивается к последнему в очереди
+        if queue and _mergeable(queue[-1].method, method):
+            last = queue[-1]
+            last.method = last.method.model_copy(update={
+                "text": f"{last.method.text}\n\n{method.text}",
+                "reply_markup": method.reply_markup,
+            })
+            last.futures.append(future)
+            self.coalesced += 1
+        else:
+            queue.append(_Outgoing(method, make_request, bot, [future]))
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        return await future
+
+    def _bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # У групп и каналов id отрицательный (или @username)
+            is_group = not isinstance(chat_id, int) or chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, 1 if is_group else self.chat_burst)
+            while len(self._buckets) > self.buckets_size:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(chat_id)
+        return bucket
+
+    async def _acquire(self, bucket: TokenBucket):
+        while True:
+            delay = max(bucket.delay(), self.global_bucket.delay())
+            if not delay:
+                bucket.take()
+                self.global_bucket.take()
+                return
+            await asyncio.sleep(delay)
+
+    async def _drain(self, chat_id: int | str):
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                await self._acquire(self._bucket(chat_id))
+                item = queue.popleft()
+                futures = [f for f in item.futures if not f.done()]
+                if not futures:
+                    continue  # все, кто ждал, уже отменены
+                try:
+                    result = await self._send(chat_id, item)
+                except Exception as e:
+                    for f in futures:
+                        if not f.done():
+                            f.set_exception(e)
+                else:
+                    for f in futures:
+                        if not f.done():
+                            f.set_result(result)
+        finally:
+            del self._queues[chat_id]
+            del self._workers[chat_id]
+
+    async def _send(self, chat_id: int | str, item: _Outgoing):
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = await item.make_request(item.bot, item.method)
+                self.sent += 1
+                return result
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retried += 1
+                logging.warning("Flood control для чата %s, ждём %s с", chat_id, e.retry_after)
+                bucket = self._bucket(chat_id)
+                bucket.block(e.retry_after)
+                await self._acquire(bucket)
+
+    async def close(self):
+        if self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+
+send_scheduler = SendScheduler()
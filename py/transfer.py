@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import csv
+import io
+import math
+import os
+import zipfile
+from datetime import datetime, timezone
+from typing import AsyncGenerator, Callable, Iterator
+
+from aiogram.types import InputFile
+from sqlalchemy import select
+
+from constants import DEFAULT_CATEGORIES, POPULAR_CURRENCIES
+from db.archive import archived_filter
+from db.expenses import expense_filter, insert_expenses
+from db.models import ArchivedExpense, Expense
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+# Файлы больше этого размера при загрузке уходят из памяти во временный файл
+IMPORT_SPOOL_SIZE = 1024 * 1024
+
+CSV_COLUMNS = ["created_at", "amount", "currency", "category", "comment"]
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class ExpenseCsvFile(InputFile):
+    """CSV с тратами, который пишется прямо во время загрузки в Telegram.
+
+    Строки читаются из базы серверным курсором порциями по ``chunk_rows``,
+    так что в памяти одновременно лежит только одна порция. Сначала идут
+    траты из архива, потом живые — каждая часть в порядке своего индекса,
+    без сортировки всей выборки.
+    """
+
+    def __init__(self, session, account_id: int | None, user_id: int, filename: str = "expenses.csv",
+                 chunk_rows: int = EXPORT_CHUNK_ROWS):
+        super().__init__(filename=filename)
+        self.session = session
+        self.account_id = account_id
+        self.user_id = user_id
+        self.chunk_rows = chunk_rows
+        self.rows_written = 0
+
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        # BOM, чтобы Excel сразу открыл кириллицу правильно
+        yield "\ufeff".encode()
+        writer.writerow(CSV_COLUMNS)
+
+        for model, where in (
+            (ArchivedExpense, archived_filter(self.account_id, self.user_id)),
+            (Expense, expense_filter(self.account_id, self.user_id)),
+        ):
+            result = await self.session.stream(
+                select(model.created_at, model.amount, model.currency, model.category, model.comment)
+                .where(where)
+                .order_by(model.created_at, model.id)
+                .execution_options(yield_per=self.chunk_rows)
+            )
+            async for partition in result.partitions():
+                for created_at, amount, currency, category, comment in partition:
+                    writer.writerow([created_at.strftime(DATE_FORMAT), amount, currency, category, comment or ""])
+                self.rows_written += len(partition)
+                yield buf.getvalue().encode()
+                buf.seek(0)
+                buf.truncate()
+
+        if buf.tell():
+            yield buf.getvalue().encode()
+
+
+class ImportFileError(ValueError):
+    """Файл или строка не подходят для импорта.
+
+    Если файл перестал читаться посреди импорта, в ``imported`` — сколько
+    трат до этого места уже добавлено, в ``line`` — строка, на которой
+    чтение оборвалось.
+    """
+
+    def __init__(self, message: str, imported: int = 0, line: int | None = None):
+        super().__init__(message)
+        self.imported = imported
+        self.line = line
+
+
+def _iter_csv(fileobj) -> Iterator[dict]:
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    # Файл декодируется по мере чтения, так что ошибка может всплыть на любой строке
+    try:
+        yield from csv.DictReader(text)
+    except UnicodeDecodeError:
+        raise ImportFileError("Файл не в кодировке UTF-8. Сохраните CSV в UTF-8 и пришлите ещё раз.")
+    except csv.Error as e:
+        raise ImportFileError(f"Не получается прочитать CSV: {e}")
+
+
+def _iter_xlsx(fileobj) -> Iterator[dict]:
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFileError("Для импорта XLSX на сервере должен быть установлен openpyxl. Пришлите CSV.")
+
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    # read_only — строки читаются потоком, без загрузки всей книги
+    try:
+        sheet = load_workbook(fileobj, read_only=True, data_only=True).active
+    except (zipfile.BadZipFile, InvalidFileException, KeyError):
+        raise ImportFileError("Файл не похож на XLSX. Пришлите книгу Excel или CSV.")
+    rows = sheet.iter_rows(values_only=True)
+    header = [str(c).strip() if c is not None else "" for c in next(rows, [])]
+    for row in rows:
+        yield dict(zip(header, row))
+
+
+def iter_import_rows(fileobj, filename: str) -> Iterator[dict]:
+    if filename.lower().endswith(".xlsx"):
+        return _iter_xlsx(fileobj)
+    return _iter_csv(fileobj)
+
+
+def parse_row(raw: dict, user_id: int, account_id: int | None) -> dict:
+    try:
+        amount = float(str(raw.get("amount", "")).replace(",", ".").replace(" ", ""))
+    except ValueError:
+        raise ImportFileError(f"неверная сумма {raw.get('amount')!r}")
+    # float() понимает и "nan", и "inf", но в базе сумма должна быть числом
+    if not math.isfinite(amount):
+        raise ImportFileError(f"неверная сумма {raw.get('amount')!r}")
+
+    currency = str(raw.get("currency") or "").strip().upper()
+    if currency not in POPULAR_CURRENCIES:
+        raise ImportFileError(f"неизвестная валюта {currency!r}")
+
+    category = str(raw.get("category") or "").strip()
+    if category not in DEFAULT_CATEGORIES:
+        raise ImportFileError(f"неизвестная категория {category!r}")
+
+    created_at = raw.get("created_at")
+    if isinstance(created_at, datetime):
+        pass
+    elif created_at:
+        try:
+            created_at = datetime.fromisoformat(str(created_at).strip())
+        except ValueError:
+            raise ImportFileError(f"неверная дата {created_at!r}")
+    else:
+        created_at = datetime.utcnow()
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc)
+
+    return dict(
+        user_id=user_id,
+        account_id=account_id,
+        amount=amount,
+        currency=currency,
+        category=category,
+        comment=str(raw.get("comment") or ""),
+        created_at=created_at.replace(tzinfo=None),
+    )
+
+
+async def import_expenses(session, rows: Iterator[dict], user_id: int, account_id: int | None,
+                          batch_size: int = IMPORT_BATCH_SIZE,
+                          on_budget_alerts: Callable[[list], None] | None = None) -> tuple[int, list[str]]:
+    """Вставляет траты пачками по ``batch_size``; каждая пачка — своя транзакция.
+
+    Возвращает число добавленных строк и описания первых ошибок. Если файл
+    перестал читаться, всё прочитанное до этого места добавляется, а
+    ImportFileError уходит наверх с ``imported`` и ``line``.
+    """
+    async def insert(batch):
+        alerts = await insert_expenses(session, batch)
+        await session.commit()
+        if alerts and on_budget_alerts is not None:
+            on_budget_alerts(alerts)
+
+    imported = 0
+    errors: list[str] = []
+    batch: list[dict] = []
+    # Первая строка файла — заголовок, поэтому данные начинаются со второй
+    line = 1
+    rows = iter(rows)
+    while True:
+        try:
+            raw = next(rows, None)
+        except ImportFileError as e:
+            if batch:
+                await insert(batch)
+                imported += len(batch)
+            raise ImportFileError(str(e), imported=imported, line=line + 1) from e
+        if raw is None:
+            break
+        line += 1
+        try:
+            batch.append(parse_row(raw, user_id, account_id))
+        except ImportFileError as e:
+            if len(errors) < 10:
+                errors.append(f"строка {line}: {e}")
+            continue
+        if len(batch) >= batch_size:
+            await insert(batch)
+            imported += len(batch)
+            batch = []
+
+    if batch:
+        await insert(batch)
+        imported += len(batch)
+    return imported, errors
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    id: int
+    tg_id: int
+    account_id: int | None
+    base_currency: str | None = None
+
+
+class UserCache:
+    """LRU-кэш tg_id -> (users.id, account_id) с временем жизни записи.
+
+    Сбрасывается вручную при входе в счёт, выходе из него и создании счёта;
+    TTL страхует от изменений, сделанных другим процессом.
+    """
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[int, tuple[float, CachedUser]] = OrderedDict()
+
+    def get(self, tg_id: int) -> CachedUser | None:
+        item = self._entries.get(tg_id)
+        if item is None:
+            return None
+        expires_at, user = item
+        if expires_at < time.monotonic():
+            del self._entries[tg_id]
+            return None
+        self._entries.move_to_end(tg_id)
+        return user
+
+    def put(self, tg_id: int, user_id: int, account_id: int | None,
+            base_currency: str | None = None) -> CachedUser:
+        user = CachedUser(id=user_id, tg_id=tg_id, account_id=account_id, base_currency=base_currency)
+        self._entries[tg_id] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(tg_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, tg_id: int):
+        self._entries.pop(tg_id, None)
+
+
+user_cache = UserCache()
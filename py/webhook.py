@@ -0,0 +1,233 @@
+"""Webhook-режим: aiohttp принимает апдейты и раздаёт их N процессам.
+
+Апдейты одного чата всегда попадают в один и тот же процесс и внутри него
+обрабатываются строго по очереди, поэтому порядок шагов FSM сохраняется.
+Запуск (из папки py, как и bot.py)::
+
+    python bot.py migrate    # один раз перед запуском и после обновления
+    WEBHOOK_URL=https://example.com/webhook WEBHOOK_WORKERS=4 python webhook.py
+
+С ``METRICS_PORT`` процесс i отдаёт свои метрики на порту METRICS_PORT + 1 + i.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+
+from aiohttp import web
+
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Публичный адрес, который сообщаем Telegram; без него вебхук не ставим
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 1)))
+# Сколько апдейтов может ждать в очереди одного процесса, дальше отвечаем 503
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+LOG_FORMAT = "%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s"
+
+_CHAT_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post",
+                "business_message", "edited_business_message")
+
+
+def update_chat_id(update: dict) -> int:
+    for field in _CHAT_FIELDS:
+        if field in update:
+            return update[field]["chat"]["id"]
+    callback = update.get("callback_query")
+    if callback is not None:
+        if callback.get("message"):
+            return callback["message"]["chat"]["id"]
+        return callback["from"]["id"]
+    for value in update.values():
+        if isinstance(value, dict) and "from" in value:
+            return value["from"]["id"]
+    return update.get("update_id", 0)
+
+
+def _worker_entry(index: int, workers: int, updates, processed, errors):
+    logging.basicConfig(format=LOG_FORMAT, level=logging.INFO)
+    asyncio.run(_run_worker(index, workers, updates, processed, errors))
+
+
+async def _run_worker(index: int, workers: int, updates, processed, errors):
+    # Тяжёлые импорты только в рабочих процессах
+    import bot as app
+    from send_queue import send_scheduler, SEND_GLOBAL_RATE
+
+    # Лимит Telegram общий на бота, а процессов несколько
+    send_scheduler.set_global_rate(SEND_GLOBAL_RATE / workers)
+    bot = app.create_bot()
+    dp = app.build_dispatcher()
+    dp["run_recurring"] = index == 0
+    dp["run_archive"] = index == 0
+    # Апдейты чата приходят в процесс chat_id % workers — туда же и его дайджест
+    dp["digest_shard"] = (index, workers)
+    if METRICS_PORT:
+        # /metrics самого процесса; сводка по очередям — на основном порту
+        dp["metrics_port"] = METRICS_PORT + 1 + index
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+
+    loop = asyncio.get_running_loop()
+    chat_locks: dict[int, asyncio.Lock] = {}
+    chat_pending: dict[int, int] = {}
+    tasks: set[asyncio.Task] = set()
+
+    async def handle(chat_id: int, update: dict):
+        # asyncio.Lock пропускает ждущих по порядку — это и есть очередь чата
+        lock = chat_locks.setdefault(chat_id, asyncio.Lock())
+        try:
+            async with lock:
+                await dp.feed_raw_update(bot, update)
+            processed[index] += 1
+        except Exception:
+            errors[index] += 1
+            logging.exception("Ошибка при обработке апдейта %s", update.get("update_id"))
+        finally:
+            chat_pending[chat_id] -= 1
+            if not chat_pending[chat_id]:
+                del chat_pending[chat_id]
+                del chat_locks[chat_id]
+
+    try:
+        while True:
+            item = await loop.run_in_executor(None, updates.get)
+            if item is None:
+                break
+            chat_id, update = item
+            chat_pending[chat_id] = chat_pending.get(chat_id, 0) + 1
+            task = asyncio.create_task(handle(chat_id, update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        # Дорабатываем всё, что уже взяли из очереди
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+
+
+class WorkerPool:
+    def __init__(self, workers: int = WEBHOOK_WORKERS, queue_size: int = WEBHOOK_QUEUE_SIZE):
+        # spawn, а не fork: у родителя уже есть event loop и движок БД
+        ctx = multiprocessing.get_context("spawn")
+        self.workers = workers
+        self.queues = [ctx.Queue(maxsize=queue_size) for _ in range(workers)]
+        # Каждый счётчик пишет только один процесс, поэтому без блокировок
+        self.received = ctx.Array("q", workers, lock=False)
+        self.rejected = ctx.Array("q", workers, lock=False)
+        self.processed = ctx.Array("q", workers, lock=False)
+        self.errors = ctx.Array("q", workers, lock=False)
+        self.processes = [
+            ctx.Process(target=_worker_entry, name=f"worker-{i}",
+                        args=(i, workers, self.queues[i], self.processed, self.errors))
+            for i in range(workers)
+        ]
+        self.draining = False
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def submit(self, update: dict) -> bool:
+        chat_id = update_chat_id(update)
+        shard = chat_id % self.workers
+        try:
+            self.queues[shard].put_nowait((chat_id, update))
+        except queue.Full:
+            self.rejected[shard] += 1
+            return False
+        self.received[shard] += 1
+        return True
+
+    def stats(self) -> list[dict]:
+        return [
+            {
+                "worker": i,
+                "alive": self.processes[i].is_alive(),
+                "received": self.received[i],
+                "rejected": self.rejected[i],
+                "processed": self.processed[i],
+                "errors": self.errors[i],
+                "backlog": self.received[i] - self.processed[i] - self.errors[i],
+            }
+            for i in range(self.workers)
+        ]
+
+    def drain(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+        self.draining = True
+        for q in self.queues:
+            q.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logging.warning("%s не завершился за %s с, останавливаем", process.name, timeout)
+                process.terminate()
+
+
+async def handle_update(request: web.Request) -> web.Response:
+    if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        return web.Response(status=403)
+    pool: WorkerPool = request.app["pool"]
+    # 503 — Telegram повторит доставку позже
+    if pool.draining or not pool.submit(await request.json()):
+        return web.Response(status=503)
+    return web.Response()
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    pool: WorkerPool = request.app["pool"]
+    stats = pool.stats()
+    status = 200 if all(s["alive"] for s in stats) else 503
+    return web.json_response({"draining": pool.draining, "workers": stats}, status=status)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    pool: WorkerPool = request.app["pool"]
+    lines = []
+    for field in ("received", "rejected", "processed", "errors"):
+        lines.append(f"# TYPE webhook_updates_{field}_total counter")
+        lines.extend(f'webhook_updates_{field}_total{{worker="{s["worker"]}"}} {s[field]}' for s in pool.stats())
+    lines.append("# TYPE webhook_backlog gauge")
+    lines.extend(f'webhook_backlog{{worker="{s["worker"]}"}} {s["backlog"]}' for s in pool.stats())
+    return web.Response(text="\n".join(lines) + "\n", content_type="text/plain")
+
+
+async def on_startup(app: web.Application):
+    import bot as app_module
+
+    await app_module.check_db()
+    app["pool"].start()
+    if WEBHOOK_URL:
+        bot = app_module.create_bot()
+        await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET, drop_pending_updates=False)
+        await bot.session.close()
+
+
+async def on_shutdown(app: web.Application):
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, app["pool"].drain)
+
+
+def create_app(workers: int = WEBHOOK_WORKERS) -> web.Application:
+    app = web.Application()
+    app["pool"] = WorkerPool(workers)
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format=LOG_FORMAT, level=logging.INFO)
+    web.run_app(create_app(), host=WEBHOOK_HOST, port=WEBHOOK_PORT)
@@ -0,0 +1,123 @@
+"""Общая обвязка тестов.
+
+Бот работает как в webhook-режиме: апдейты подаются в ``dp.feed_raw_update``,
+а всё, что он отправляет, уходит по HTTP в поддельный Bot API из
+bench/e2e.py, поднятый в том же event loop. База — временный файл SQLite.
+
+Асинхронные тесты (``async def test_...``) выполняются в одном общем event
+loop: движок базы и сессия бота живут всю сессию pytest.
+"""
+import asyncio
+import inspect
+import os
+import sys
+import tempfile
+import types
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "py"))
+sys.path.insert(0, str(ROOT))
+
+from bench.e2e import BENCH_TOKEN, Session, _free_port, fake_bot_api  # noqa: E402
+
+# Настройки читаются при импорте модулей бота, поэтому задаются заранее
+_tmp = tempfile.TemporaryDirectory()
+DB_PATH = Path(_tmp.name) / "expenses.db"
+API_PORT = _free_port()
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{API_PORT}"
+# Закрытый порт: факты сразу берутся из офлайн-набора
+os.environ["FACTS_API_URL"] = f"http://127.0.0.1:{_free_port()}"
+os.environ["SEND_CHAT_RATE"] = os.environ["SEND_CHAT_BURST"] = "1000"
+os.environ["SEND_GLOBAL_RATE"] = "100000"
+for name in ("FX_RATES_URL", "METRICS_PORT", "ARCHIVE_DATABASE"):
+    os.environ.pop(name, None)
+try:
+    import config  # noqa: F401
+except ImportError:
+    # config.py с настоящим токеном есть только у того, кто запускает бота
+    config = types.ModuleType("config")
+    config.BOT_TOKEN = BENCH_TOKEN
+    sys.modules["config"] = config
+
+LOOP = asyncio.new_event_loop()
+asyncio.set_event_loop(LOOP)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    if inspect.iscoroutinefunction(pyfuncitem.obj):
+        kwargs = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+        LOOP.run_until_complete(pyfuncitem.obj(**kwargs))
+        return True
+
+
+@pytest.fixture(scope="session")
+def api():
+    """Поддельный Bot API; ``api["requests"]`` — всё, что бот отправил."""
+    from aiohttp import web
+
+    app = fake_bot_api(record=True)
+    runner = web.AppRunner(app, access_log=None)
+    LOOP.run_until_complete(runner.setup())
+    LOOP.run_until_complete(web.TCPSite(runner, "127.0.0.1", API_PORT).start())
+    yield app
+    LOOP.run_until_complete(runner.cleanup())
+
+
+@pytest.fixture(scope="session")
+def bot_app(api):
+    """Модуль bot, бот и диспетчер со свежей схемой базы и загруженными курсами."""
+    import bot as app
+    from db.database import engine
+    from fx import refresh_rates
+
+    LOOP.run_until_complete(app.init_db())
+    LOOP.run_until_complete(refresh_rates())
+    bot = app.create_bot()
+    dp = app.build_dispatcher()
+    yield app, bot, dp
+    LOOP.run_until_complete(app.expense_writer.stop())
+    LOOP.run_until_complete(dp.storage.close())
+    LOOP.run_until_complete(app.fact_client.close())
+    LOOP.run_until_complete(bot.session.close())
+    LOOP.run_until_complete(engine.dispose())
+
+
+class Chat:
+    """Личный чат пользователя с ботом."""
+
+    def __init__(self, bot_app, api, tg_id: int, name: str = "Тест"):
+        self.app, self.bot, self.dp = bot_app
+        self.api = api
+        self.tg_id = tg_id
+        self.name = name
+        self.session = Session(tg_id)
+
+    async def send(self, text: str) -> list[tuple[str, dict]]:
+        """Отправляет боту сообщение; возвращает запросы, которые бот сделал в ответ."""
+        update = self.session.update(text)
+        update["message"]["from"]["first_name"] = self.name
+        return await self.feed(update)
+
+    async def press(self, callback_data: str, message_id: int = 1) -> list[tuple[str, dict]]:
+        user = {"id": self.tg_id, "is_bot": False, "first_name": self.name}
+        return await self.feed({"update_id": next(Session.update_ids), "callback_query": {
+            "id": str(next(Session.update_ids)), "from": user, "chat_instance": "test", "data": callback_data,
+            "message": {"message_id": message_id, "date": 0, "chat": {"id": self.tg_id, "type": "private"},
+                        "from": user, "text": "…"},
+        }})
+
+    async def feed(self, update: dict) -> list[tuple[str, dict]]:
+        requests = self.api["requests"]
+        start = len(requests)
+        await self.dp.feed_raw_update(self.bot, update)
+        return [(method, data) for method, data in requests[start:] if int(data.get("chat_id", 0)) == self.tg_id]
+
+
+@pytest.fixture
+def chat(bot_app, api):
+    return lambda tg_id, name="Тест": Chat(bot_app, api, tg_id, name)
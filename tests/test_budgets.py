@@ -0,0 +1,18 @@
+"""/budget: сумма, которую не записать в базу, получает подсказку, а не ошибку."""
+import pytest
+
+
+@pytest.mark.parametrize("amount", ["nan", "inf", "-inf"])
+async def test_non_finite_budget_is_rejected(chat, amount):
+    from sqlalchemy import func, select
+
+    from db.database import AsyncSessionLocal
+    from db.models import Budget
+
+    user = chat(6301)
+    await user.send("/start")
+    answer = await user.send(f"/budget Еда {amount} RUB")
+
+    assert answer[0][1]["text"].startswith("Напишите категорию, сумму")
+    async with AsyncSessionLocal() as session:
+        assert not await session.scalar(select(func.count()).select_from(Budget).where(Budget.scope == "user:6301"))
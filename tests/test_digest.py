@@ -0,0 +1,52 @@
+"""Дайджест: выпуск считается отправленным, только если он дошёл или отправлять было нечего."""
+
+
+async def sent_on(tg_ids: list[int]) -> dict:
+    from sqlalchemy import select
+
+    from db.database import AsyncSessionLocal
+    from db.models import User
+
+    async with AsyncSessionLocal() as session:
+        return dict((await session.execute(select(User.tg_id, User.digest_sent_on).where(User.tg_id.in_(tg_ids)))).all())
+
+
+async def test_failed_digest_is_retried(bot_app, chat, monkeypatch):
+    from sqlalchemy import update
+
+    import digest
+    from db.database import AsyncSessionLocal
+    from db.models import User
+
+    app, bot, _ = bot_app
+    paid, failed, idle = 6401, 6402, 6403
+    for tg_id in (paid, failed, idle):
+        user = chat(tg_id)
+        await user.send("/start")
+        await user.send("/digest неделя")
+    async with AsyncSessionLocal() as session:
+        for tg_id in (paid, failed):
+            await app.add_expense(tg_id, 100.0, "RUB", "Еда", session=session)
+        # Подписка откладывает первый выпуск до следующего периода — будто он уже наступил
+        await session.execute(update(User).where(User.tg_id.in_([paid, failed, idle])).values(digest_sent_on=None))
+        await session.commit()
+
+    # Выпуск положен с начала недели, в любой час
+    monkeypatch.setattr(digest, "DIGEST_HOUR", 0)
+    job = digest.DigestJob(bot, window=0)
+    send = job._send
+
+    async def flaky_send(tg_id, key, title):
+        if tg_id == failed:
+            return False
+        return await send(tg_id, key, title)
+
+    monkeypatch.setattr(job, "_send", flaky_send)
+    assert await job.run("week") == 1
+    marks = await sent_on([paid, failed, idle])
+    assert marks[paid] is not None and marks[idle] is not None
+    assert marks[failed] is None
+
+    monkeypatch.setattr(job, "_send", send)
+    assert await job.run("week") == 1
+    assert (await sent_on([failed]))[failed] is not None
@@ -0,0 +1,53 @@
+"""Очередь ExpenseWriter: испорченная трата не держит очередь, при занятой базе траты не теряются."""
+from datetime import datetime
+
+import pytest
+
+
+def row(user_id: int, amount) -> dict:
+    return dict(user_id=user_id, account_id=None, amount=amount, currency="RUB", category="Еда", comment="",
+                created_at=datetime.utcnow())
+
+
+async def count(user_id: int) -> int:
+    from sqlalchemy import func, select
+
+    from db.database import AsyncSessionLocal
+    from db.models import Expense
+
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(func.count()).select_from(Expense).where(Expense.user_id == user_id))
+
+
+async def test_bad_row_is_dropped_and_others_written(bot_app):
+    from expense_writer import ExpenseWriter
+
+    writer = ExpenseWriter()
+    # Одна пачка, как у фоновой задачи; NOT NULL на amount — так в базу попадал nan
+    writer._pending.extend([row(9101, 10.0), row(9101, None), row(9102, 20.0)])
+    await writer.flush()
+
+    assert writer.pending == 0
+    assert await count(9101) == 1
+    assert await count(9102) == 1
+
+
+async def test_transient_error_keeps_batch(bot_app, monkeypatch):
+    from sqlalchemy.exc import OperationalError
+
+    from expense_writer import ExpenseWriter
+
+    async def locked(rows):
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    writer = ExpenseWriter()
+    writer._pending.append(row(9103, 5.0))
+    monkeypatch.setattr(writer, "_insert", locked)
+    with pytest.raises(OperationalError):
+        await writer.flush()
+    assert writer.pending == 1
+
+    monkeypatch.undo()
+    await writer.flush()
+    assert writer.pending == 0
+    assert await count(9103) == 1
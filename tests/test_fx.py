@@ -0,0 +1,38 @@
+"""Перевод валют: сумма в валюте без курса не пересчитывается — в fx, в бюджетах и в SQL отчёта."""
+import pytest
+
+
+def test_unknown_currency_is_not_converted(bot_app):
+    from db.budgets import _convert
+    from fx import fx_rates
+
+    rates = dict(fx_rates.rates)
+    assert fx_rates.convert(100.0, "XXX", "RUB") == _convert(100.0, "XXX", "RUB", rates) == 100.0
+    assert fx_rates.convert(100.0, "RUB", "XXX") == _convert(100.0, "RUB", "XXX", rates) == 100.0
+    assert fx_rates.convert(100.0, "USD", "RUB") == pytest.approx(_convert(100.0, "USD", "RUB", rates))
+    assert fx_rates.convert(100.0, "USD", "RUB") == pytest.approx(100.0 * rates["RUB"] / rates["USD"])
+
+
+async def test_report_sql_matches_convert(bot_app):
+    from sqlalchemy import func, literal, select
+
+    from db.database import AsyncSessionLocal
+    from db.models import FxRate
+    from fx import fx_rates
+
+    base_rate = fx_rates.rate("RUB")
+    async with AsyncSessionLocal() as session:
+        for currency in ("XXX", "USD", "RUB"):
+            total = await session.scalar(
+                select(literal(100.0) / func.coalesce(FxRate.rate, base_rate))
+                .select_from(select(literal(currency).label("currency")).subquery("t"))
+                .outerjoin(FxRate, FxRate.currency == currency)
+            )
+            assert total * base_rate == pytest.approx(fx_rates.convert(100.0, currency, "RUB"))
+
+
+def test_snapshot_without_report_currency_is_rejected(bot_app):
+    from fx import FxRates
+
+    with pytest.raises(ValueError, match="RUB"):
+        FxRates().load({"date": "2024-01-01", "base": "USD", "rates": {"EUR": 0.9}})
@@ -0,0 +1,27 @@
+"""/members: график общий для счёта, а расчёт долга — свой у каждого участника."""
+import re
+
+
+async def test_settlement_is_per_viewer(bot_app, chat):
+    from db.database import AsyncSessionLocal
+
+    app = bot_app[0]
+    owner, member = chat(6101, "Платил"), chat(6102, "Не платил")
+    await owner.send("/start")
+    await owner.send("Настройки")
+    created = await owner.send("Создать новый счет")
+    code, password = re.search(r"Код счёта: (\S+)\nПароль: (\S+)", created[0][1]["text"]).groups()
+    await member.send("/start")
+    await member.send("Настройки")
+    await member.send("Подключиться к существующему счету")
+    await member.send(f"{code} {password}")
+    async with AsyncSessionLocal() as session:
+        await app.add_expense(6101, 300.0, "RUB", "Еда", session=session)
+
+    paid = await owner.send("/members")
+    owed = await member.send("/members")
+
+    assert "вам должны 150.00 RUB" in paid[-1][1]["text"]
+    assert "с вас 150.00 RUB" in owed[-1][1]["text"]
+    # График второму участнику тоже отправлен
+    assert owed[0][0] == "sendPhoto"
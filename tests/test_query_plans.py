@@ -0,0 +1,173 @@
+"""Ни один запрос бота не должен читать большую таблицу целиком.
+
+Тест проходит все команды бота и фоновые задачи на заполненной базе,
+записывает каждый выполненный запрос и прогоняет его через
+``EXPLAIN QUERY PLAN``. Строка плана ``SCAN <таблица>`` без индекса или с
+полным проходом индекса — ошибка: на живой базе такой запрос растёт вместе
+с таблицей. Новый запрос попадает под проверку сам, как только его
+выполняет какой-нибудь шаг сценария.
+"""
+import random
+import re
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, select
+
+from conftest import DB_PATH
+
+# Маленькие справочники, которые дешевле прочитать целиком
+ALLOWED_SCANS = {"fx_rates", "schema_version"}
+# Запросы, которым и нужна вся таблица: раз в сутки reconcile_budgets без
+# scope сверяет все бюджеты — читает их и берёт суммы только их scope
+INTENDED_SCANS = {
+    "budgets": re.compile(r"^SELECT budgets\.scope, budgets\.category, budgets\.currency, budgets\.month, "
+                          r"budgets\.notified \nFROM budgets$"
+                          r"|daily_category_totals\.scope IN \(SELECT budgets\.scope \nFROM budgets\)"),
+}
+
+_SKIP = re.compile(r"^\s*(PRAGMA|ATTACH|CREATE|DROP|ALTER|BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE)\b", re.I)
+_SOURCE = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(?:\w+\.)?(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.I)
+_NOT_ALIAS = {"where", "on", "join", "left", "inner", "outer", "cross", "group", "order", "limit", "union",
+              "using", "set", "and", "values", "select", "returning", "default", "as"}
+
+
+@pytest.fixture
+def statements(bot_app):
+    from db.database import engine
+
+    seen = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not _SKIP.match(statement):
+            params = parameters[0] if executemany and parameters else parameters
+            seen.setdefault(statement, tuple(params or ()))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    yield seen
+    event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+
+def table_aliases(statement: str, tables: set[str]) -> dict[str, str]:
+    aliases = {name: name for name in tables}
+    for table, alias in _SOURCE.findall(statement):
+        if table in tables and alias and alias.lower() not in _NOT_ALIAS:
+            aliases[alias] = table
+    return aliases
+
+
+def full_scans(conn, statement: str, params: tuple, tables: set[str]) -> list[str]:
+    aliases = table_aliases(statement, tables)
+    scans = []
+    for *_, detail in conn.execute(f"EXPLAIN QUERY PLAN {statement}", params):
+        match = re.match(r"SCAN (\w+)", detail)
+        if match is None or "VIRTUAL TABLE" in detail:
+            continue
+        table = aliases.get(match[1])
+        if table is None or table in ALLOWED_SCANS:
+            continue
+        if table in INTENDED_SCANS and INTENDED_SCANS[table].search(statement):
+            continue
+        scans.append(detail)
+    return scans
+
+
+async def seed(account_tg_id: int):
+    """История трат общего счёта: свежие, прошлых месяцев и старше горизонта архива."""
+    from db.archive import ARCHIVE_AFTER_DAYS
+    from db.database import AsyncSessionLocal
+    from db.expenses import insert_expenses
+    from db.models import User
+
+    rng = random.Random(1)
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as session:
+        account_id = await session.scalar(select(User.account_id).where(User.tg_id == account_tg_id))
+        rows = [
+            dict(user_id=account_tg_id, account_id=account_id, amount=round(rng.uniform(10, 5000), 2),
+                 currency=rng.choice(["RUB", "USD", "EUR"]), category=rng.choice(["Еда", "Дом", "Транспорт"]),
+                 comment=rng.choice(["кофе", "обед", "такси", ""]),
+                 created_at=now - timedelta(days=rng.uniform(0, ARCHIVE_AFTER_DAYS + 400)))
+            for _ in range(500)
+        ]
+        await insert_expenses(session, rows)
+        await session.commit()
+
+
+async def test_no_full_table_scans(bot_app, chat, statements):
+    from archive import ArchiveJob
+    from db.budgets import reconcile_budgets
+    from db.database import ARCHIVE_DATABASE, AsyncSessionLocal, Base
+    from digest import DigestJob
+    from recurring import RecurringScheduler
+    from transfer import import_expenses
+
+    app, bot, dp = bot_app
+    owner, member = chat(5001, "Владелец"), chat(5002, "Участник")
+
+    await owner.send("/start")
+    await owner.send("Настройки")
+    created = await owner.send("Создать новый счет")
+    code, password = re.search(r"Код счёта: (\S+)\nПароль: (\S+)", created[0][1]["text"]).groups()
+    await seed(owner.tg_id)
+
+    await member.send("/start")
+    await member.send("Настройки")
+    await member.send("Подключиться к существующему счету")
+    await member.send(f"{code} {password}")
+
+    for text in ("/add", "150", "RUB", "Еда", "кофе с собой"):
+        await owner.send(text)
+    for period in ("1 день", "7 дней", "30 дней", "90 дней", "За весь период"):
+        await owner.send("/report")
+        await owner.send(period)
+    for text in ("/trends", "/trends 30", "/members", "/members 1000", "/last", "/history",
+                 "/search кофе", "/search кофе 30", "/base", "/base USD", "/budget", "/budget Еда 100 RUB",
+                 "/recurring", "/recurring день 10 RUB Еда кофе", "/digest", "/digest неделя", "/export",
+                 "Настройки", "Получить код и пароль счета"):
+        await owner.send(text)
+    for sent in reversed(owner.api["requests"]):
+        markup = sent[1].get("reply_markup", "")
+        if "history:" in markup:
+            break
+    older = re.search(r'"(history:1:[^"]+)"', markup)
+    if older:
+        await owner.press(older[1])
+    await owner.send("/search обед")
+    for sent in reversed(owner.api["requests"]):
+        more = re.search(r'"(search:1:[^"]+)"', sent[1].get("reply_markup", ""))
+        if more:
+            await owner.press(more[1])
+            break
+
+    await member.send("/members")
+    await member.send("Настройки")
+    await member.send("Покинуть текущий счет")
+    await member.send("/last")
+
+    # Фоновые задачи: рассылки, повторы, архив, сверка бюджетов, чистка FSM
+    await DigestJob(bot, window=0).run("week", datetime.utcnow() + timedelta(days=7))
+    await RecurringScheduler(clock=lambda: datetime.utcnow() + timedelta(days=3)).run_due()
+    await ArchiveJob(pause=0).run_pass()
+    async with AsyncSessionLocal() as session:
+        await reconcile_budgets(session)
+        await session.commit()
+        rows = iter([{"date": "2024-01-01", "amount": "10", "currency": "RUB", "category": "Еда", "comment": ""}])
+        await import_expenses(session, rows, owner.tg_id, None)
+    await dp.storage.expire()
+    await app.expense_writer.flush()
+
+    assert len(statements) > 50, "сценарий не дошёл до большинства запросов"
+    tables = {table.name for table in Base.metadata.sorted_tables}
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DATABASE,))
+    try:
+        problems = {
+            statement: scans
+            for statement, params in statements.items()
+            if (scans := full_scans(conn, statement, params, tables))
+        }
+    finally:
+        conn.close()
+    assert not problems, "\n\n".join(f"{' | '.join(scans)}\n{statement}" for statement, scans in problems.items())
@@ -0,0 +1,67 @@
+"""/recurring и планировщик повторяющихся трат на подменённых часах."""
+import os
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+# Столько правил прогоняет тест; полный прогон — RECURRING_TEST_RULES=100000
+RULES = int(os.getenv("RECURRING_TEST_RULES", "2000"))
+
+
+@pytest.mark.parametrize("amount", ["nan", "inf", "-5", "0"])
+async def test_bad_amount_is_rejected(chat, amount):
+    from db.database import AsyncSessionLocal
+    from db.models import RecurringExpense
+    from expense_writer import expense_writer
+    from sqlalchemy import func, select
+
+    user = chat(6201)
+    await user.send("/start")
+    answer = await user.send(f"/recurring месяц {amount} RUB Еда")
+
+    assert answer[0][1]["text"].startswith("Добавить: /recurring")
+    assert expense_writer.pending == 0
+    async with AsyncSessionLocal() as session:
+        assert not await session.scalar(
+            select(func.count()).select_from(RecurringExpense).where(RecurringExpense.user_id == 6201)
+        )
+
+
+async def test_scheduler_replays_rules(bot_app):
+    from sqlalchemy import func, insert, select
+
+    from bench.recurring import Clock, expected_runs
+    from constants import DEFAULT_CATEGORIES
+    from db.database import AsyncSessionLocal
+    from db.models import Expense, RecurringExpense, User
+    from recurring import RecurringScheduler
+
+    # Отдельные пользователи, чтобы не считать траты других тестов
+    users = range(700001, 700101)
+    clock = Clock(datetime(2024, 1, 15, 12, 0))
+    rng = random.Random(1)
+    rules = []
+    for i in range(RULES):
+        # Бот «лежал» неделю: часть повторов надо догнать при первом тике
+        start_at = clock.now - timedelta(days=rng.uniform(0, 7))
+        rules.append(dict(user_id=users[i % len(users)], amount=round(rng.uniform(100, 5000), 2), currency="RUB",
+                          category=rng.choice(DEFAULT_CATEGORIES), comment="",
+                          period=rng.choice(["day", "week", "month"]), start_at=start_at, next_run_at=start_at))
+    async with AsyncSessionLocal() as session:
+        await session.execute(insert(User), [dict(tg_id=tg_id) for tg_id in users])
+        await session.execute(insert(RecurringExpense), rules)
+        await session.commit()
+
+    scheduler = RecurringScheduler(clock=clock)
+    inserted = await scheduler.run_due()
+    end = clock.now + timedelta(days=35)
+    while clock.now < end:
+        clock.now += timedelta(hours=6)
+        inserted += await scheduler.run_due()
+
+    async with AsyncSessionLocal() as session:
+        stored = await session.scalar(select(func.count()).select_from(Expense).where(Expense.user_id.in_(users)))
+        await session.execute(RecurringExpense.__table__.delete().where(RecurringExpense.user_id.in_(users)))
+        await session.commit()
+    assert inserted == stored == expected_runs(rules, clock.now)
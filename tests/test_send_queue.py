@@ -0,0 +1,117 @@
+"""Очередь отправки (py/send_queue.py) против поддельного Bot API.
+
+Проверяется то, что видит Telegram: сколько запросов ушло, с каким текстом
+и как быстро.
+"""
+import asyncio
+import os
+import re
+import time
+
+import pytest
+
+from bench.e2e import BENCH_TOKEN
+from conftest import LOOP
+
+
+@pytest.fixture
+def make_bot(api):
+    """Отдельный бот со своей очередью, чтобы задавать ей лимиты."""
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    from send_queue import SendScheduler
+
+    bots = []
+
+    def make(**limits):
+        scheduler = SendScheduler(**limits)
+        session = AiohttpSession(api=TelegramAPIServer.from_base(os.environ["TELEGRAM_API_URL"]))
+        bot = Bot(token=BENCH_TOKEN, session=session)
+        bot.session.middleware(scheduler)
+        bots.append(bot)
+        return bot, scheduler
+
+    yield make
+    for bot in bots:
+        LOOP.run_until_complete(bot.session.close())
+
+
+def sent_to(api, chat_id: int, start: int = 0) -> list[dict]:
+    return [data for method, data in api["requests"][start:]
+            if method == "sendMessage" and int(data["chat_id"]) == chat_id]
+
+
+async def test_queued_texts_are_coalesced(api, make_bot):
+    bot, scheduler = make_bot(chat_rate=1, chat_burst=1)
+    results = await asyncio.gather(*(bot.send_message(7001, f"строка {i}") for i in range(5)))
+
+    sent = sent_to(api, 7001)
+    assert [data["text"] for data in sent] == ["\n\n".join(f"строка {i}" for i in range(5))]
+    assert len(results) == 5 and scheduler.coalesced == 4
+
+
+async def test_messages_with_entities_stay_alone(api, make_bot):
+    from aiogram.types import MessageEntity
+
+    bot, _ = make_bot(chat_rate=1, chat_burst=1)
+    code = "ABC123 secret"
+    await asyncio.gather(
+        bot.send_message(7002, "до"),
+        bot.send_message(7002, code, entities=[MessageEntity(type="code", offset=0, length=len(code))]),
+        bot.send_message(7002, "после"),
+    )
+    assert [data["text"] for data in sent_to(api, 7002)] == ["до", code, "после"]
+
+
+async def test_retry_after_is_respected(api, make_bot):
+    bot, scheduler = make_bot()
+    api["flood"].append(1)
+    started = time.perf_counter()
+    message = await bot.send_message(7003, "после флуда")
+
+    assert message.text == "после флуда"
+    assert [data["text"] for data in sent_to(api, 7003)] == ["после флуда"] * 2
+    assert scheduler.retried == 1
+    assert time.perf_counter() - started >= 1
+
+
+async def test_global_rate_limit(api, make_bot):
+    bot, scheduler = make_bot(global_rate=20)
+    started = time.perf_counter()
+    await asyncio.gather(*(bot.send_message(7100 + i, "привет") for i in range(11)))
+
+    # Первое сообщение уходит сразу, остальные десять — по одному в 1/20 с
+    assert time.perf_counter() - started >= 10 / 20 * 0.9
+    assert scheduler.sent == 11
+
+
+async def test_notice_goes_with_menu(chat):
+    user = chat(6003)
+    await user.send("/start")
+    answer = await user.send("/base USD")
+
+    assert len(answer) == 1
+    assert answer[0][1]["text"].startswith("Теперь отчеты будут в USD.\n\nВаши личные траты")
+
+
+async def test_credentials_can_be_forwarded(chat):
+    owner, member = chat(6001, "Владелец"), chat(6002, "Участник")
+    await owner.send("/start")
+    await owner.send("Настройки")
+    created = await owner.send("Создать новый счет")
+    code, password = re.search(r"Код счёта: (\S+)\nПароль: (\S+)", created[0][1]["text"]).groups()
+
+    await owner.send("Настройки")
+    answer = await owner.send("Получить код и пароль счета")
+    assert [method for method, _ in answer] == ["sendMessage", "sendMessage"]
+    credentials = answer[0][1]
+    assert credentials["text"] == f"{code} {password}" and "code" in credentials["entities"]
+    assert "сообщение выше" in answer[1][1]["text"]
+
+    await member.send("/start")
+    await member.send("Настройки")
+    await member.send("Подключиться к существующему счету")
+    joined = await member.send(credentials["text"])
+    assert joined[0][1]["text"].startswith("Вы успешно подключились к счёту!")
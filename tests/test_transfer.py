@@ -0,0 +1,46 @@
+"""Импорт трат из испорченных файлов: ошибки чтения не роняют хендлер."""
+import io
+
+import pytest
+
+
+def csv_file(*lines: str, encoding: str = "utf-8") -> io.BytesIO:
+    header = "created_at,amount,currency,category,comment\n"
+    return io.BytesIO((header + "".join(lines)).encode(encoding))
+
+
+async def run_import(fileobj, batch_size: int = 2):
+    from db.database import AsyncSessionLocal
+    from transfer import import_expenses, iter_import_rows
+
+    async with AsyncSessionLocal() as session:
+        return await import_expenses(session, iter_import_rows(fileobj, "expenses.csv"), 8001, None,
+                                     batch_size=batch_size)
+
+
+async def test_non_finite_amounts_are_rejected(bot_app):
+    fileobj = csv_file("2024-01-01,10,RUB,Еда,\n", "2024-01-01,nan,RUB,Еда,\n", "2024-01-01,-inf,RUB,Еда,\n")
+    imported, errors = await run_import(fileobj)
+
+    assert imported == 1
+    assert errors == ["строка 3: неверная сумма 'nan'", "строка 4: неверная сумма '-inf'"]
+
+
+async def test_unreadable_file_reports_progress(bot_app):
+    from transfer import ImportFileError
+
+    good = "2024-01-01,10,RUB,Еда,кофе\n" * 3000
+    fileobj = io.BytesIO(csv_file(good).getvalue() + "2024-01-01,10,RUB,Еда,чай\n".encode("cp1251"))
+    with pytest.raises(ImportFileError, match="UTF-8") as error:
+        await run_import(fileobj, batch_size=1000)
+
+    # Всё, что прочитано до сбоя, уже в базе, и это сказано пользователю
+    assert 0 < error.value.imported <= 3000
+    assert error.value.line == error.value.imported + 2
+
+
+async def test_broken_csv_is_an_import_error(bot_app):
+    from transfer import ImportFileError
+
+    with pytest.raises(ImportFileError, match="CSV"):
+        await run_import(csv_file('2024-01-01,10,RUB,Еда,"' + "x" * 200000 + '"\n'))